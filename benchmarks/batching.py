@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+import highfive
+import highfive.worker
+
+
+# Measures job throughput over loopback for a range of batching settings. Jobs
+# are empty so that the result is dominated by per-job protocol overhead.
+#
+#     python benchmarks/batching.py --jobs 50000 --workers 2
+
+
+SETTINGS = [
+    dict(prefetch=1, batch_size=1),
+    dict(prefetch=8, batch_size=1),
+    dict(prefetch=64, batch_size=1),
+    dict(prefetch=64, batch_size=16),
+    dict(prefetch=256, batch_size=64),
+]
+
+
+def echo(call):
+
+    return call
+
+
+async def measure(n_jobs, n_workers, port, executor, settings):
+
+    async with await highfive.start_master(port=port, **settings) as m:
+
+        processes = [multiprocessing.Process(
+                target=highfive.worker.worker_main,
+                args=(echo, "localhost", port),
+                kwargs=dict(executor=executor)) for _ in range(n_workers)]
+        for p in processes:
+            p.start()
+
+        try:
+            start = time.perf_counter()
+            async with m.run(range(n_jobs)) as js:
+                async for _ in js.results():
+                    pass
+            elapsed = time.perf_counter() - start
+        finally:
+            for p in processes:
+                p.terminate()
+                p.join()
+
+    return n_jobs / elapsed
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=48485)
+    parser.add_argument("--executor", default="inline",
+                        choices=["inline", "thread", "process"])
+    args = parser.parse_args()
+
+    for settings in SETTINGS:
+        rate = asyncio.run(measure(args.jobs, args.workers, args.port,
+                                   args.executor, settings))
+        print("prefetch={prefetch:<4} batch_size={batch_size:<3}".format(
+                **settings), "{:>10.0f} jobs/sec".format(rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+import highfive
+import highfive.worker
+
+
+# End-to-end benchmark of a master and local workers over loopback. Every
+# combination of payload size, worker count and job set size is run against a
+# fresh master, and the results are written as JSON so they can be compared
+# over time. Each job's call is a payload of the given size, which the workers
+# echo back with the raw codec.
+#
+#     python benchmarks/end_to_end.py --payloads 0,1024 --workers 1,8,64 \
+#         --jobs 10000,1000000 --output results.json
+#
+# Workers are connections, which are spread across up to --processes local
+# processes, so hundreds of workers don't need hundreds of processes. For
+# each run, the JSON reports:
+#
+# - jobs_per_second: jobs completed per second of wall time
+# - latency: exact p50, p99 and mean seconds from a call being sent by the
+#   master to its response being received, unless --no-latency is given
+# - master_cpu_per_job: CPU seconds used by the master process per job
+# - memory: the master's resident set size before and after the run
+#
+# Latency is recorded by a tracing hook, which costs the master CPU and
+# memory, so it is measured in a second run against a fresh master. The other
+# figures come from a run without hooks.
+#
+# Runs whose payloads would move more than --max-volume bytes each way are
+# skipped, and are listed with the reason.
+
+
+def echo(call):
+
+    return call
+
+
+def run_workers(n_connections, port, executor):
+    """
+    Runs several worker connections in one process, until they are
+    disconnected.
+    """
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(highfive.worker.handle_jobs(
+                echo, "localhost", port, executor=executor, loop=loop)
+                for _ in range(n_connections)))
+
+    asyncio.run(run())
+
+
+class LatencyRecorder(highfive.Hooks):
+    """
+    Records the time from each call being sent to its response arriving.
+    """
+
+    def __init__(self):
+
+        self.latencies = []
+
+    def on_response(self, trace):
+
+        self.latencies.append(trace.received - trace.sent)
+
+
+def quantile(values, q):
+
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss():
+    """
+    Returns the resident set size of this process in bytes, or its peak if
+    the current size can't be read.
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def run_jobs(payload_bytes, n_workers, n_jobs, args, hooks):
+    """
+    Runs one job set against a fresh master and local workers. Returns the
+    elapsed seconds, the master's CPU seconds, its resident set size before
+    the master started and after the run, and the master's statistics.
+    """
+
+    rss_before = rss()
+
+    m = await highfive.start_master(port=args.port, codec="raw",
+                                    prefetch=args.prefetch,
+                                    batch_size=args.batch_size,
+                                    compression=args.compression,
+                                    hooks=hooks)
+    per_process = math.ceil(n_workers / min(n_workers, args.processes))
+    counts = [min(per_process, n_workers - i)
+              for i in range(0, n_workers, per_process)]
+    processes = [multiprocessing.Process(target=run_workers,
+                                         args=(n, args.port, args.executor))
+                 for n in counts]
+    for p in processes:
+        p.start()
+
+    try:
+        while m.stats()["capacity"] < n_workers:
+            await asyncio.sleep(0.01)
+
+        payload = bytes(payload_bytes)
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        async with m.run(itertools.repeat(payload, n_jobs),
+                         streaming=True) as js:
+            async for _ in js.results():
+                pass
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        rss_after = rss()
+        stats = m.stats()
+    finally:
+        m.close()
+        await m.wait_closed()
+        for p in processes:
+            p.terminate()
+            p.join()
+
+    return elapsed, cpu, rss_before, rss_after, stats
+
+
+async def measure(payload_bytes, n_workers, n_jobs, args):
+
+    elapsed, cpu, rss_before, rss_after, stats = await run_jobs(
+            payload_bytes, n_workers, n_jobs, args, hooks=[])
+
+    result = {
+        "payload_bytes": payload_bytes,
+        "workers": n_workers,
+        "jobs": n_jobs,
+        "elapsed": elapsed,
+        "bytes_in": stats["bytes_in"],
+        "bytes_out": stats["bytes_out"],
+        "jobs_per_second": n_jobs / elapsed,
+        "master_cpu_per_job": cpu / n_jobs,
+        "memory": {
+            "rss_before": rss_before,
+            "rss_after": rss_after,
+            "growth": rss_after - rss_before,
+        },
+    }
+    if not args.no_latency:
+        # tracing costs the master CPU and memory, so latency is measured in
+        # a run of its own
+        recorder = LatencyRecorder()
+        await run_jobs(payload_bytes, n_workers, n_jobs, args,
+                       hooks=[recorder])
+        latencies = sorted(recorder.latencies)
+        result["latency"] = {
+            "p50": quantile(latencies, 0.5),
+            "p99": quantile(latencies, 0.99),
+            "mean": sum(latencies) / len(latencies),
+        }
+    return result
+
+
+def int_list(text):
+
+    return [int(item) for item in text.split(",")]
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payloads", type=int_list, default=[0, 1024, 2 ** 20])
+    parser.add_argument("--workers", type=int_list, default=[1, 8, 64])
+    parser.add_argument("--jobs", type=int_list, default=[1000, 100000])
+    parser.add_argument("--prefetch", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--executor", default="inline",
+                        choices=["inline", "thread", "process"])
+    parser.add_argument("--processes", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--max-volume", type=int, default=2 ** 30)
+    parser.add_argument("--compression")
+    parser.add_argument("--no-latency", action="store_true")
+    parser.add_argument("--port", type=int, default=48486)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": multiprocessing.cpu_count(),
+        "settings": {
+            "prefetch": args.prefetch,
+            "batch_size": args.batch_size,
+            "executor": args.executor,
+            "processes": args.processes,
+            "compression": args.compression,
+            "latency": not args.no_latency,
+        },
+        "results": [],
+        "skipped": [],
+    }
+
+    for payload_bytes, n_workers, n_jobs in itertools.product(
+            args.payloads, args.workers, args.jobs):
+        run = dict(payload_bytes=payload_bytes, workers=n_workers, jobs=n_jobs)
+        if payload_bytes * n_jobs > args.max_volume:
+            report["skipped"].append(dict(run, reason="over max volume"))
+            continue
+        result = asyncio.run(measure(payload_bytes, n_workers, n_jobs, args))
+        report["results"].append(result)
+        print("payload={payload_bytes:<8} workers={workers:<4} "
+              "jobs={jobs:<8}".format(**run),
+              "{:>10.0f} jobs/sec".format(result["jobs_per_second"]),
+              "{:>8.1f} us cpu/job".format(
+                    result["master_cpu_per_job"] * 1e6),
+              file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
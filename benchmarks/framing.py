@@ -0,0 +1,114 @@
+import argparse
+import time
+
+import highfive.master as master
+import highfive.protocol as protocol
+
+
+# Micro-benchmark of WorkerProtocol.data_received. Two workloads are fed
+# directly into the protocol without a network: many small responses packed
+# into each chunk, and a single large response split across many chunks. An
+# implementation in the style of the original line framing, which copied the
+# rest of the buffer after every message, is included for comparison.
+#
+#     python benchmarks/framing.py
+
+
+class NullWorker:
+
+    def bytes_received(self, n):
+
+        pass
+
+    def frame_received(self, size, seconds=0):
+
+        pass
+
+    def response_received(self, call_id, response, timing=None):
+
+        pass
+
+
+class LegacyWorkerProtocol(master.WorkerProtocol):
+
+    def data_received(self, data):
+
+        self._buffer.extend(data)
+        while len(self._buffer) >= protocol.FRAME_PREFIX.size:
+            header_length, body_length = \
+                    protocol.FRAME_PREFIX.unpack_from(self._buffer)
+            body_start = protocol.FRAME_PREFIX.size + header_length
+            end = body_start + body_length
+            if len(self._buffer) < end:
+                break
+            header = self._buffer[protocol.FRAME_PREFIX.size:body_start]
+            body = memoryview(self._buffer[body_start:end])
+            self._buffer = self._buffer[end:]
+            self.frame_received(header, body)
+
+
+def make_protocol(cls):
+
+    p = cls(None, None, loop=None)
+    p._buffer = bytearray()
+    p._scan_start = 0
+    p._codec = protocol.get_codec("json")
+    p._worker = NullWorker()
+    return p
+
+
+def response_frame(response):
+
+    payload = protocol.get_codec("json").encode(response)
+    return b"".join(protocol.encode_frame(
+            {"responses": [[0, len(payload)]]}, [payload]))
+
+
+def chunked(data, chunk_size):
+
+    return [data[i:i+chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def many_frames(n_frames, chunk_size):
+
+    return chunked(response_frame("x" * 16) * n_frames, chunk_size)
+
+
+def one_large_frame(n_bytes, chunk_size):
+
+    return chunked(response_frame("x" * n_bytes), chunk_size)
+
+
+def run(cls, chunks):
+
+    protocol = make_protocol(cls)
+    start = time.perf_counter()
+    for chunk in chunks:
+        protocol.data_received(chunk)
+    return time.perf_counter() - start
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--large-bytes", type=int, default=16 * 2 ** 20)
+    parser.add_argument("--chunk-size", type=int, default=2 ** 16)
+    args = parser.parse_args()
+
+    workloads = [
+        ("{} small frames".format(args.frames),
+            many_frames(args.frames, 2 ** 20)),
+        ("one {} byte frame".format(args.large_bytes),
+            one_large_frame(args.large_bytes, args.chunk_size)),
+    ]
+
+    for name, chunks in workloads:
+        for cls in (master.WorkerProtocol, LegacyWorkerProtocol):
+            elapsed = run(cls, chunks)
+            print("{:<32} {:<22} {:>8.3f} s".format(
+                    name, cls.__name__, elapsed))
+
+
+if __name__ == "__main__":
+    main()
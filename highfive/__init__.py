@@ -1,4 +1,9 @@
 from .master import start_master
-from .jobs import Job
-from .worker import run_worker_pool
+from .jobs import Job, JobSource, IterableJobSource
+from .scheduling import FifoScheduler, FairScheduler
+from .cache import MemoryCache, SqliteCache, TieredCache
+from .tracing import Hooks, ChromeTrace
+from .shared import get_shared
+from .worker import run_worker, run_worker_pool
 
+from .relay import start_relay, run_relay
@@ -0,0 +1,211 @@
+import collections
+import hashlib
+import json
+import pickle
+import sqlite3
+import time
+
+from . import protocol
+
+
+def call_key(call):
+    """
+    Returns a hash of a call object, which identifies the call's response in
+    a result cache. Calls which are sent identically over the wire, such as a
+    list and a tuple with the same items, have the same key. Returns None if
+    the call can't be serialized.
+    """
+
+    h = hashlib.sha256()
+    if protocol.is_array(call):
+        payload, extras = protocol.encode_payload(None, call)
+        h.update(b"array:")
+        h.update(json.dumps(extras).encode("utf-8"))
+        h.update(payload)
+    elif isinstance(call, (bytes, bytearray, memoryview)):
+        h.update(b"raw:")
+        h.update(call)
+    else:
+        try:
+            encoded = json.dumps(call, sort_keys=True, separators=(",", ":"))
+        except (TypeError, ValueError):
+            try:
+                h.update(b"pickle:")
+                h.update(pickle.dumps(call, protocol=pickle.HIGHEST_PROTOCOL))
+            except Exception:
+                return None
+        else:
+            h.update(b"json:")
+            h.update(encoded.encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Interface for result caches, which map call keys to the responses that
+    workers returned for those calls.
+    """
+
+    def get(self, key):
+        """
+        Looks up a key. Returns a tuple of whether the key was found and the
+        cached response.
+        """
+
+        raise NotImplementedError
+
+    def put(self, key, response):
+        """
+        Stores the response for a key.
+        """
+
+        raise NotImplementedError
+
+
+class MemoryCache(ResultCache):
+    """
+    Keeps up to max_entries responses in memory, evicting the least recently
+    used response first. If ttl is given, responses expire ttl seconds after
+    they are stored. Cached responses are shared, not copied, so they should
+    not be modified.
+    """
+
+    def __init__(self, max_entries=1024, *, ttl=None):
+
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def get(self, key):
+
+        try:
+            response, stored = self._entries[key]
+        except KeyError:
+            return False, None
+
+        if self._ttl is not None and time.monotonic() - stored > self._ttl:
+            del self._entries[key]
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, response
+
+    def put(self, key, response):
+
+        self._entries[key] = (response, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+class SqliteCache(ResultCache):
+    """
+    Keeps responses in an SQLite database at the given path, so that they
+    survive restarts of the master. Responses are stored with pickle, so the
+    database must only be writable by trusted users. If max_entries is given,
+    the least recently used responses are evicted beyond that many. If ttl is
+    given, responses expire ttl seconds after they are stored.
+
+    The database is accessed synchronously on the event loop, with relaxed
+    durability, so a crash may lose the most recently stored responses.
+    """
+
+    def __init__(self, path, *, max_entries=None, ttl=None):
+
+        if max_entries is not None and max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+
+        self._max_entries = max_entries
+        self._ttl = ttl
+
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                         "key TEXT PRIMARY KEY, response BLOB NOT NULL, "
+                         "stored REAL NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_used "
+                         "ON results (used)")
+        self._count = self._db.execute(
+                "SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __len__(self):
+
+        return self._count
+
+    def get(self, key):
+
+        row = self._db.execute("SELECT response, stored FROM results "
+                               "WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+
+        now = time.time()
+        if self._ttl is not None and now - row[1] > self._ttl:
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._count -= 1
+            return False, None
+
+        self._db.execute("UPDATE results SET used = ? WHERE key = ?",
+                         (now, key))
+        return True, pickle.loads(row[0])
+
+    def put(self, key, response):
+
+        now = time.time()
+        data = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        cursor = self._db.execute("UPDATE results SET response = ?, "
+                                  "stored = ?, used = ? WHERE key = ?",
+                                  (data, now, now, key))
+        if cursor.rowcount == 0:
+            self._db.execute("INSERT INTO results VALUES (?, ?, ?, ?)",
+                             (key, data, now, now))
+            self._count += 1
+
+        if self._max_entries is not None and self._count > self._max_entries:
+            self._db.execute("DELETE FROM results WHERE key IN (SELECT key "
+                             "FROM results ORDER BY used LIMIT ?)",
+                             (self._count - self._max_entries,))
+            self._count = self._max_entries
+
+    def close(self):
+        """
+        Closes the database.
+        """
+
+        self._db.close()
+
+
+class TieredCache(ResultCache):
+    """
+    Combines several caches, such as a small MemoryCache in front of a large
+    SqliteCache. Lookups try each tier in order, and a response found in a
+    later tier is copied into the earlier tiers. Responses are stored in
+    every tier.
+    """
+
+    def __init__(self, *tiers):
+
+        self._tiers = tiers
+
+    def get(self, key):
+
+        for i, tier in enumerate(self._tiers):
+            found, response = tier.get(key)
+            if found:
+                for earlier in self._tiers[:i]:
+                    earlier.put(key, response)
+                return True, response
+        return False, None
+
+    def put(self, key, response):
+
+        for tier in self._tiers:
+            tier.put(key, response)
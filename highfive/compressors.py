@@ -0,0 +1,323 @@
+import collections
+import time
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import protocol
+
+
+class Compressor:
+    """
+    Interface for frame compressors. Compressors are negotiated per
+    connection, and are only applied to frames above a size threshold.
+    """
+
+    name = None
+
+    def compress(self, buffers):
+        """
+        Compresses the concatenation of a list of bytes-like objects,
+        returning bytes.
+        """
+
+        raise NotImplementedError
+
+    def decompress(self, data, limit):
+        """
+        Decompresses data, returning at most limit bytes of the original data
+        without decompressing the rest. Raises a ValueError if the data is
+        corrupt.
+        """
+
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    """
+    Compresses frames with zlib, from the standard library. The default
+    level favours speed, since frames are compressed as they are sent.
+    """
+
+    name = "zlib"
+
+    def __init__(self, level=1):
+
+        self._level = level
+
+    def compress(self, buffers):
+
+        compressor = zlib.compressobj(self._level)
+        parts = [compressor.compress(buffer) for buffer in buffers]
+        parts.append(compressor.flush())
+        return b"".join(parts)
+
+    def decompress(self, data, limit):
+
+        try:
+            return zlib.decompressobj().decompress(data, limit)
+        except zlib.error as e:
+            raise ValueError("corrupt zlib data") from e
+
+
+class Lz4Compressor(Compressor):
+    """
+    Compresses frames with LZ4, which is much faster than zlib for a somewhat
+    lower ratio. Requires the lz4 package.
+    """
+
+    name = "lz4"
+
+    def compress(self, buffers):
+
+        return lz4_frame.compress(b"".join(buffers))
+
+    def decompress(self, data, limit):
+
+        try:
+            return lz4_frame.LZ4FrameDecompressor().decompress(
+                    data, max_length=limit)
+        except RuntimeError as e:
+            raise ValueError("corrupt lz4 data") from e
+
+
+class ZstdCompressor(Compressor):
+    """
+    Compresses frames with Zstandard, which is faster than zlib for a better
+    ratio. Requires the zstandard package.
+    """
+
+    name = "zstd"
+
+    def compress(self, buffers):
+
+        return zstandard.ZstdCompressor().compress(b"".join(buffers))
+
+    def decompress(self, data, limit):
+
+        chunks = []
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                while limit > 0:
+                    chunk = reader.read(limit)
+                    if len(chunk) == 0:
+                        break
+                    chunks.append(chunk)
+                    limit -= len(chunk)
+        except zstandard.ZstdError as e:
+            raise ValueError("corrupt zstd data") from e
+        return b"".join(chunks)
+
+
+# Every compressor known by name, in the order a master prefers them by
+# default.
+ALL_COMPRESSORS = ("zstd", "lz4", "zlib")
+
+# Compressors which can be used in this process, since their packages are
+# installed.
+COMPRESSORS = {compressor.name: compressor for compressor in (
+        [ZlibCompressor()]
+        + ([Lz4Compressor()] if lz4_frame is not None else [])
+        + ([ZstdCompressor()] if zstandard is not None else []))}
+
+# Frames are only compressed if they hold at least this many bytes, unless
+# the master chooses otherwise.
+DEFAULT_THRESHOLD = 4096
+
+# Frames of at least this many bytes are compressed and decompressed on a
+# thread instead of on the event loop.
+OFFLOAD_BYTES = 2 ** 20
+
+# Compressed frames may not hold more than this many bytes, so that a corrupt
+# or hostile frame can't use up the receiver's memory. Larger frames are sent
+# uncompressed.
+MAX_FRAME_BYTES = 2 ** 30
+
+
+def check_names(names):
+    """
+    Raises a ValueError if any of the compressor names is unknown.
+    """
+
+    for name in names:
+        if name not in ALL_COMPRESSORS:
+            raise ValueError("unknown compressor: {}".format(name))
+
+
+def available():
+    """
+    Returns the names of the compressors which can be used in this process,
+    in the default order of preference.
+    """
+
+    return [name for name in ALL_COMPRESSORS if name in COMPRESSORS]
+
+
+def choose_compressor(preferred, accepted):
+    """
+    Chooses the first compressor in the preferred list of names which is
+    available in this process and also in the accepted list. Returns None if
+    there is no such compressor.
+    """
+
+    for name in preferred:
+        if name in accepted and name in COMPRESSORS:
+            return COMPRESSORS[name]
+    return None
+
+
+def get_compressor(name):
+    """
+    Gets an available compressor by name, raising a ValueError if it doesn't
+    exist or its package isn't installed.
+    """
+
+    try:
+        return COMPRESSORS[name]
+    except KeyError:
+        raise ValueError("unavailable compressor: {}".format(name)) from None
+
+
+def frame_size(frame):
+    """
+    Returns the number of bytes in a frame, given as the list of buffers
+    returned by protocol.encode_frame().
+    """
+
+    header_length, body_length = protocol.FRAME_PREFIX.unpack(frame[0])
+    return protocol.FRAME_PREFIX.size + header_length + body_length
+
+
+def compress_frame(compressor, frame, size):
+    """
+    Compresses a frame into a compressed frame, whose header holds the size
+    of the original frame and whose body is the compressed original frame.
+    """
+
+    return protocol.encode_frame({"compressed": size},
+                                 [compressor.compress(frame)])
+
+
+def decompress_frame(compressor, header, body):
+    """
+    Decompresses the body of a compressed frame, given its decoded header.
+    Returns a memoryview of the header and of the body of the original
+    frame. Raises a ValueError if the original frame is larger than
+    MAX_FRAME_BYTES, or isn't the size the header gives.
+    """
+
+    size = header["compressed"]
+    if (not isinstance(size, int) or size < protocol.FRAME_PREFIX.size
+            or size > MAX_FRAME_BYTES):
+        raise ValueError("bad compressed frame size: {!r}".format(size))
+    data = memoryview(compressor.decompress(body, size + 1))
+    if len(data) != size:
+        raise ValueError("compressed frame isn't the size it claims")
+    header_length, body_length = protocol.FRAME_PREFIX.unpack_from(data)
+    header_start = protocol.FRAME_PREFIX.size
+    body_start = header_start + header_length
+    if body_start + body_length != size:
+        raise ValueError("compressed frame isn't the size it claims")
+    return (data[header_start:body_start], data[body_start:])
+
+
+class FrameWriter:
+    """
+    Writes frames to a connection in order, compressing those of at least
+    threshold bytes and at most MAX_FRAME_BYTES with the connection's
+    compressor, if it has one. Frames
+    of at least offload_bytes are compressed on the loop's default executor,
+    and frames written after them wait until they have been sent. Frames
+    which don't get any smaller are sent uncompressed.
+
+    Each frame is passed to the write callback along with its size before
+    compression and the seconds spent compressing it.
+    """
+
+    def __init__(self, write, compressor=None, *, threshold=DEFAULT_THRESHOLD,
+            offload_bytes=OFFLOAD_BYTES, loop):
+
+        self._write = write
+        self._compressor = compressor
+        self._threshold = threshold
+        self._offload_bytes = offload_bytes
+        self._loop = loop
+
+        self._waiting = collections.deque()
+        self._closed = False
+
+    def _compress(self, frame, size):
+        """
+        Compresses a frame, returning the frame to send and the seconds
+        spent compressing it.
+        """
+
+        started = time.perf_counter()
+        compressed = compress_frame(self._compressor, frame, size)
+        if frame_size(compressed) >= size:
+            compressed = frame
+        return compressed, time.perf_counter() - started
+
+    def write(self, frame):
+        """
+        Writes a frame, given as the list of buffers returned by
+        protocol.encode_frame().
+        """
+
+        if self._closed:
+            return
+
+        size = frame_size(frame)
+        if (self._compressor is None or size < self._threshold
+                or size > MAX_FRAME_BYTES):
+            item = (frame, size, 0)
+        elif size < self._offload_bytes:
+            compressed, seconds = self._compress(frame, size)
+            item = (compressed, size, seconds)
+        else:
+            future = self._loop.run_in_executor(None, self._compress,
+                                                frame, size)
+            future.add_done_callback(self._compressed)
+            self._waiting.append((future, size, None))
+            return
+
+        if len(self._waiting) > 0:
+            self._waiting.append(item)
+        else:
+            self._write(*item)
+
+    def _compressed(self, future):
+        """
+        Called when a frame has been compressed on the executor. Sends the
+        frames which were waiting for it, up to the next frame which is still
+        being compressed. Waiting frames which are still being compressed
+        are held as a future in place of the frame, with seconds of None.
+        """
+
+        if self._closed:
+            return
+
+        while len(self._waiting) > 0:
+            frame, size, seconds = self._waiting[0]
+            if seconds is None:
+                if not frame.done():
+                    break
+                frame, seconds = frame.result()
+            self._waiting.popleft()
+            self._write(frame, size, seconds)
+
+    def close(self):
+        """
+        Drops frames which are waiting to be sent.
+        """
+
+        self._closed = True
+        self._waiting.clear()
@@ -1,5 +1,17 @@
+import asyncio
 import collections
+import functools
+import itertools
 import logging
+import operator
+import time
+import weakref
+
+from . import cache
+from . import metrics
+from . import reducers
+from . import scheduling
+from . import shared
 
 
 logger = logging.getLogger(__name__)
@@ -12,7 +24,11 @@ class Job:
 
     def get_call(self):
         """
-        Gets a JSON-serializable call object to send to a worker.
+        Gets a call object to send to a worker. The call object must be
+        encodable by the codec used for the worker's connection, so by default
+        it must be JSON-serializable. With the raw codec, it must be a
+        bytes-like object, which is sent without being copied. NumPy arrays
+        can be sent with any codec, as their raw buffer.
         """
 
         raise NotImplementedError
@@ -45,24 +61,143 @@ class DefaultJob(Job):
         return response
 
 
+class ChunkJob(Job):
+    """
+    A chunk of consecutive jobs from a job set, which is sent to a worker as
+    a single call. The call is the list of the jobs' calls, which the worker
+    runs one at a time, and the response is the list of their responses. The
+    result is the list of the jobs' results.
+
+    If the chunk has a reducer, given as its name and function, the worker
+    reduces the responses to a single partial result, which is the chunk's
+    response and result. The jobs' get_result() methods are not used.
+    """
+
+    def __init__(self, jobs, *, reducer=None):
+
+        self.jobs = jobs
+        self.started = time.monotonic()
+        self.reducer_name, self.reducer = (reducer if reducer is not None
+                                           else (None, None))
+
+    def __len__(self):
+
+        return len(self.jobs)
+
+    def get_call(self):
+
+        return [job.get_call() for job in self.jobs]
+
+    def get_result(self, response):
+
+        if self.reducer is not None:
+            return response
+        return [job.get_result(r) for job, r in zip(self.jobs, response)]
+
+    def reduce(self, responses):
+        """
+        Reduces a list of responses to the chunk's calls, for workers which
+        don't know the chunk's reducer.
+        """
+
+        return functools.reduce(self.reducer, responses)
+
+
+def job_count(job):
+    """
+    Returns the number of jobs a job stands for, which is more than one for
+    chunks.
+    """
+
+    return len(job) if isinstance(job, ChunkJob) else 1
+
+
+class JobSource:
+    """
+    Interface for job sources which produce jobs in chunks, such as a
+    database cursor. Chunks are fetched in an executor, so fetching may block.
+    """
+
+    def get_jobs(self, n):
+        """
+        Gets a list of up to n jobs. An empty list means there are no more
+        jobs. Items which are not Job objects are wrapped in DefaultJobs.
+        """
+
+        raise NotImplementedError
+
+
+class IterableJobSource(JobSource):
+    """
+    Job source which takes its jobs from a plain iterable, so that a blocking
+    generator can be read without blocking the event loop.
+    """
+
+    def __init__(self, iterable):
+
+        self._jobs = iter(iterable)
+
+    def get_jobs(self, n):
+
+        return list(itertools.islice(self._jobs, n))
+
+
 class Results:
     """
-    A set of job results from a single job set.
+    A set of job results from a single job set, in the order the jobs
+    completed. The submission index of each result's job is kept alongside it.
+
+    Every iterator over the results is registered as a consumer. In streaming
+    mode, results are dropped once every registered consumer has passed them,
+    so only results which are still waiting to be consumed are kept in
+    memory. Until a consumer is registered, all results are kept. Indexing a
+    dropped result raises an IndexError, and iterators created later start at
+    the oldest result which is still kept.
+
+    If high_water is given, the results are full while at least that many
+    results have not yet been passed by every consumer. The job set stops
+    handing out new jobs while its results are full, and on_drain is called
+    when they stop being full.
     """
 
-    def __init__(self, *, loop):
+    def __init__(self, *, streaming=False, high_water=None, on_drain=None,
+            loop):
         self._loop = loop
-        self._results = []
+        self._streaming = streaming
+        self._results = collections.deque() if streaming else []
+        self._indices = collections.deque() if streaming else []
+        self._offset = 0
         self._complete = False
         self._waiters = []
 
+        self._consumers = weakref.WeakSet()
+        self._high_water = high_water
+        self._on_drain = on_drain
+        self._full = False
+
     def __len__(self):
 
-        return len(self._results)
+        return self._offset + len(self._results)
 
     def __getitem__(self, i):
 
-        return self._results[i]
+        if i < 0:
+            i += len(self)
+        if i < self._offset:
+            raise IndexError("result has been dropped")
+        return self._results[i - self._offset]
+
+    def job_index(self, i):
+        """
+        Returns the submission index of the job which produced the ith
+        result.
+        """
+
+        if i < 0:
+            i += len(self)
+        if i < self._offset:
+            raise IndexError("result has been dropped")
+        return self._indices[i - self._offset]
 
     def _change(self):
         """
@@ -75,21 +210,102 @@ class Results:
                 waiter.set_result(None)
         self._waiters = []
 
-    def aiter(self): # not __aiter__ because we don't want an async function
+    # not __aiter__ because we don't want an async function
+    def aiter(self, *, ordered=False, indexed=False):
+        """
+        Returns an async iterator over the results. By default, results are
+        returned in the order they were added. If ordered is True, they are
+        returned in the order their jobs were submitted instead. If indexed is
+        True, (index, result) pairs are returned, where index is the
+        submission index of the result's job.
+
+        Ordered iterators can't skip results which were dropped in streaming
+        mode without knowing which ones they were, so a ValueError is raised
+        if ordered is True and any results have already been dropped.
+        """
+
+        if ordered:
+            if self._offset > 0:
+                raise ValueError("results have already been dropped, so they "
+                                 "can't be returned in order")
+            return OrderedResultsIterator(self, indexed=indexed)
+        return ResultsIterator(self, indexed=indexed)
+
+    def first_index(self):
+        """
+        Returns the index of the oldest result which is still kept.
+        """
+
+        return self._offset
+
+    def register(self, consumer):
+        """
+        Registers a consumer, which must have a position() method returning
+        the index of the next result it will consume.
+        """
+
+        self._consumers.add(consumer)
+
+    def unregister(self, consumer):
+        """
+        Unregisters a consumer which will not consume any more results.
+        """
+
+        self._consumers.discard(consumer)
+        self.consumer_advanced()
+
+    def _consumed(self):
+        """
+        Returns the index of the first result which has not been passed by
+        every registered consumer.
+        """
+
+        if len(self._consumers) == 0:
+            return self._offset
+        return min(consumer.position() for consumer in self._consumers)
+
+    def is_full(self):
         """
-        Returns an async iterator over the results.
+        Returns True if at least high_water results are waiting to be
+        consumed, and False otherwise.
         """
 
-        return ResultsIterator(self)
+        return (self._high_water is not None
+                and len(self) - self._consumed() >= self._high_water)
+
+    def consumer_advanced(self):
+        """
+        Called when a consumer has moved past a result. In streaming mode,
+        results passed by every consumer are dropped. If the results stop
+        being full, on_drain is called.
+        """
+
+        if self._streaming and len(self._consumers) > 0:
+            consumed = self._consumed()
+            while self._offset < consumed:
+                self._results.popleft()
+                self._indices.popleft()
+                self._offset += 1
+
+        if self._full and not self.is_full():
+            self._full = False
+            if self._on_drain is not None:
+                self._on_drain()
 
-    def add(self, result):
+    def add(self, result, index=None):
         """
-        Adds a new result.
+        Adds a new result, given the submission index of its job. By default,
+        the index is the number of results added before it.
         """
 
         assert not self._complete
 
+        if index is None:
+            index = len(self)
         self._results.append(result)
+        self._indices.append(index)
+        if self.is_full():
+            self._full = True
         self._change()
 
     def complete(self):
@@ -124,22 +340,115 @@ class Results:
             await waiter
 
 
+class Reduction:
+    """
+    The result of a map/reduce job set. Partial results are combined with
+    the reducer function as they arrive, so individual results are never
+    stored. Partial results may arrive in any order, so the reducer must be
+    associative and commutative.
+    """
+
+    def __init__(self, reducer, *, initial=reducers.NO_INITIAL, loop):
+
+        self._reducer = reducer
+        self._value = initial
+        self._count = 0
+        self._complete = False
+        self._waiters = []
+        self._loop = loop
+
+    def __len__(self):
+
+        return self._count
+
+    def add(self, result, index=None):
+        """
+        Combines a partial result into the reduction.
+        """
+
+        assert not self._complete
+
+        if self._value is reducers.NO_INITIAL:
+            self._value = result
+        else:
+            self._value = self._reducer(self._value, result)
+        self._count += 1
+
+    def is_full(self):
+        """
+        Returns False, since a reduction never holds back its job set.
+        """
+
+        return False
+
+    def complete(self):
+        """
+        Indicates that no more partial results will be added.
+        """
+
+        if self._complete:
+            return
+
+        self._complete = True
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters = []
+
+    def is_complete(self):
+        """
+        Returns whether the reduction has been completed.
+        """
+
+        return self._complete
+
+    def value(self):
+        """
+        Returns the reduction of the partial results added so far. Raises a
+        TypeError if there are none and there is no initial value.
+        """
+
+        if self._value is reducers.NO_INITIAL:
+            raise TypeError("reduction of no results with no initial value")
+        return self._value
+
+    async def wait_complete(self):
+        """
+        Waits until the reduction is complete.
+        """
+
+        if not self._complete:
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+
 class ResultsIterator:
     """
     Asynchronous iterator over a Results object. Results are found in the
     order they are added to the results. Getting the next result may block if
-    the next result is not known.
+    the next result is not known. The iterator is registered as a consumer of
+    the results until it is exhausted.
     """
 
-    def __init__(self, results):
+    def __init__(self, results, *, indexed=False):
 
         self._results = results
-        self._i = 0
+        self._indexed = indexed
+        self._i = results.first_index()
+        self._results.register(self)
 
-    async def __aiter__(self):
+    def __aiter__(self):
 
         return self
 
+    def position(self):
+        """
+        Returns the index of the next result the iterator will return.
+        """
+
+        return self._i
+
     async def __anext__(self):
 
         if self._i >= len(self._results):
@@ -150,17 +459,83 @@ class ResultsIterator:
             # this is the permanent end, otherwise a new result is available.
 
             if self._results.is_complete():
+                self._results.unregister(self)
                 raise StopAsyncIteration
             else:
                 await self._results.wait_changed()
                 if self._i >= len(self._results):
                     # no new results, change must be results completion
+                    self._results.unregister(self)
                     raise StopAsyncIteration
 
         # At this point, the ith result is available
 
         result = self._results[self._i]
+        if self._indexed:
+            result = (self._results.job_index(self._i), result)
         self._i += 1
+        self._results.consumer_advanced()
+        return result
+
+
+class OrderedResultsIterator:
+    """
+    Asynchronous iterator over a Results object which returns results in the
+    order their jobs were submitted. Results which arrive early wait in a
+    reorder buffer, which only holds their positions in the Results object.
+    The iterator's consumer position stays at the oldest buffered result, so
+    buffered results count towards the high-water mark of the results, which
+    bounds the size of the buffer.
+
+    If a result never arrives, for example because the job set was cancelled,
+    the iterator skips to the next buffered result once the results are
+    complete.
+    """
+
+    def __init__(self, results, *, indexed=False):
+
+        self._results = results
+        self._indexed = indexed
+        self._scan = results.first_index()
+        self._next_index = 0
+        self._buffer = collections.OrderedDict()
+        self._results.register(self)
+
+    def __aiter__(self):
+
+        return self
+
+    def position(self):
+        """
+        Returns the position of the oldest result which the iterator has not
+        returned yet.
+        """
+
+        for position in self._buffer.values():
+            return position
+        return self._scan
+
+    async def __anext__(self):
+
+        while self._next_index not in self._buffer:
+            if self._scan < len(self._results):
+                index = self._results.job_index(self._scan)
+                self._buffer[index] = self._scan
+                self._scan += 1
+            elif not self._results.is_complete():
+                await self._results.wait_changed()
+            elif len(self._buffer) > 0:
+                self._next_index = min(self._buffer)
+            else:
+                self._results.unregister(self)
+                raise StopAsyncIteration
+
+        index = self._next_index
+        result = self._results[self._buffer.pop(index)]
+        self._next_index += 1
+        self._results.consumer_advanced()
+        if self._indexed:
+            return index, result
         return result
 
 
@@ -175,7 +550,8 @@ class JobSetHandle:
         self._js = js
         self._results = results
 
-        self._internal_results_iter = self._results.aiter()
+        # created on first use, since it holds on to every result until then
+        self._internal_results_iter = None
 
     async def __aenter__(self):
 
@@ -192,12 +568,28 @@ class JobSetHandle:
 
         self._js.cancel()
 
-    def results(self):
+    def results(self, *, ordered=False, indexed=False):
         """
         Returns an asynchronous iterator over the all of the job set's results.
+        In streaming mode, the iterator starts at the oldest result which has
+        not been dropped yet. Results are returned as they complete, unless
+        ordered is True, in which case they are returned in the order their
+        jobs were submitted. If indexed is True, (index, result) pairs are
+        returned, where index is the position of the result's job in the job
+        list. In streaming mode, ordered iterators must be created before any
+        result is dropped, or a ValueError is raised.
+        """
+
+        return self._results.aiter(ordered=ordered, indexed=indexed)
+
+    def set_shared(self, keys):
+        """
+        Changes the keys of the shared objects the job set's calls use, for
+        long-running job sets whose calls come to need other objects. Calls
+        which were already sent are not affected.
         """
 
-        return self._results.aiter()
+        self._js.set_shared(keys)
 
     async def next_result(self):
         """
@@ -207,46 +599,245 @@ class JobSetHandle:
         return an iterator over all results, not all remaining results.
         """
 
+        if self._internal_results_iter is None:
+            self._internal_results_iter = self._results.aiter()
         return await self._internal_results_iter.__anext__()
 
 
+class ReductionHandle:
+    """
+    A handle to a map/reduce job set, which is used to get its result or to
+    cancel it.
+    """
+
+    def __init__(self, js, reduction):
+
+        self._js = js
+        self._reduction = reduction
+
+    async def __aenter__(self):
+
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+
+        self.cancel()
+
+    def cancel(self):
+        """
+        Cancels the job set.
+        """
+
+        self._js.cancel()
+
+    def partial_result(self):
+        """
+        Returns the reduction of the results which have arrived so far.
+        """
+
+        return self._reduction.value()
+
+    async def result(self):
+        """
+        Waits for the job set to finish, then returns the reduction of all of
+        its results. Raises asyncio.CancelledError if the job set was
+        cancelled.
+        """
+
+        await self._reduction.wait_complete()
+        if self._js.is_cancelled():
+            raise asyncio.CancelledError("job set was cancelled")
+        return self._reduction.value()
+
+
 class JobSet:
     """
     A set of jobs to be distributed across the workers. The job set contains
     the state of the execution of the job set, but is controlled by a job
     manager.
+
+    Jobs are taken from a plain iterable one at a time, as they are needed.
+    Async iterables and JobSource objects are instead read by a task, which
+    keeps enough jobs loaded ahead to meet the manager's current demand, so
+    slow sources don't block the event loop. JobSource chunks are fetched in
+    the event loop's default executor.
+
+    If a journal is given, results are recorded in it under the job set's
+    name. Restored results from an earlier run of the same job set, keyed by
+    submission index, are added to the results straight away, and their jobs
+    are skipped when they are loaded.
+
+    If chunk_duration is given, fresh jobs are handed out in ChunkJobs of
+    consecutive jobs, sized to take about chunk_duration seconds each from
+    being handed out to their results arriving, going by a moving average of
+    the time per job in earlier chunks. Chunks are also kept to at most the
+    remaining jobs divided by the workers' slots, if the number of remaining
+    jobs is known, so they shrink as the job set nears completion (guided
+    self-scheduling). The first chunks hold one job each, until a time has
+    been measured. Chunk results are added to the results one job at a time.
+
+    If a reducer is given, as its name and function, the job set is always
+    chunked, each chunk is reduced by the worker, and each chunk's partial
+    result is added to the results, which must be a Reduction.
     """
 
-    def __init__(self, jobs, results, manager, *, loop):
+    # weight of the newest chunk in the moving average of the time per job
+    CHUNK_SMOOTHING = 0.25
+
+    def __init__(self, jobs, results, manager, *, job_timeout=None,
+            journal=None, name=None, restored=None, chunk_duration=None,
+            reducer=None, shared=(), loop):
         self._loop = loop
-        self._jobs = iter(jobs)
+        self._job_timeout = job_timeout
+        self._shared = shared
+        self._chunk_duration = chunk_duration
+        self._reducer = reducer
+        self._cancelled = False
+        self._job_seconds = None
+        self._loaded = collections.deque()
         self._return_queue = collections.deque()
         self._active_jobs = 0
         self._results = results
         self._manager = manager
 
+        self._job_indices = dict()
+        self._next_index = 0
+
+        self._journal = journal
+        self._name = name
+        self._skipped = set()
+        if restored is not None:
+            for index, result in sorted(restored.items()):
+                self._results.add(result, index)
+            self._skipped.update(restored)
+
         self._waiters = []
 
-        self._load_job()
+        self._jobs = None
+        self._source = None
+        self._source_task = None
+        self._wanted = None
 
-        if self._active_jobs == 0:
-            self._done()
+        if isinstance(jobs, JobSource):
+            self._source = jobs
+        elif hasattr(jobs, "__aiter__"):
+            self._source = jobs.__aiter__()
+        else:
+            self._jobs = iter(jobs)
+
+        if self._source is not None:
+            self._source_task = self._loop.create_task(self._read_source())
+        else:
+            self._load_job()
+            if self._active_jobs == 0:
+                self._done()
+
+    def _add_loaded(self, job):
+        """
+        Queues a newly loaded job and increments the active job count. If the
+        job's result was restored from the journal, the job is skipped and
+        False is returned.
+        """
+
+        index = self._next_index
+        self._next_index += 1
+        if index in self._skipped:
+            self._skipped.discard(index)
+            return False
+
+        if not isinstance(job, Job):
+            job = DefaultJob(job)
+        self._job_indices[job] = index
+        self._loaded.append(job)
+        self._active_jobs += 1
+        return True
 
     def _load_job(self):
         """
         If there is still a job in the job iterator, loads it and increments
-        the active job count.
+        the active job count. Jobs with restored results are skipped.
+        """
+
+        for next_job in self._jobs:
+            if self._add_loaded(next_job):
+                break
+
+    def _readahead(self):
+        """
+        Returns the number of jobs to keep loaded from an asynchronous source,
+        which is enough for a chunk per job wanted when chunking.
+        """
+
+        return max(1, self._manager.demand()) * self._chunk_target()
+
+    def _chunk_target(self):
         """
+        Returns the number of jobs expected to take chunk_duration seconds,
+        or 1 if the job set isn't chunked or no time has been measured yet.
+        """
+
+        if self._chunk_duration is None or self._job_seconds is None:
+            return 1
+        if self._job_seconds <= 0:
+            return max(1, self._active_jobs)
+        return max(1, int(self._chunk_duration / self._job_seconds))
+
+    def chunk_size(self):
+        """
+        Returns the number of jobs to put in the next chunk.
+        """
+
+        n = self._chunk_target()
+        remaining = self.remaining()
+        capacity = self._manager.capacity()
+        if remaining is not None and capacity > 0:
+            n = min(n, max(1, -(-remaining // capacity)))
+        return n
+
+    async def _fetch(self, n):
+        """
+        Fetches up to n jobs from the asynchronous source. An empty list means
+        the source is exhausted.
+        """
+
+        if isinstance(self._source, JobSource):
+            return await self._loop.run_in_executor(None,
+                    self._source.get_jobs, n)
 
         try:
-            next_job = next(self._jobs)
-        except StopIteration:
-            self._on_deck = None
-        else:
-            if not isinstance(next_job, Job):
-                next_job = DefaultJob(next_job)
-            self._on_deck = next_job
-            self._active_jobs += 1
+            return [await self._source.__anext__()]
+        except StopAsyncIteration:
+            return []
+
+    async def _read_source(self):
+        """
+        Loads jobs from the asynchronous source until it is exhausted, waiting
+        whenever enough jobs are loaded. If the source fails, the job set is
+        cancelled.
+        """
+
+        try:
+            while True:
+                while len(self._loaded) >= self._readahead():
+                    self._wanted = self._loop.create_future()
+                    await self._wanted
+                new_jobs = await self._fetch(
+                        self._readahead() - len(self._loaded))
+                if len(new_jobs) == 0:
+                    break
+                for job in new_jobs:
+                    self._add_loaded(job)
+                self._manager.jobs_loaded(self)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("job source failed, cancelling job set")
+            self.cancel()
+            return
+
+        self._source_task = None
+        if self._active_jobs == 0:
+            self._done()
 
     def _done(self):
         """
@@ -259,76 +850,227 @@ class JobSet:
             waiter.set_result(None)
         self._manager.job_set_done(self)
 
+    def name(self):
+        """
+        Returns the name the job set's results are journaled under, or None.
+        """
+
+        return self._name
+
+    def job_timeout(self):
+        """
+        Returns the number of seconds a worker may hold one of the job set's
+        jobs before it is dropped, or None to use the job manager's default.
+        """
+
+        return self._job_timeout
+
+    def shared(self):
+        """
+        Returns the keys of the shared objects the job set's calls use.
+        """
+
+        return self._shared
+
+    def set_shared(self, keys):
+        """
+        Changes the keys of the shared objects the job set's calls use, for
+        calls sent from now on.
+        """
+
+        self._shared = self._manager.check_shared(keys)
+
     def job_available(self):
         """
         Returns True if there is a job queued which can be retrieved by a call
-        to get_job(), and False otherwise.
+        to get_job(), and False otherwise. While the job set is paused, only
+        returned jobs are available, since a result waiting to be consumed in
+        order may depend on one of them.
+        """
+
+        return (len(self._return_queue) > 0
+                or (len(self._loaded) > 0 and not self.is_paused()))
+
+    def returned_count(self):
+        """
+        Returns the number of returned jobs waiting to be run again.
+        """
+
+        return len(self._return_queue)
+
+    def remaining(self):
+        """
+        Returns the number of jobs which have not been handed out yet, or None
+        if that isn't known, such as for generators and asynchronous sources
+        which have not been exhausted.
+        """
+
+        if self._source_task is not None:
+            return None
+        n = sum(job_count(job) for job in self._return_queue)
+        n += len(self._loaded)
+        if self._jobs is not None:
+            hint = operator.length_hint(self._jobs, -1)
+            if hint < 0:
+                return None
+            n += hint
+        return n
+
+    def remaining_calls(self):
+        """
+        Returns the number of calls needed to run the jobs which have not been
+        handed out yet, or None if that isn't known. When chunking, this is
+        an estimate from the next chunk's size.
+        """
+
+        remaining = self.remaining()
+        if remaining is None or self._chunk_duration is None:
+            return remaining
+        return -(-remaining // self.chunk_size())
+
+    def is_paused(self):
+        """
+        Returns True if the job set's results are full, so no more jobs should
+        be handed out until they are consumed, and False otherwise.
+        """
+
+        return self._results.is_full()
+
+    def is_draining(self):
+        """
+        Returns True if every job has been handed out and the job set is only
+        waiting for running jobs to finish, and False otherwise.
+        """
+
+        return (not self.is_done() and len(self._return_queue) == 0
+                and len(self._loaded) == 0 and self._source_task is None
+                and not self.is_paused())
+
+    def is_cancelled(self):
+        """
+        Returns True if the job set was cancelled, and False otherwise.
         """
 
-        return len(self._return_queue) > 0 or self._on_deck is not None
+        return self._cancelled
 
     def is_done(self):
         """
         Returns True if the job set is complete, and False otherwise.
         """
 
-        return self._active_jobs == 0
+        return self._active_jobs == 0 and self._source_task is None
 
     def get_job(self):
         """
         Gets a job from the job set if one is queued. The jobs_available()
         method should be consulted first to determine if a job can be obtained
         from a call to this method. If no jobs are available, an IndexError is
-        raised.
+        raised. When chunking, fresh jobs are returned in a ChunkJob, and
+        returned chunks are handed out again whole.
         """
 
         if len(self._return_queue) > 0:
-            return self._return_queue.popleft()
-        elif self._on_deck is not None:
-            job = self._on_deck
-            self._load_job()
+            job = self._return_queue.popleft()
+            if isinstance(job, ChunkJob):
+                # the chunk's time per job is measured from when it is resent
+                job.started = time.monotonic()
             return job
+        elif len(self._loaded) > 0:
+            if self._chunk_duration is None:
+                return self._next_loaded()
+            n = self.chunk_size()
+            chunk = [self._next_loaded()]
+            while (len(chunk) < n and len(self._loaded) > 0
+                    and not self.is_paused()):
+                chunk.append(self._next_loaded())
+            return ChunkJob(chunk, reducer=self._reducer)
         else:
             raise IndexError("no jobs available")
 
+    def _next_loaded(self):
+        """
+        Takes the next loaded job, then loads another job or wakes the
+        source reader.
+        """
+
+        job = self._loaded.popleft()
+        if self._jobs is not None:
+            self._load_job()
+        elif self._wanted is not None and not self._wanted.done():
+            self._wanted.set_result(None)
+        return job
+
     def return_job(self, job):
         """
         Requeues an incomplete job to be run again later. If the job set is
         already complete, the job is simply discarded instead.
         """
 
-        if self._active_jobs == 0:
+        if self.is_done():
             return
 
         self._return_queue.append(job)
 
-    def add_result(self, result):
+    def add_result(self, result, *, job=None):
         """
         Adds the result of a completed job to the result list, then decrements
-        the active job count. If the job set is already complete, the result is
-        simply discarded instead.
+        the active job count. If the job is given, its submission index is
+        recorded with the result. The results of a chunk are added one at a
+        time, and the chunk's time per job is measured. If the job set is
+        already complete, the result is simply discarded instead.
         """
 
-        if self._active_jobs == 0:
+        if self.is_done():
             return
 
-        self._results.add(result)
-        self._active_jobs -= 1
-        if self._active_jobs == 0:
+        if isinstance(job, ChunkJob):
+            job_seconds = (time.monotonic() - job.started) / len(job)
+            if self._job_seconds is None:
+                self._job_seconds = job_seconds
+            else:
+                self._job_seconds += self.CHUNK_SMOOTHING * (
+                        job_seconds - self._job_seconds)
+            if job.reducer is not None:
+                for sub_job in job.jobs:
+                    self._job_indices.pop(sub_job, None)
+                self._results.add(result)
+                self._active_jobs -= len(job)
+            else:
+                for sub_job, sub_result in zip(job.jobs, result):
+                    self._add_result(sub_result, sub_job)
+        else:
+            self._add_result(result, job)
+        if self.is_done():
             self._done()
 
+    def _add_result(self, result, job):
+        """
+        Adds the result of a single job, recording it in the journal.
+        """
+
+        index = self._job_indices.pop(job, None)
+        self._results.add(result, index)
+        if self._journal is not None and index is not None:
+            self._journal.add_result(self._name, index, result)
+        self._active_jobs -= 1
+
     def cancel(self):
         """
         Cancels the job set. The job set is immediately finished, and all
         queued jobs are discarded.
         """
 
-        if self._active_jobs == 0:
+        if self.is_done():
             return
 
+        self._cancelled = True
+        if self._source_task is not None:
+            self._source_task.cancel()
+            self._source_task = None
         self._jobs = iter(())
-        self._on_deck = None
+        self._loaded.clear()
         self._return_queue.clear()
+        self._job_indices.clear()
         self._active_jobs = 0
 
         self._done()
@@ -339,122 +1081,648 @@ class JobSet:
         is already finished.
         """
         
-        if self._active_jobs > 0:
+        if not self.is_done():
             future = self._loop.create_future()
             self._waiters.append(future)
             await future
 
 
 class JobManager:
+    """
+    Hands out jobs from job sets to workers and collects their results. Each
+    call to get_job() stands for one slot of worker capacity waiting for a
+    job, so a worker which can run several jobs at once asks for several jobs.
+    Workers also register their capacity with the manager, so the total number
+    of slots across all workers is known. The scheduler decides which job set
+    each job is taken from, and defaults to running job sets one at a time.
+
+    With speculative execution, idle workers are given duplicates of running
+    jobs from job sets which have no fresh jobs left, so that a single slow
+    worker does not hold up the end of a job set. The first copy to finish
+    provides the result, and the other copy's result is ignored.
+
+    With a result cache, each job's call is looked up in the cache before the
+    job is handed out, and cached responses go straight to the job's results
+    without using a worker. A job whose call is identical to the call of a
+    job which is already running waits for that job's response instead of
+    running again.
+
+    With a journal, the results of named job sets are recorded, and a job set
+    added with the name of an earlier job set skips the jobs which already
+    have results in the journal. The manager closes the journal when it is
+    closed.
+
+    Workers may report their measured speed with set_worker_speed(). Near the
+    end of a job set whose size is known, a job is then held back from a slow
+    worker if the other workers would finish it and every other remaining
+    job sooner, so the last jobs go to fast workers rather than holding up
+    the job set on a slow one.
+    """
 
-    def __init__(self, *, loop):
+    def __init__(self, *, scheduler=None, speculative=False, job_timeout=None,
+            cache=None, journal=None, loop):
 
         self._loop = loop
-        self._active_js = None
+        self._job_timeout = job_timeout
+        self._scheduler = (scheduler if scheduler is not None
+                           else scheduling.FifoScheduler())
+        self._speculative = speculative
+        self._cache = cache
+        self._journal = journal
+        self._names = set()
+        self._job_keys = dict()
+        self._inflight = dict()
+        self._followers = dict()
         self._job_sources = dict()
+        self._job_workers = dict()
         self._ready_callbacks = collections.deque()
-        self._js_queue = collections.deque()
+        self._capacity = 0
+        self._shared = shared.SharedObjects()
+        self._speeds = dict()
+        self._total_throughput = 0
         self._closed = False
 
+        self._metrics = metrics.Metrics()
+
+    def _dispatch(self, job, js, callback, worker):
+        """
+        Hands a job to a get_job callback, recording which job set the job
+        came from and which worker is running it.
+        """
+
+        self._metrics.dispatched += job_count(job)
+        self._job_sources[job] = js
+        self._job_workers.setdefault(job, []).append(worker)
+        callback(job)
+
+    def _find_speculative_job(self, worker):
+        """
+        Finds a running job to duplicate onto the given worker, or returns
+        None. Only jobs from job sets with no fresh jobs left are duplicated,
+        oldest first, and each job runs at most twice at once. A worker is
+        never given a second copy of a job it is already running.
+
+        Jobs are keyed by identity in _job_sources, so both copies of a job
+        share one entry there. _job_workers lists the worker running each
+        copy.
+        """
+
+        for job, js in self._job_sources.items():
+            workers = self._job_workers[job]
+            if (len(workers) == 1 and workers[0] is not worker
+                    and js.is_draining()):
+                return job, js
+        return None
+
     def _distribute_jobs(self):
         """
-        Distributes jobs from the active job set to any waiting get_job
-        callbacks.
+        Distributes jobs from the scheduled job sets to any waiting get_job
+        callbacks. If speculative execution is enabled, callbacks left waiting
+        are given duplicates of running jobs.
+        """
+
+        while len(self._ready_callbacks) > 0 or self._cache is not None:
+            js = self._scheduler.next_job_set()
+            if js is None:
+                break
+            job = js.get_job()
+            if self._cache is not None and not self._needs_worker(job, js):
+                continue
+            i = self._choose_callback(js)
+            if i is None:
+                # only looking for cache hits, or the job is being held back
+                # for a faster worker, so put the job back
+                js.return_job(job)
+                break
+            callback, worker = self._ready_callbacks[i]
+            del self._ready_callbacks[i]
+            self._dispatch(job, js, callback, worker)
+
+        if self._speculative:
+            while len(self._ready_callbacks) > 0:
+                callback, worker = self._ready_callbacks[0]
+                found = self._find_speculative_job(worker)
+                if found is None:
+                    break
+                self._ready_callbacks.popleft()
+                job, js = found
+                logger.debug("speculatively duplicating job")
+                self._dispatch(job, js, callback, worker)
+
+    def _choose_callback(self, js):
+        """
+        Chooses which waiting get_job callback is given the job just taken
+        from a job set, returning its index in the queue, or None if every
+        waiting worker should be passed over. Callbacks are served in order
+        unless workers have reported their speed and the job set's size is
+        known. Then slow workers are passed over when the other workers would
+        finish all of the remaining jobs sooner, and if there are no more jobs
+        left than waiting callbacks, the fastest worker is chosen.
+        """
+
+        if len(self._ready_callbacks) == 0:
+            return None
+        if len(self._speeds) == 0:
+            return 0
+        remaining = js.remaining_calls()
+        if remaining is None:
+            return 0
+        # including the job just taken
+        remaining += 1
+
+        tail = remaining <= len(self._ready_callbacks)
+        best = None
+        best_seconds = None
+        for i, (_, worker) in enumerate(self._ready_callbacks):
+            speed = self._speeds.get(worker)
+            if speed is None:
+                if not tail:
+                    return i
+                if best is None:
+                    best = i
+                continue
+            if self._should_pass_over(speed, remaining):
+                continue
+            if not tail:
+                return i
+            if best_seconds is None or speed[1] < best_seconds:
+                best = i
+                best_seconds = speed[1]
+        return best
+
+    def _should_pass_over(self, speed, remaining):
+        """
+        Returns True if a worker with the given speed would take longer to
+        run one job than the other workers would take to finish the running
+        jobs and the remaining jobs between them.
         """
 
-        while (self._active_js.job_available()
-                and len(self._ready_callbacks) > 0):
-            job = self._active_js.get_job()
-            self._job_sources[job] = self._active_js
-            callback = self._ready_callbacks.popleft()
-            callback(job)
+        throughput, job_seconds = speed
+        others = self._total_throughput - throughput
+        if others <= 0:
+            return False
+        return job_seconds > (len(self._job_sources) + remaining) / others
+
+    def _needs_worker(self, job, js):
+        """
+        Checks the result cache before a job is handed out. Returns False if
+        the job was answered from the cache or is waiting for an identical
+        running job, and True if it must be run by a worker.
+        """
 
-    def add_job_set(self, job_list):
+        if isinstance(job, ChunkJob) and job.reducer is not None:
+            return True
+
+        key = self._job_keys.get(job)
+        if key is None:
+            key = cache.call_key(job.get_call())
+            if key is None:
+                return True
+
+        if key in self._inflight:
+            if self._inflight[key][0] is job:
+                return True
+            self._followers[key].append((job, js))
+            return False
+
+        found, response = self._cache.get(key)
+        if found:
+            self._metrics.cache_hits += job_count(job)
+            js.add_result(job.get_result(response), job=job)
+            return False
+
+        self._job_keys[job] = key
+        self._inflight[key] = (job, js)
+        self._followers[key] = []
+        return True
+
+    def _release_key(self, job):
         """
-        Adds a job set to the manager's queue. If there is no job set running,
-        it is activated immediately. A new job set handle is returned.
+        Forgets the cache key of a job which has completed. Returns the key,
+        or None if the job had none, along with the list of (job, job set)
+        pairs which were waiting for its response.
+        """
+
+        if self._cache is None:
+            return None, []
+
+        key = self._job_keys.pop(job, None)
+        if key is None or self._inflight.get(key, (None,))[0] is not job:
+            return None, []
+        del self._inflight[key]
+        return key, self._followers.pop(key)
+
+    def _promote_followers(self, js):
+        """
+        Called when a job set is done. Its running jobs will never produce
+        results, so each one's first waiting identical job from a job set
+        which is still running is requeued to run in its place.
+        """
+
+        for key, (job, job_js) in list(self._inflight.items()):
+            if job_js is not js:
+                continue
+            del self._inflight[key]
+            self._job_keys.pop(job, None)
+            followers = [(f_job, f_js)
+                         for f_job, f_js in self._followers.pop(key)
+                         if not f_js.is_done()]
+            if len(followers) > 0:
+                f_job, f_js = followers[0]
+                self._job_keys[f_job] = key
+                self._inflight[key] = (f_job, f_js)
+                self._followers[key] = followers[1:]
+                f_js.return_job(f_job)
+
+    def add_job_set(self, job_list, *, priority=0, weight=1,
+            job_timeout=None, streaming=False, high_water=None, name=None,
+            chunk_duration=None, shared=()):
+        """
+        Adds a job set to the manager's scheduler, and distributes its jobs if
+        the scheduler allows. The priority and weight are passed on to the
+        scheduler, and the job timeout overrides the manager's default job
+        timeout for the job set's jobs. Streaming and high_water configure the
+        job set's results, as described by Results. If the manager has a
+        journal and a name is given, the job set's results are journaled under
+        that name, and results already journaled under it are restored. If
+        chunk_duration is given, the job set's jobs are chunked as described
+        by JobSet. Shared lists the keys of the shared objects the job set's
+        calls use. A new job set handle is returned.
         """
 
         assert not self._closed
 
-        results = Results(loop=self._loop)
-        js = JobSet(job_list, results, self, loop=self._loop)
+        if high_water is not None and high_water < 1:
+            raise ValueError("high_water must be at least 1")
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        if chunk_duration is not None and chunk_duration <= 0:
+            raise ValueError("chunk_duration must be positive")
+        shared = self.check_shared(shared)
+
+        restored = None
+        if self._journal is not None and name is not None:
+            if name in self._names:
+                raise ValueError("job set {} is already running".format(name))
+            restored = self._journal.load(name)
+            if len(restored) > 0:
+                logger.info("restored {} results of job set {}".format(
+                        len(restored), name))
+            self._names.add(name)
+        else:
+            name = None
+
+        results = Results(streaming=streaming, high_water=high_water,
+                          on_drain=self._results_drained, loop=self._loop)
+        try:
+            js = JobSet(job_list, results, self, job_timeout=job_timeout,
+                        journal=self._journal if name is not None else None,
+                        name=name, restored=restored,
+                        chunk_duration=chunk_duration, shared=shared,
+                        loop=self._loop)
+            self._schedule(js, priority=priority, weight=weight)
+        except Exception:
+            # the name was reserved before the job set could be started, and
+            # is only released when a job set finishes
+            self._names.discard(name)
+            raise
+        return JobSetHandle(js, results)
+
+    def add_reduction(self, job_list, reducer, *,
+            initial=reducers.NO_INITIAL, priority=0, weight=1,
+            job_timeout=None, chunk_duration=0.1, shared=()):
+        """
+        Adds a map/reduce job set to the manager's scheduler. The jobs are run
+        in chunks, as described by JobSet, which the workers reduce with the
+        reducer before returning them, and the partial results are combined
+        into a Reduction. The reducer is the name of a built-in reducer or a
+        function, and is started with the initial value if one is given.
+        Shared lists the keys of the shared objects the job set's calls use. A
+        new reduction handle is returned.
+        """
+
+        assert not self._closed
+
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        if chunk_duration <= 0:
+            raise ValueError("chunk_duration must be positive")
+        shared = self.check_shared(shared)
+
+        name, function = reducers.resolve(reducer)
+        reduction = Reduction(function, initial=initial, loop=self._loop)
+        js = JobSet(job_list, reduction, self, job_timeout=job_timeout,
+                    chunk_duration=chunk_duration, reducer=(name, function),
+                    shared=shared, loop=self._loop)
+        self._schedule(js, priority=priority, weight=weight)
+        return ReductionHandle(js, reduction)
+
+    def forget(self, name):
+        """
+        Deletes the journaled results of a named job set, so that running it
+        again runs every job. Raises a ValueError if a job set with the name
+        is running.
+        """
+
+        if name in self._names:
+            raise ValueError("job set {} is running".format(name))
+        if self._journal is not None:
+            self._journal.forget(name)
+
+    def check_shared(self, keys):
+        """
+        Checks that a job set's shared object keys are known, returning them
+        as a tuple. Raises ValueError if any of them isn't shared.
+        """
+
+        keys = tuple(keys)
+        for key in keys:
+            if key not in self._shared:
+                raise ValueError("unknown shared object: {}".format(key))
+        return keys
+
+    def shared_objects(self):
+        """
+        Returns the SharedObjects shared with the workers.
+        """
+
+        return self._shared
+
+    def job_shared(self, job):
+        """
+        Returns the keys of the shared objects a running job's call uses.
+        """
+
+        js = self._job_sources.get(job)
+        return js.shared() if js is not None else ()
+
+    def _schedule(self, js, *, priority, weight):
+        """
+        Adds a new job set to the scheduler and distributes its jobs, unless
+        it has no jobs.
+        """
+
         if not js.is_done():
-            if self._active_js is None:
-                self._active_js = js
-                logger.debug("activated job set")
-                self._distribute_jobs()
-            else:
-                self._js_queue.append(js)
+            self._scheduler.add(js, priority=priority, weight=weight)
+            logger.debug("added job set")
+            self._distribute_jobs()
         else:
             logger.debug("new job set has no jobs")
-        return JobSetHandle(js, results)
 
-    def get_job(self, callback):
+    def demand(self):
+        """
+        Returns the number of jobs worth loading ahead from asynchronous job
+        sources, which is the larger of the total worker capacity and the
+        number of workers waiting for a job.
+        """
+
+        return max(self._capacity, len(self._ready_callbacks))
+
+    def jobs_loaded(self, js):
+        """
+        Called when an asynchronous job source has loaded new jobs into a job
+        set, so that they can be distributed.
+        """
+
+        if not self._closed:
+            self._distribute_jobs()
+
+    def _results_drained(self):
         """
-        Calls the given callback function when a job becomes available.
+        Called when a paused job set's results have been consumed, so that its
+        jobs can be distributed again.
+        """
+
+        if not self._closed:
+            self._distribute_jobs()
+
+    def get_job(self, callback, *, worker=None):
+        """
+        Calls the given callback function when a job becomes available. The
+        worker which will run the job may be given, so that speculative
+        execution never duplicates a job onto the worker already running it.
         """
 
         assert not self._closed
 
-        if self._active_js is None or not self._active_js.job_available():
-            self._ready_callbacks.append(callback)
+        self._ready_callbacks.append((callback, worker))
+        self._distribute_jobs()
+
+    def cancel_requests(self, worker):
+        """
+        Forgets the get_job callbacks still waiting on behalf of a worker, when
+        the worker disconnects, so that no jobs are handed to it.
+        """
+
+        self._ready_callbacks = collections.deque(
+                (callback, w) for callback, w in self._ready_callbacks
+                if w is not worker)
+
+    def job_timeout(self, job):
+        """
+        Returns the number of seconds a worker may hold a running job before
+        the worker is considered hung, or None if there is no limit. The
+        timeout applies to each of a chunk's jobs, so a chunk may be held for
+        that many times longer.
+        """
+
+        js = self._job_sources.get(job)
+        if js is not None and js.job_timeout() is not None:
+            timeout = js.job_timeout()
         else:
-            job = self._active_js.get_job()
-            self._job_sources[job] = self._active_js
-            callback(job)
+            timeout = self._job_timeout
+        if timeout is None:
+            return None
+        return timeout * job_count(job)
 
-    def return_job(self, job):
+    def add_capacity(self, slots):
+        """
+        Registers slots of worker capacity, when a worker connects.
+        """
+
+        self._capacity += slots
+
+    def remove_capacity(self, slots):
+        """
+        Unregisters slots of worker capacity, when a worker disconnects.
+        """
+
+        self._capacity -= slots
+
+    def capacity(self):
         """
-        Returns a job to its source job set to be run again later.
+        Returns the total number of slots across all connected workers.
+        """
+
+        return self._capacity
+
+    def set_worker_speed(self, worker, throughput, job_seconds):
+        """
+        Records a worker's measured speed: the number of jobs it completes per
+        second across all of its slots, and the number of seconds it takes to
+        run one job.
+        """
+
+        old = self._speeds.get(worker)
+        if old is not None:
+            self._total_throughput -= old[0]
+        self._speeds[worker] = (throughput, job_seconds)
+        self._total_throughput += throughput
+
+    def forget_worker_speed(self, worker):
+        """
+        Forgets the speed of a worker which has disconnected. Jobs held back
+        for it are distributed to the waiting workers.
+        """
+
+        if self._speeds.pop(worker, None) is None:
+            return
+        self._total_throughput = sum(t for t, _ in self._speeds.values())
+        if not self._closed:
+            self._distribute_jobs()
+
+    def return_job(self, job, *, worker=None):
+        """
+        Returns a job to its source job set to be run again later. If another
+        copy of the job is still running speculatively, or the job has already
+        been completed by another copy, the job is simply dropped instead.
         """
 
         if self._closed:
             return
 
-        js = self._job_sources[job]
-        if len(self._ready_callbacks) > 0:
-            callback = self._ready_callbacks.popleft()
-            callback(job)
+        if job not in self._job_sources:
+            return
+
+        self._metrics.returned += job_count(job)
+        workers = self._job_workers[job]
+        if worker in workers:
+            workers.remove(worker)
         else:
-            del self._job_sources[job]
-            js.return_job(job)
+            workers.pop()
+        if len(workers) > 0:
+            return
+
+        js = self._job_sources.pop(job)
+        del self._job_workers[job]
+        js.return_job(job)
+        self._distribute_jobs()
 
     def add_result(self, job, result):
         """
         Adds the result of a job to the results list of the job's source job
-        set.
+        set. Jobs waiting for the same call are given the same result. If the
+        job has already been completed by a speculative copy, the result is
+        discarded.
         """
 
         if self._closed:
             return
 
-        js = self._job_sources[job]
-        del self._job_sources[job]
-        js.add_result(result)
+        js = self._job_sources.pop(job, None)
+        if js is None:
+            return
+        del self._job_workers[job]
+        self._metrics.completed += job_count(job)
+
+        _, followers = self._release_key(job)
+        js.add_result(result, job=job)
+        for f_job, f_js in followers:
+            f_js.add_result(result, job=f_job)
+
+    def add_response(self, job, response):
+        """
+        Adds the result of a job given its worker's response. The response is
+        stored in the result cache, and jobs waiting for the same call are
+        given their own results from the response. Returns the job's result,
+        or None if the response was discarded.
+        """
+
+        if self._closed or job not in self._job_sources:
+            return None
+
+        key, followers = self._release_key(job)
+        if key is not None:
+            self._cache.put(key, response)
+
+        result = job.get_result(response)
+        self.add_result(job, result)
+        for f_job, f_js in followers:
+            f_js.add_result(f_job.get_result(response), job=f_job)
+        return result
 
     def job_set_done(self, js):
         """
-        Called when a job set has been completed or cancelled. If the job set
-        was active, the next incomplete job set is loaded from the job set
-        queue and is activated.
+        Called when a job set has been completed or cancelled. The job set is
+        removed from the scheduler, and jobs from the remaining job sets are
+        distributed to any waiting workers.
         """
 
         if self._closed:
             return
 
-        if self._active_js != js:
-            return
+        logger.debug("job set done")
+        self._scheduler.remove(js)
+        if js.name() is not None:
+            self._names.discard(js.name())
+            self._journal.flush()
+        if self._cache is not None:
+            self._promote_followers(js)
+        self._distribute_jobs()
 
-        try:
-            while self._active_js.is_done():
-                logger.debug("job set done")
-                self._active_js = self._js_queue.popleft()
-                logger.debug("activated job set")
-        except IndexError:
-            self._active_js = None
-        else:
-            self._distribute_jobs()
+    def metrics(self):
+        """
+        Returns the manager's Metrics object, which workers also update.
+        """
+
+        return self._metrics
+
+    def stats(self):
+        """
+        Returns a dict of statistics about the jobs handled by the manager.
+        """
+
+        m = self._metrics
+        job_sets = self._scheduler.job_sets()
+        latency = m.latency
+        dispatched_rate, completed_rate, returned_rate = m.rates()
+        return {
+            "uptime": time.monotonic() - m.started,
+            "jobs": {
+                "dispatched": m.dispatched,
+                "completed": m.completed,
+                "returned": m.returned,
+                "cache_hits": m.cache_hits,
+                "dispatched_per_second": dispatched_rate,
+                "completed_per_second": completed_rate,
+                "returned_per_second": returned_rate,
+            },
+            "latency": {
+                "count": latency.count,
+                "sum": latency.sum,
+                "mean": (latency.sum / latency.count if latency.count > 0
+                         else None),
+                "p50": latency.quantile(0.5),
+                "p90": latency.quantile(0.9),
+                "p99": latency.quantile(0.99),
+                "buckets": latency.buckets(),
+            },
+            "queues": {
+                "waiting_slots": len(self._ready_callbacks),
+                "returned_jobs": sum(js.returned_count() for js in job_sets),
+                "job_sets": len(job_sets),
+            },
+            "capacity": self._capacity,
+            "bytes_in": m.bytes_in,
+            "bytes_out": m.bytes_out,
+            "compression": {
+                "frame_bytes_in": m.frame_bytes_in,
+                "frame_bytes_out": m.frame_bytes_out,
+                "ratio_in": metrics.ratio(m.frame_bytes_in, m.bytes_in),
+                "ratio_out": metrics.ratio(m.frame_bytes_out, m.bytes_out),
+                "seconds": m.compression_seconds,
+            },
+        }
 
     def is_closed(self):
         """
@@ -473,8 +1741,8 @@ class JobManager:
             return
 
         self._closed = True
-        if self._active_js is not None:
-            self._active_js.cancel()
-        for js in self._js_queue:
+        for js in self._scheduler.job_sets():
             js.cancel()
+        if self._journal is not None:
+            self._journal.close()
 
@@ -0,0 +1,110 @@
+import logging
+import pickle
+import sqlite3
+
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    Write-ahead journal of completed job results, kept in an SQLite database
+    so that a restarted master can skip work which was already done. Results
+    are recorded under the name of their job set and the submission index of
+    their job, and are stored with pickle, so the database must only be
+    writable by trusted users.
+
+    Writes are batched: results are written in one transaction once
+    batch_size of them are waiting, or flush_interval seconds after the first
+    of them arrived, whichever comes first. A crash loses at most the results
+    which were waiting to be written.
+    """
+
+    def __init__(self, path, *, batch_size=1000, flush_interval=1, loop):
+
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._loop = loop
+
+        self._pending = []
+        self._flush_handle = None
+
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                         "job_set TEXT NOT NULL, job_index INTEGER NOT NULL, "
+                         "result BLOB NOT NULL, "
+                         "PRIMARY KEY (job_set, job_index))")
+
+    def add_result(self, name, index, result):
+        """
+        Queues the result of the job with the given submission index in the
+        named job set to be written.
+        """
+
+        self._pending.append((name, index, result))
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self._flush_interval,
+                                                       self.flush)
+
+    def flush(self):
+        """
+        Writes all queued results in a single transaction. Results which
+        can't be pickled are logged and left out.
+        """
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if len(self._pending) == 0:
+            return
+
+        rows = []
+        for name, index, result in self._pending:
+            try:
+                data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                logger.exception("could not journal result {} of job set "
+                                 "{}".format(index, name))
+                continue
+            rows.append((name, index, data))
+        self._pending = []
+
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO results "
+                                 "VALUES (?, ?, ?)", rows)
+
+    def load(self, name):
+        """
+        Returns a dict mapping submission indices to the results recorded for
+        the named job set.
+        """
+
+        self.flush()
+        cursor = self._db.execute("SELECT job_index, result FROM results "
+                                  "WHERE job_set = ?", (name,))
+        return {index: pickle.loads(data) for index, data in cursor}
+
+    def forget(self, name):
+        """
+        Deletes every result recorded for the named job set.
+        """
+
+        self.flush()
+        self._db.execute("DELETE FROM results WHERE job_set = ?", (name,))
+
+    def close(self):
+        """
+        Writes any queued results, then closes the database.
+        """
+
+        self.flush()
+        self._db.close()
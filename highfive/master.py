@@ -1,79 +1,402 @@
 import logging
-import json
 import asyncio
+import collections
+import math
+import time
 
+from . import compressors
 from . import jobs
+from . import metrics
+from . import protocol
+from . import reducers
+from . import tracing
+from .journal import Journal
 
 
 logger = logging.getLogger(__name__)
 
 
-async def start_master(host="", port=48484, *, loop=None):
+async def start_master(host="", port=48484, *, codec="json", prefetch=1,
+        batch_size=1, batch_bytes=65536, batch_delay=0, scheduler=None,
+        speculative=False, heartbeat_interval=5, heartbeat_timeout=30,
+        job_timeout=None, cache=None, journal=None, metrics_port=None,
+        hooks=(), adaptive=False, compression=None,
+        compression_threshold=compressors.DEFAULT_THRESHOLD, loop=None):
     """
     Starts a new HighFive master at the given host and port, and returns it.
+
+    The scheduler decides which job set each job is taken from when several
+    job sets are running. By default, a FifoScheduler runs job sets one at a
+    time. A FairScheduler shares the workers between job sets.
+
+    If speculative is True, workers which would otherwise sit idle near the
+    end of a job set are given duplicates of jobs which are still running
+    elsewhere, and whichever copy finishes first provides the result.
+
+    The codec parameter names the codec used to encode calls and responses, or
+    is a sequence of codec names in order of preference. Each worker is sent
+    the most preferred codec it accepts, and workers which accept none of them
+    are turned away.
+
+    Compression names the compressor used to compress frames, or is a
+    sequence of compressor names in order of preference: "zstd" and "lz4",
+    if their packages are installed, or "zlib". Each worker uses the most
+    preferred compressor which both sides have, or none. Only frames of at
+    least compression_threshold bytes are compressed, and large frames are
+    compressed on a thread so the event loop keeps running.
+
+    Each worker connection advertises a number of slots, which is how many
+    calls it can run at once. The prefetch parameter is the number of calls the
+    master keeps in flight per slot. Raising it hides the network round trip
+    between a worker finishing one job and receiving the next, at the cost of
+    jobs being committed to a worker before it is ready to run them.
+
+    Calls to the same worker are packed into a single frame of up to
+    batch_size calls or batch_bytes bytes of encoded calls, whichever is
+    reached first. A partial batch is sent after batch_delay seconds, or at
+    the end of the current event loop iteration if batch_delay is 0. Since a
+    batch can only hold calls which are in flight, batch_size is effectively
+    capped by the number of slots times prefetch.
+
+    If adaptive is True, each worker's throughput is measured as it returns
+    results, and prefetch and batch_size become upper limits. Each worker
+    keeps just enough calls in flight to stay busy across a round trip to
+    it, and sends as many calls per batch as it completes in a round trip,
+    so slow workers don't hoard prefetched jobs. The final jobs of a job set
+    are held back from slow workers if faster workers would finish them
+    sooner.
+
+    The master pings each worker every heartbeat_interval seconds, and drops
+    any worker it has heard nothing from for heartbeat_timeout seconds. If
+    job_timeout is given, a worker which has not responded to a call within
+    job_timeout seconds of it being sent is also dropped. Either may be None
+    to disable them. The jobs of a dropped worker are requeued. Job timeouts
+    include the time a call waits behind the worker's other prefetched calls,
+    and a chunk's timeout is job_timeout times its number of jobs.
+    Workers using the inline executor cannot answer pings while a job runs,
+    so heartbeat_timeout must be longer than their longest job.
+
+    If a result cache is given, such as a MemoryCache, responses are cached
+    by call, and jobs whose calls are in the cache never reach a worker.
+
+    If journal is the path of an SQLite database, the results of job sets run
+    with a name are written to it in batches. Running a job set with the same
+    name again, such as after the master is restarted, skips the jobs which
+    already have results in the journal.
+
+    If metrics_port is given, the master's statistics are served on that port
+    in the Prometheus text format. See Master.stats().
+
+    Hooks is a list of tracing.Hooks objects, such as a ChromeTrace, which are
+    told about each call to a worker as it progresses. While there are hooks,
+    workers also report how long each call was queued and how long it ran.
     """
 
+    codecs = (codec,) if isinstance(codec, str) else tuple(codec)
+    for name in codecs:
+        protocol.get_codec(name)
+    if compression is None:
+        compression = ()
+    elif isinstance(compression, str):
+        compression = (compression,)
+    compression = tuple(compression)
+    compressors.check_names(compression)
+    if prefetch < 1:
+        raise ValueError("prefetch must be at least 1")
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    if heartbeat_timeout is not None and heartbeat_interval is None:
+        raise ValueError("heartbeat_timeout requires heartbeat_interval")
+
     loop = loop if loop is not None else asyncio.get_event_loop()
 
-    manager = jobs.JobManager(loop=loop)
+    if journal is not None:
+        journal = Journal(journal, loop=loop)
+
+    manager = jobs.JobManager(scheduler=scheduler, speculative=speculative,
+                              job_timeout=job_timeout, cache=cache,
+                              journal=journal, loop=loop)
     workers = set()
+    worker_options = dict(prefetch=prefetch, batch_size=batch_size,
+            batch_bytes=batch_bytes, batch_delay=batch_delay,
+            heartbeat_interval=heartbeat_interval,
+            heartbeat_timeout=heartbeat_timeout, hooks=tuple(hooks),
+            adaptive=adaptive)
     server = await loop.create_server(
-            lambda: WorkerProtocol(manager, workers), host, port)
-    return Master(server, manager, workers, loop=loop)
+            lambda: WorkerProtocol(manager, workers, codecs=codecs,
+                                   compression=compression,
+                                   compression_threshold=compression_threshold,
+                                   loop=loop, **worker_options),
+            host, port)
+    master = Master(server, manager, workers, loop=loop)
+    if metrics_port is not None:
+        await master.serve_metrics(metrics_port, host=host)
+    return master
 
 
 class WorkerProtocol(asyncio.Protocol):
     """
-    The asyncio protocol used to handle remote workers. This class finds lines
-    of input and delegates their processing to a Worker object.
+    The asyncio protocol used to handle remote workers. This class performs the
+    handshake with the remote worker, then finds frames of input and delegates
+    their processing to a Worker object.
     """
 
-    def __init__(self, manager, workers):
+    def __init__(self, manager, workers, *, codecs=("json",), compression=(),
+            compression_threshold=compressors.DEFAULT_THRESHOLD, loop,
+            **worker_options):
 
         self._manager = manager
         self._workers = workers
+        self._codecs = codecs
+        self._compression = compression
+        self._compression_threshold = compression_threshold
+        self._loop = loop
+        self._worker_options = worker_options
+
+        self._transport = None
+        self._worker = None
+        self._codec = None
+        self._compressor = None
+        self._rejected = False
+        self._decompressing = None
+        self._lost = False
 
     def connection_made(self, transport):
         """
         Called when a remote worker connection has been found. Finishes setting
-        up the protocol object.
+        up the protocol object. The worker object is not created until the
+        remote worker's hello line is received.
         """
 
+        self._transport = transport
+        self._buffer = bytearray()
+        self._scan_start = 0
+
         if self._manager.is_closed():
             logger.debug("worker tried to connect while manager was closed")
+            self._rejected = True
+            self._transport.close()
             return
 
         logger.debug("new worker connected")
 
-        self._transport = transport
-        self._buffer = bytearray()
-        self._worker = Worker(self._transport, self._manager)
-        self._workers.add(self._worker)
-
     def data_received(self, data):
         """
         Called when a chunk of data is received from the remote worker. These
-        chunks are stored in a buffer. When a complete line is found in the
-        buffer, it removed and sent to line_received().
+        chunks are stored in a buffer. Until the handshake is complete, each
+        line found in the buffer is sent to line_received(). After that, each
+        complete frame is sent to frame_received(). Consumed data is removed
+        from the buffer all at once.
+
+        Line endings are only searched for in bytes which have not been
+        searched before, frames are found by their length prefix, and the
+        buffer is compacted at most once per chunk, so the cost of framing is
+        linear in the amount of data received no matter how it is split
+        across chunks.
         """
 
         self._buffer.extend(data)
-        while True:
-            i = self._buffer.find(b"\n")
-            if i == -1:
-                break
-            line = self._buffer[:i+1]
-            self._buffer = self._buffer[i+1:]
-            self.line_received(line)
+        if self._worker is not None:
+            self._worker.bytes_received(len(data))
+        self._read_buffer()
+
+    def _read_buffer(self):
+        """
+        Handles the lines or frames in the buffer, as described by
+        data_received(), stopping early while a frame is being decompressed
+        on the executor.
+        """
+
+        buffer = self._buffer
+        start = 0
+        with memoryview(buffer) as view:
+            while not self._rejected and self._decompressing is None:
+                if self._worker is None:
+                    i = buffer.find(b"\n", self._scan_start)
+                    if i == -1:
+                        self._scan_start = len(buffer)
+                        break
+                    with view[start:i+1] as line:
+                        self.line_received(line)
+                    start = self._scan_start = i + 1
+                else:
+                    if len(buffer) - start < protocol.FRAME_PREFIX.size:
+                        break
+                    header_length, body_length = \
+                            protocol.FRAME_PREFIX.unpack_from(buffer, start)
+                    header_start = start + protocol.FRAME_PREFIX.size
+                    body_start = header_start + header_length
+                    end = body_start + body_length
+                    if len(buffer) < end:
+                        break
+                    with view[header_start:body_start] as header, \
+                            view[body_start:end] as body:
+                        self.frame_received(header, body)
+                    start = end
+
+        if start > 0:
+            del buffer[:start]
+            self._scan_start -= min(start, self._scan_start)
 
     def line_received(self, line):
         """
-        Called when a complete line is found from the remote worker. Decodes
-        a response object from the line, then passes it to the worker object.
+        Called when the remote worker's hello line is received. Chooses the
+        codec and compressor for the connection and replies with them, then
+        creates the worker
+        object with the number of slots the remote worker advertised. If the
+        remote worker accepts none of the master's codecs, it is told so and
+        disconnected.
+        """
+
+        hello = protocol.decode_line(line)
+        codec = protocol.choose_codec(self._codecs, hello.get("codecs", ()))
+        compressor = compressors.choose_compressor(
+                self._compression, hello.get("compression", ()))
+        slots = hello.get("slots", 1)
+        if codec is None:
+            self._reject("no codec in common with the master")
+            return
+        if not isinstance(slots, int) or slots < 1:
+            self._reject("slots must be a positive integer")
+            return
+
+        logger.debug("worker handshake complete, using {} codec".format(
+                codec.name))
+
+        self._codec = codec
+        self._compressor = compressor
+        reply = {"codec": codec.name}
+        if compressor is not None:
+            reply["compression"] = compressor.name
+            reply["compression_threshold"] = self._compression_threshold
+        if self._worker_options.get("hooks"):
+            reply["timing"] = True
+        self._transport.write(protocol.encode_line(reply))
+        self._worker = Worker(self._transport, self._manager, codec=codec,
+                compressor=compressor,
+                compression_threshold=self._compression_threshold,
+                slots=slots, reducers=frozenset(hello.get("reducers", ())),
+                shared_bytes=hello.get("shared_bytes", 0),
+                shared_keys=hello.get("shared", {}), loop=self._loop,
+                **self._worker_options)
+        self._workers.add(self._worker)
+
+    def _reject(self, reason):
+        """
+        Tells the remote worker why it is being turned away, then disconnects
+        it.
+        """
+
+        logger.warning("rejected worker: {}".format(reason))
+        self._transport.write(protocol.encode_line({"error": reason}))
+        self._rejected = True
+        self._transport.close()
+
+    def frame_received(self, header, body):
+        """
+        Called when a complete frame is found from the remote worker. The
+        header and body are memoryviews into the receive buffer, so they are
+        only valid for the duration of this call. Compressed frames are
+        decompressed first. Those of at least OFFLOAD_BYTES are decompressed
+        on the loop's default executor, and reading from the connection is
+        paused until they are done, so frames are still handled in order. A
+        remote worker which sends a corrupt or oversized compressed frame is
+        disconnected.
+        """
+
+        size = protocol.FRAME_PREFIX.size + len(header) + len(body)
+        header = protocol.decode_header(header)
+        if "compressed" not in header or self._compressor is None:
+            self._handle_frame(header, body, size, 0)
+            return
+
+        compressed = header["compressed"]
+        if (isinstance(compressed, int)
+                and compressed >= compressors.OFFLOAD_BYTES):
+            # the body is copied, since the buffer changes in the meantime
+            self._decompressing = self._loop.run_in_executor(
+                    None, self._decompress, header, bytes(body))
+            self._decompressing.add_done_callback(self._decompressed)
+            self._transport.pause_reading()
+            return
+
+        try:
+            frame = self._decompress(header, body)
+        except ValueError as e:
+            self._drop(str(e))
+            return
+        self._handle_frame(*frame)
+
+    def _decompress(self, header, body):
+        """
+        Decompresses a compressed frame, returning the decoded header, body
+        and size of the original frame, and the seconds spent decompressing
+        it.
+        """
+
+        started = time.perf_counter()
+        header, body = compressors.decompress_frame(self._compressor, header,
+                                                    body)
+        seconds = time.perf_counter() - started
+        size = protocol.FRAME_PREFIX.size + len(header) + len(body)
+        return protocol.decode_header(header), body, size, seconds
+
+    def _decompressed(self, future):
+        """
+        Called when a frame has been decompressed on the executor. Handles
+        it, then resumes reading from the connection. Since this runs as a
+        loop callback rather than under data_received(), any error handling
+        the frame drops the remote worker, instead of leaving the connection
+        paused.
+        """
+
+        self._decompressing = None
+        if self._lost or future.cancelled():
+            return
+        try:
+            frame = future.result()
+        except ValueError as e:
+            self._drop(str(e))
+            return
+        try:
+            self._handle_frame(*frame)
+        except Exception:
+            logger.exception("error handling frame from worker {}".format(
+                    id(self)))
+            self._drop("could not handle a frame")
+            return
+        self._transport.resume_reading()
+        self._read_buffer()
+
+    def _drop(self, reason):
+        """
+        Disconnects a remote worker which broke the protocol.
         """
 
-        response = json.loads(line.decode("utf-8"))
-        self._worker.response_received(response)
+        logger.warning("dropping worker: {}".format(reason))
+        self._rejected = True
+        self._transport.close()
+
+    def _handle_frame(self, header, body, size, seconds):
+        """
+        Handles a decoded frame from the remote worker, given its size before
+        compression and the seconds spent decompressing it. Any frame shows
+        that the remote worker is alive. Decodes a batch of call IDs and
+        response objects from the frame, then passes them to the worker
+        object one at a time.
+        """
+
+        self._worker.frame_received(size, seconds)
+        if "pong" in header:
+            self._worker.pong_received(header["pong"])
+        if "slots" in header:
+            self._worker.slots_changed(header["slots"])
+        for entry, payload in protocol.split_payloads(
+                header.get("responses", ()), body):
+            with payload:
+                response = protocol.decode_payload(self._codec, entry, payload)
+            timing = entry[2].get("timing") if len(entry) > 2 else None
+            self._worker.response_received(entry[0], response, timing)
 
     def connection_lost(self, exc):
         """
@@ -83,81 +406,574 @@ class WorkerProtocol(asyncio.Protocol):
 
         logger.debug("worker connection lost")
 
-        self._worker.close()
-        self._workers.remove(self._worker)
+        self._lost = True
+        if self._worker is not None:
+            self._worker.close()
+            self._workers.remove(self._worker)
 
 
 class Worker:
     """
-    Handles job retrieval and result reporting for remote workers.
+    Handles job retrieval and result reporting for remote workers. The remote
+    worker can run up to slots jobs at once, and up to slots times prefetch
+    jobs are kept in flight on the connection, each tagged with a call ID so
+    that responses can be matched to their jobs in any order.
+    Calls are encoded with the connection's codec and sent in batches, and
+    each batch is a single frame on the wire.
+
+    The worker also pings the remote worker regularly, and drops the
+    connection if the remote worker goes quiet or holds on to a call for
+    longer than the call's job timeout.
+
+    In adaptive mode, the worker measures the remote worker's throughput as
+    a moving average of the time between responses while it is busy, and
+    reports it to the job manager. The number of calls kept in flight, its
+    window, is the number of slots plus the calls the remote worker completes
+    in one round trip, and the batch size is the calls it completes in one
+    round trip, both capped by the configured prefetch and batch size. The
+    round trip is the latest ping time, or the shortest response time seen
+    before the first ping is answered.
+
+    Reducers is the set of names of the reducers the remote worker knows.
+    Chunks with a reducer the remote worker doesn't know are sent unreduced,
+    and their responses are reduced when they arrive.
+
+    If the connection has a compressor, frames of at least
+    compression_threshold bytes are compressed before they are sent, as
+    described by compressors.FrameWriter.
+
+    Shared objects used by a call are sent ahead of it, unless the remote
+    worker already has them. Shared_keys maps the keys of the objects the
+    remote worker had when it connected to their sizes. The worker keeps
+    track of which objects the remote worker holds, and when they take up
+    more than shared_bytes, it tells the remote worker to drop the least
+    recently used objects which no call in flight uses.
     """
 
-    def __init__(self, transport, manager):
+    # weight of the newest sample in the moving average of response intervals
+    SPEED_SMOOTHING = 0.1
+
+    def __init__(self, transport, manager, *, codec, compressor=None,
+            compression_threshold=compressors.DEFAULT_THRESHOLD, slots=1,
+            prefetch=1,
+            batch_size=1, batch_bytes=65536, batch_delay=0,
+            heartbeat_interval=None, heartbeat_timeout=None, hooks=(),
+            adaptive=False, reducers=frozenset(), shared_bytes=0,
+            shared_keys=None, loop):
 
         self._transport = transport
         self._manager = manager
+        self._codec = codec
+        self._slots = slots
+        self._loop = loop
+
+        self._jobs = dict()
+        self._deadlines = dict()
+        self._sent_times = dict()
+        self._next_call_id = 0
+        self._requested = 0
+        self._reducers = reducers
+        self._unreduced = set()
+
+        self._shared_bytes = shared_bytes
+        self._shared = collections.OrderedDict(shared_keys or ())
+        self._shared_size = sum(self._shared.values())
+        self._shared_refs = dict()
+        self._call_shared = dict()
+        self._prefetch = prefetch
+        self._max_window = slots * prefetch
+        self._window = self._max_window
+
+        self._adaptive = adaptive
+        self._busy_since = None
+        self._interval = None
+        self._min_latency = None
+
+        self._metrics = manager.metrics()
+        self._address = transport.get_extra_info("peername")
+        self._connected = time.monotonic()
+        self._idle_since = self._connected
+        self._idle_time = 0
+        self._completed = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._frame_bytes_in = 0
+        self._frame_bytes_out = 0
+        self._compression_seconds = 0
+
+        self._compressor = compressor
+        self._frames = compressors.FrameWriter(
+                self._send, compressor, threshold=compression_threshold,
+                loop=loop)
+
+        self._hooks = hooks
+        self._traces = dict()
+
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_timeout = heartbeat_timeout
+        self._last_seen = self._loop.time()
+        self._next_ping = 0
+        self._ping_sent = None
+        self._rtt = None
+        self._tick_handle = self._loop.call_later(
+                self._tick_interval(), self._tick)
+
+        self._batch_size = batch_size
+        self._max_batch_size = batch_size
+        self._batch_bytes = batch_bytes
+        self._batch_delay = batch_delay
+        self._batch = []
+        self._payloads = []
+        self._batch_len = 0
+        self._flush_handle = None
 
         self._closed = False
 
-        self._load_job()
+        self._manager.add_capacity(slots)
+        self._fill_window()
 
     def _load_job(self):
         """
         Initiates a job load from the job manager.
         """
 
-        self._job = None
-        self._manager.get_job(self._job_loaded)
+        self._requested += 1
+        self._manager.get_job(self._job_loaded, worker=self)
+
+    def _fill_window(self):
+        """
+        Requests jobs from the job manager until the jobs in flight and the
+        jobs requested fill the worker's window.
+        """
+
+        while len(self._jobs) + self._requested < self._window:
+            self._load_job()
 
     def _job_loaded(self, job):
         """
-        Called when a job has been found for the worker to run. Sends the job's
-        RPC to the remote worker.
+        Called when a job has been found for the worker to run. Assigns the job
+        a call ID and adds the job's RPC to the next batch sent to the remote
+        worker.
         """
 
         logger.debug("worker {} found a job".format(id(self)))
 
+        self._requested -= 1
         if self._closed:
-            self._manager.return_job(job)
+            self._manager.return_job(job, worker=self)
+            return
+
+        call_id = self._next_call_id
+        self._next_call_id += 1
+        if self._hooks:
+            trace = tracing.JobTrace(job, call_id, self._name())
+            trace.dispatched = time.perf_counter()
+            self._traces[call_id] = trace
+        now = time.monotonic()
+        self._jobs[call_id] = job
+        self._sent_times[call_id] = now
+        if self._idle_since is not None:
+            self._idle_time += now - self._idle_since
+            self._idle_since = None
+            self._busy_since = now
+        timeout = self._manager.job_timeout(job)
+        if timeout is not None:
+            self._deadlines[call_id] = self._loop.time() + timeout
+        shared_keys = self._manager.job_shared(job)
+        if shared_keys:
+            self._use_shared(call_id, shared_keys)
+
+        payload, extras = protocol.encode_payload(self._codec, job.get_call())
+        if isinstance(job, jobs.ChunkJob):
+            extras = dict(extras or (), chunk=True)
+            if job.reducer is not None:
+                if job.reducer_name in self._reducers:
+                    extras["reduce"] = job.reducer_name
+                else:
+                    self._unreduced.add(call_id)
+        self._batch.append(protocol.payload_entry(call_id, payload, extras))
+        self._payloads.append(payload)
+        self._batch_len += len(payload)
+
+        if self._hooks:
+            trace.encoded = time.perf_counter()
+            for hook in self._hooks:
+                hook.on_dispatch(trace)
+
+        if (len(self._batch) >= self._batch_size
+                or self._batch_len >= self._batch_bytes):
+            self._flush()
+        elif self._flush_handle is None:
+            if self._batch_delay > 0:
+                self._flush_handle = self._loop.call_later(
+                        self._batch_delay, self._flush)
+            else:
+                self._flush_handle = self._loop.call_soon(self._flush)
+
+    def _use_shared(self, call_id, keys):
+        """
+        Records that a call uses some shared objects, and sends the remote
+        worker the ones it doesn't have in a frame ahead of the call. Objects
+        the remote worker should drop to make room are listed in the same
+        frame.
+        """
+
+        entries = []
+        payloads = []
+        for key in keys:
+            self._shared_refs[key] = self._shared_refs.get(key, 0) + 1
+            if key in self._shared:
+                self._shared.move_to_end(key)
+                continue
+            payload, extras = self._manager.shared_objects().encoded(
+                    key, self._codec)
+            entries.append(protocol.payload_entry(key, payload, extras))
+            payloads.append(payload)
+            self._shared[key] = len(payload)
+            self._shared_size += len(payload)
+        self._call_shared[call_id] = keys
+
+        if len(entries) > 0:
+            header = {"shared": entries}
+            drop = self._evict_shared()
+            if len(drop) > 0:
+                header["drop"] = drop
+            self._write(protocol.encode_frame(header, payloads))
+
+    def _evict_shared(self):
+        """
+        Forgets the least recently used shared objects which no call in
+        flight uses, until the remote worker's objects fit in shared_bytes.
+        Returns the keys of the forgotten objects.
+        """
+
+        drop = []
+        for key in list(self._shared):
+            if self._shared_size <= self._shared_bytes:
+                break
+            if key in self._shared_refs:
+                continue
+            self._shared_size -= self._shared.pop(key)
+            drop.append(key)
+        return drop
+
+    def _release_shared(self, call_id):
+        """
+        Records that a call no longer uses its shared objects.
+        """
+
+        for key in self._call_shared.pop(call_id, ()):
+            refs = self._shared_refs[key] - 1
+            if refs == 0:
+                del self._shared_refs[key]
+            else:
+                self._shared_refs[key] = refs
+
+    def _flush(self):
+        """
+        Sends the current batch of calls to the remote worker as one frame.
+        """
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._closed or len(self._batch) == 0:
+            return
+
+        if self._hooks:
+            sent = time.perf_counter()
+            for entry in self._batch:
+                self._traces[entry[0]].sent = sent
+
+        frame = protocol.encode_frame({"calls": self._batch}, self._payloads)
+        self._batch = []
+        self._payloads = []
+        self._batch_len = 0
+        self._write(frame)
+
+    def _write(self, frame):
+        """
+        Writes a frame to the remote worker, compressing it if it is large
+        enough.
+        """
+
+        self._frames.write(frame)
+
+    def _send(self, frame, size, seconds):
+        """
+        Sends a frame, which may be compressed, to the remote worker, and
+        counts the bytes sent. Size is the size of the frame before
+        compression, and seconds is the time spent compressing it.
+        """
+
+        n = compressors.frame_size(frame)
+        self._bytes_out += n
+        self._frame_bytes_out += size
+        self._compression_seconds += seconds
+        self._metrics.bytes_out += n
+        self._metrics.frame_bytes_out += size
+        self._metrics.compression_seconds += seconds
+        self._transport.writelines(frame)
+
+    def _tick_interval(self):
+        """
+        Returns the number of seconds between heartbeat and timeout checks.
+        """
+
+        if self._heartbeat_interval is not None:
+            return self._heartbeat_interval
+        return 1
+
+    def _tick(self):
+        """
+        Called regularly to check that the remote worker is alive and that no
+        call has run past its deadline, then to ping the remote worker. The
+        connection is dropped if either check fails.
+        """
+
+        now = self._loop.time()
+
+        if (self._heartbeat_timeout is not None
+                and now - self._last_seen > self._heartbeat_timeout):
+            logger.warning("worker {} stopped responding, dropping it".format(
+                    id(self)))
+            self.drop()
+            return
+
+        for deadline in self._deadlines.values():
+            if now > deadline:
+                logger.warning("job timed out on worker {}, dropping it".format(
+                        id(self)))
+                self.drop()
+                return
+
+        if self._heartbeat_interval is not None:
+            self._write(protocol.encode_frame({"ping": self._next_ping}))
+            self._next_ping += 1
+            self._ping_sent = now
+
+        self._tick_handle = self._loop.call_later(
+                self._tick_interval(), self._tick)
+
+    def bytes_received(self, n):
+        """
+        Called when n bytes are received from the remote worker.
+        """
+
+        self._bytes_in += n
+        self._metrics.bytes_in += n
+
+    def frame_received(self, size, seconds=0):
+        """
+        Called when any frame is received from the remote worker. Size is
+        the size of the frame after decompression, and seconds is the time
+        spent decompressing it.
+        """
+
+        self._last_seen = self._loop.time()
+        self._frame_bytes_in += size
+        self._compression_seconds += seconds
+        self._metrics.frame_bytes_in += size
+        self._metrics.compression_seconds += seconds
+
+    def pong_received(self, ping_id):
+        """
+        Called when the remote worker answers a ping. Records the round trip
+        time of the latest ping.
+        """
+
+        if ping_id == self._next_ping - 1 and self._ping_sent is not None:
+            self._rtt = self._loop.time() - self._ping_sent
+
+    def slots_changed(self, slots):
+        """
+        Called when the remote worker changes its number of slots, such as a
+        relay whose own workers come and go. The window is resized to match,
+        and calls already in flight beyond it are left to finish. A worker
+        with no slots runs no more jobs, so in adaptive mode its speed is
+        forgotten, and measured afresh once it has slots again.
+        """
+
+        if self._closed or not isinstance(slots, int) or slots < 0:
             return
 
-        self._job = job
-        call_obj = self._job.get_call()
-        call = (json.dumps(call_obj) + "\n").encode("utf-8")
-        self._transport.write(call)
+        self._manager.remove_capacity(self._slots)
+        self._manager.add_capacity(slots)
+        self._slots = slots
+        if self._adaptive and slots == 0:
+            self._interval = None
+            self._manager.forget_worker_speed(self)
+        self._max_window = slots * self._prefetch
+        if self._adaptive:
+            self._window = max(slots, min(self._window, self._max_window))
+        else:
+            self._window = self._max_window
+        self._fill_window()
 
-    def response_received(self, response):
+    def _name(self):
+        """
+        Returns a name for the remote worker, for traces.
+        """
+
+        if self._address is None:
+            return str(id(self))
+        return "{}:{}".format(*self._address[:2])
+
+    def response_received(self, call_id, response, timing=None):
         """
         Called when a response to a job RPC has been received. Decodes the
         response and finalizes the result, then reports the result to the
-        job manager.
+        job manager and requests a job to take its place. The timing is the
+        (queued, run) pair reported by the remote worker, if any.
         """
 
         if self._closed:
             return
 
-        assert self._job is not None
+        job = self._jobs.pop(call_id)
+        self._deadlines.pop(call_id, None)
+        if self._unreduced and call_id in self._unreduced:
+            self._unreduced.discard(call_id)
+            response = job.reduce(response)
+        if self._call_shared:
+            self._release_shared(call_id)
+        now = time.monotonic()
+        latency = now - self._sent_times.pop(call_id)
+        self._metrics.latency.observe(latency)
+        if self._adaptive:
+            self._measure(now, latency)
+        if len(self._jobs) == 0:
+            self._idle_since = now
+        self._completed += 1
 
         logger.debug("worker {} got response".format(id(self)))
-        result = self._job.get_result(response)
-        self._manager.add_result(self._job, result)
+        if self._hooks:
+            trace = self._traces.pop(call_id)
+            trace.received = time.perf_counter()
+            if timing is not None:
+                trace.queued_seconds, trace.run_seconds = timing
+            for hook in self._hooks:
+                hook.on_response(trace)
+            result = self._manager.add_response(job, response)
+            trace.completed = time.perf_counter()
+            for hook in self._hooks:
+                hook.on_result(trace, result)
+        else:
+            self._manager.add_response(job, response)
+
+        self._fill_window()
+
+    def _measure(self, now, latency):
+        """
+        Updates the measured speed of the remote worker when a response is
+        received, then resizes the window and the batch size to match it.
+        """
+
+        interval = now - self._busy_since
+        self._busy_since = now
+        if self._interval is None:
+            self._interval = interval
+        else:
+            self._interval += self.SPEED_SMOOTHING * (interval - self._interval)
+        if self._min_latency is None or latency < self._min_latency:
+            self._min_latency = latency
+
+        if self._interval <= 0 or self._slots == 0:
+            return
+        throughput = 1 / self._interval
+        self._manager.set_worker_speed(self, throughput,
+                                       self._slots * self._interval)
 
-        self._load_job()
+        rtt = self._rtt if self._rtt is not None else self._min_latency
+        per_round_trip = math.ceil(throughput * rtt)
+        self._window = max(self._slots, min(self._slots + per_round_trip,
+                                            self._max_window))
+        self._batch_size = max(1, min(per_round_trip, self._max_batch_size))
 
     def close(self):
         """
-        Closes the worker. No more jobs will be handled by the worker, and any
-        running job is immediately returned to the job manager.
+        Closes the worker. No more jobs will be handled by the worker, and all
+        running jobs are immediately returned to the job manager.
         """
 
         if self._closed:
             return
 
         self._closed = True
+        self._manager.remove_capacity(self._slots)
+        self._manager.cancel_requests(self)
+        self._requested = 0
 
-        if self._job is not None:
-            self._manager.return_job(self._job)
-            self._job = None
+        self._tick_handle.cancel()
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._batch = []
+        self._payloads = []
+        self._frames.close()
+
+        jobs_in_flight = list(self._jobs.values())
+        self._jobs.clear()
+        self._deadlines.clear()
+        self._sent_times.clear()
+        self._traces.clear()
+        self._unreduced.clear()
+        self._call_shared.clear()
+        self._shared_refs.clear()
+        for job in jobs_in_flight:
+            self._manager.return_job(job, worker=self)
+        if self._adaptive:
+            self._manager.forget_worker_speed(self)
+
+    def stats(self):
+        """
+        Returns a dict of statistics about the worker. Idle time is the time
+        spent with no calls in flight, and utilization is the fraction of the
+        time since the worker connected which was not idle. Throughput is only
+        measured in adaptive mode, and is None otherwise. Compression ratios
+        are bytes of frames per byte on the wire, and compression seconds is
+        the time the master spent compressing and decompressing frames.
+        """
+
+        now = time.monotonic()
+        idle_time = self._idle_time
+        if self._idle_since is not None:
+            idle_time += now - self._idle_since
+        elapsed = now - self._connected
+
+        return {
+            "id": id(self),
+            "address": None if self._address is None else self._name(),
+            "slots": self._slots,
+            "in_flight": len(self._jobs),
+            "window": self._window,
+            "batch_size": self._batch_size,
+            "throughput": (1 / self._interval if self._interval else None),
+            "completed": self._completed,
+            "utilization": 1 - idle_time / elapsed if elapsed > 0 else 0,
+            "idle_seconds": idle_time,
+            "rtt": self._rtt,
+            "bytes_in": self._bytes_in,
+            "bytes_out": self._bytes_out,
+            "compression": (None if self._compressor is None
+                            else self._compressor.name),
+            "compression_ratio_in": metrics.ratio(self._frame_bytes_in,
+                                                  self._bytes_in),
+            "compression_ratio_out": metrics.ratio(self._frame_bytes_out,
+                                                   self._bytes_out),
+            "compression_seconds": self._compression_seconds,
+        }
+
+    def drop(self):
+        """
+        Closes the worker, returning its jobs to the job manager, then aborts
+        the connection to the remote worker.
+        """
+
+        self.close()
+        self._transport.abort()
 
 
 class Master:
@@ -169,8 +985,11 @@ class Master:
         self._workers = workers
         self._loop = loop
 
+        self._metrics_server = None
         self._closed = False
 
+        self._sample_handle = self._loop.call_later(1, self._sample)
+
     async def __aenter__(self):
 
         return self
@@ -180,20 +999,157 @@ class Master:
         self.close()
         await self.wait_closed()
 
-    def run(self, job_list):
+    def share(self, obj, *, key=None):
+        """
+        Shares an object with the workers, such as a lookup table which many
+        calls need, and returns its key. Job sets run with the key in their
+        shared list send the object to each worker at most once, ahead of the
+        first call which needs it, and job handlers get the object with
+        highfive.get_shared(key). Calls should hold the key rather than the
+        object. Sharing the same content twice returns the same key. Relays
+        give the key the object was shared under upstream.
+        """
+
+        return self._manager.shared_objects().add(obj, key)
+
+    def unshare(self, key):
+        """
+        Stops sharing an object. It must not be used by any running job set.
+        """
+
+        self._manager.shared_objects().remove(key)
+
+    def forget(self, name):
+        """
+        Deletes the journaled results of a named job set which has finished,
+        so that running a job set with the same name again starts afresh.
+        Raises a ValueError if a job set with the name is running.
+        """
+
+        self._manager.forget(name)
+
+    def run(self, job_list, *, priority=0, weight=1, job_timeout=None,
+            streaming=False, high_water=None, name=None,
+            chunk_duration=None, shared=()):
         """
         Runs a job set which consists of the jobs in an iterable job list.
+        The job list may also be an async iterable or a JobSource, which are
+        read ahead of the workers without blocking the event loop. Job sets
+        with a higher priority are scheduled ahead of job sets with a lower
+        priority. The weight is used by schedulers which share the workers
+        between job sets, such as FairScheduler. If job_timeout is given, it
+        overrides the master's job timeout for this job set. Job timeouts are
+        per job, so a chunk of jobs may be held for its number of jobs times
+        the timeout.
+
+        In streaming mode, results are dropped once every results iterator
+        has passed them, so they can't be indexed afterwards. If high_water
+        is given, no new jobs are started while that many results are waiting
+        to be consumed.
+
+        If the master has a journal, the results of a named job set are
+        journaled, and results journaled by an earlier job set with the same
+        name are reused. The job list must produce the same jobs in the same
+        order each time for this to be correct.
+
+        If chunk_duration is given, consecutive jobs are sent to workers in
+        chunks, which are sized to take about chunk_duration seconds each and
+        shrink as the job set nears completion. This cuts the overhead of
+        jobs which are too small to be worth sending one at a time. Results
+        are still delivered one job at a time. A chunk's calls are sent as a
+        list, so the codec must be able to encode lists of them.
+
+        Shared lists the keys of the shared objects the job set's calls use,
+        as returned by share().
+        """
+
+        if self._closed:
+            raise RuntimeError("master is closed")
+
+        return self._manager.add_job_set(job_list, priority=priority,
+                                         weight=weight,
+                                         job_timeout=job_timeout,
+                                         streaming=streaming,
+                                         high_water=high_water, name=name,
+                                         chunk_duration=chunk_duration,
+                                         shared=shared)
+
+    def map_reduce(self, job_list, reducer, *, initial=reducers.NO_INITIAL,
+            chunk_duration=0.1, priority=0, weight=1, job_timeout=None,
+            shared=()):
+        """
+        Runs a job set and reduces its results to a single value, without
+        keeping the individual results. The reducer is "sum", "product",
+        "min", "max", or a function which combines two values. Jobs are sent
+        in chunks, as with run(), and each worker reduces the responses to a
+        chunk before returning a single partial result, which the master
+        combines with the others as it arrives. Workers must be given custom
+        reducer functions with run_worker(reducers=...), or their chunks are
+        reduced on the master instead.
+
+        Partial results arrive in any order, so the reducer must be
+        associative and commutative. If initial is given, the reduction starts
+        with it. The jobs' get_result() methods are not used, since responses
+        are reduced on the workers. Returns a ReductionHandle, whose result()
+        method waits for the job set to finish and returns the reduction.
+        Shared lists the keys of shared objects, as for run().
         """
 
         if self._closed:
             raise RuntimeError("master is closed")
 
-        return self._manager.add_job_set(job_list)
+        return self._manager.add_reduction(job_list, reducer, initial=initial,
+                                           priority=priority, weight=weight,
+                                           job_timeout=job_timeout,
+                                           chunk_duration=chunk_duration,
+                                           shared=shared)
+
+    def capacity(self):
+        """
+        Returns the number of slots across all connected workers.
+        """
+
+        return self._manager.capacity()
+
+    def _sample(self):
+        """
+        Takes a snapshot of the job counters once per second, which job rates
+        are worked out from.
+        """
+
+        self._manager.metrics().sample()
+        self._sample_handle = self._loop.call_later(1, self._sample)
+
+    def stats(self):
+        """
+        Returns a dict of statistics about the master: job counts and rates
+        over the last ten seconds, a histogram of the time from sending each
+        call to receiving its response, queue depths, bytes sent to and
+        received from workers, how well frames compressed and how long that
+        took, and per-worker statistics.
+        """
+
+        stats = self._manager.stats()
+        stats["workers"] = [worker.stats() for worker in self._workers]
+        return stats
+
+    async def serve_metrics(self, port, *, host=""):
+        """
+        Starts serving the master's statistics over HTTP on the given port,
+        in the Prometheus text format.
+        """
+
+        if self._metrics_server is not None:
+            raise RuntimeError("metrics are already being served")
+
+        self._metrics_server = await metrics.start_metrics_server(
+                self, host, port)
 
     def close(self):
         """
-        Starts closing the HighFive master. The server will be closed and
-        all queued job sets will be cancelled.
+        Starts closing the HighFive master. The server will be closed, all
+        queued job sets will be cancelled, and workers will be disconnected,
+        so that they can reconnect to the next master.
         """
 
         if self._closed:
@@ -201,10 +1157,13 @@ class Master:
 
         self._closed = True
 
+        self._sample_handle.cancel()
         self._server.close()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
         self._manager.close()
         for worker in self._workers:
-            worker.close()
+            worker.drop()
 
     async def wait_closed(self):
         """
@@ -212,4 +1171,6 @@ class Master:
         """
 
         await self._server.wait_closed()
+        if self._metrics_server is not None:
+            await self._metrics_server.wait_closed()
 
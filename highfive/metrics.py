@@ -0,0 +1,234 @@
+import asyncio
+import bisect
+import collections
+import time
+
+
+# Upper bounds of the job latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    """
+    Counts observations in buckets with fixed upper bounds, plus an overflow
+    bucket, and keeps their count and sum.
+    """
+
+    def __init__(self, bounds):
+
+        self._bounds = tuple(bounds)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """
+        Records an observation.
+        """
+
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def buckets(self):
+        """
+        Returns a list of (upper bound, cumulative count) pairs, ending with
+        an infinite bound which counts every observation.
+        """
+
+        buckets = []
+        total = 0
+        for bound, count in zip(self._bounds + (float("inf"),),
+                                self._counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+    def quantile(self, q):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in.
+        Returns None if there are no observations.
+        """
+
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        for bound, total in self.buckets():
+            if total >= rank:
+                return bound
+
+
+class Metrics:
+    """
+    Counters shared by the job manager and the master's workers. Updating
+    them only costs a few additions per job, so they are always enabled.
+
+    Rates are worked out from snapshots of the job counters, which the master
+    takes once per second with sample(), so counting a job never reads the
+    clock.
+    """
+
+    def __init__(self, *, window=10):
+
+        self.started = time.monotonic()
+        self.dispatched = 0
+        self.completed = 0
+        self.returned = 0
+        self.cache_hits = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frame_bytes_in = 0
+        self.frame_bytes_out = 0
+        self.compression_seconds = 0
+
+        self._samples = collections.deque(maxlen=window + 1)
+        self.sample()
+
+    def _counts(self):
+
+        return (self.dispatched, self.completed, self.returned)
+
+    def sample(self):
+        """
+        Takes a snapshot of the job counters.
+        """
+
+        self._samples.append((time.monotonic(), self._counts()))
+
+    def rates(self):
+        """
+        Returns the number of jobs dispatched, completed and returned per
+        second, averaged from the oldest snapshot up to now.
+        """
+
+        then, old = self._samples[0]
+        elapsed = time.monotonic() - then
+        if elapsed <= 0:
+            return (0, 0, 0)
+        return tuple((new - count) / elapsed
+                     for new, count in zip(self._counts(), old))
+
+
+def ratio(frame_bytes, wire_bytes):
+    """
+    Returns the compression ratio of bytes of frames to bytes on the wire, or
+    None if no bytes have been sent.
+    """
+
+    if wire_bytes == 0:
+        return None
+    return frame_bytes / wire_bytes
+
+
+def _prometheus_value(value):
+
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def prometheus_text(stats):
+    """
+    Formats the dict returned by Master.stats() in the Prometheus text
+    exposition format.
+    """
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append("# HELP highfive_{} {}".format(name, help_text))
+        lines.append("# TYPE highfive_{} {}".format(name, kind))
+        for labels, value in samples:
+            label_text = ",".join('{}="{}"'.format(k, v) for k, v in labels)
+            if label_text:
+                label_text = "{" + label_text + "}"
+            lines.append("highfive_{}{} {}".format(
+                    name, label_text, _prometheus_value(value)))
+
+    jobs = stats["jobs"]
+    for event in ("dispatched", "completed", "returned"):
+        metric("jobs_{}_total".format(event), "counter",
+               "Jobs {} since the master started.".format(event),
+               [((), jobs[event])])
+    metric("cache_hits_total", "counter",
+           "Jobs answered from the result cache.",
+           [((), jobs["cache_hits"])])
+
+    latency = stats["latency"]
+    lines.append("# HELP highfive_job_latency_seconds Time from sending a "
+                 "call to receiving its response.")
+    lines.append("# TYPE highfive_job_latency_seconds histogram")
+    for bound, count in latency["buckets"]:
+        lines.append('highfive_job_latency_seconds_bucket{{le="{}"}} {}'
+                     .format(_prometheus_value(bound), count))
+    lines.append("highfive_job_latency_seconds_sum {}".format(
+            _prometheus_value(latency["sum"])))
+    lines.append("highfive_job_latency_seconds_count {}".format(
+            latency["count"]))
+
+    queues = stats["queues"]
+    metric("waiting_slots", "gauge", "Worker slots waiting for a job.",
+           [((), queues["waiting_slots"])])
+    metric("returned_jobs", "gauge", "Returned jobs waiting to be rerun.",
+           [((), queues["returned_jobs"])])
+    metric("job_sets", "gauge", "Running job sets.",
+           [((), queues["job_sets"])])
+    metric("capacity", "gauge", "Slots across all connected workers.",
+           [((), stats["capacity"])])
+    metric("bytes_received_total", "counter", "Bytes received from workers.",
+           [((), stats["bytes_in"])])
+    metric("bytes_sent_total", "counter", "Bytes sent to workers.",
+           [((), stats["bytes_out"])])
+    compression = stats["compression"]
+    metric("frame_bytes_received_total", "counter",
+           "Bytes of frames received from workers, after decompression.",
+           [((), compression["frame_bytes_in"])])
+    metric("frame_bytes_sent_total", "counter",
+           "Bytes of frames sent to workers, before compression.",
+           [((), compression["frame_bytes_out"])])
+    metric("compression_seconds_total", "counter",
+           "Time spent compressing and decompressing frames.",
+           [((), compression["seconds"])])
+
+    workers = stats["workers"]
+    metric("worker_utilization", "gauge",
+           "Fraction of time a worker had calls in flight.",
+           [((("worker", w["id"]),), w["utilization"]) for w in workers])
+    metric("worker_idle_seconds_total", "counter",
+           "Time a worker spent with no jobs.",
+           [((("worker", w["id"]),), w["idle_seconds"]) for w in workers])
+
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_request(master, reader, writer):
+    """
+    Answers a single HTTP request with the master's metrics.
+    """
+
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = prometheus_text(master.stats()).encode("utf-8")
+        writer.write(b"HTTP/1.0 200 OK\r\n"
+                     b"Content-Type: text/plain; version=0.0.4\r\n"
+                     b"Content-Length: " + str(len(body)).encode("ascii")
+                     + b"\r\n\r\n" + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(master, host, port):
+    """
+    Starts a minimal HTTP server which answers every request with the
+    master's metrics in the Prometheus text format.
+    """
+
+    return await asyncio.start_server(
+            lambda reader, writer: _handle_request(master, reader, writer),
+            host, port)
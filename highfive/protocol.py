@@ -0,0 +1,275 @@
+import json
+import pickle
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Wire protocol shared by the master and the workers.
+#
+# A connection starts with a handshake of two JSON lines. The worker sends a
+# hello object listing the codecs it accepts, and the master replies with the
+# codec it chose for the connection (or an error, after which it disconnects).
+# The reply may also ask the worker to report timing with each response.
+#
+# Every message after the handshake is a length-prefixed frame. The prefix
+# holds the length of a JSON header followed by the length of the frame body.
+# The header describes the message, and the body is the concatenation of the
+# codec-encoded payloads which the header refers to by length. Keeping payloads
+# out of the header means binary codecs can send their payloads untouched.
+#
+# Each header entry for a payload is a list starting with the payload's call ID
+# and length. An optional third element holds a dict of extra information about
+# the payload. NumPy arrays bypass the codec entirely: their raw buffer is sent
+# as the payload and their dtype and shape are sent in the extras. Response
+# timing is sent in the extras as the seconds the call spent queued on the
+# worker and running. A call marked as a chunk in its extras is a list of
+# calls, which the worker runs one at a time, responding with the list of
+# their responses. A chunk may also name a reducer in its extras, in which case
+# the worker responds with the reduction of the responses instead. Workers list
+# the names of the reducers they know in their hello.
+#
+# Objects shared by the master are sent in a frame of their own, ahead of the
+# first call which needs them, with header entries keyed by the object's
+# content hash instead of a call ID. The same frame may list the keys of
+# objects the worker should drop. Workers say in their hello how many bytes of
+# shared objects they can keep, and which objects they already have.
+#
+# Workers also list the frame compressors they have in their hello, and the
+# master may reply with one of them and a size threshold. Either side may then
+# send a frame of at least that many bytes as a compressed frame, whose header
+# holds the size of the original frame and whose body is the whole original
+# frame, prefix included, compressed.
+#
+# A worker whose number of slots changes after the handshake, such as a relay
+# whose own workers come and go, sends a frame whose header holds the new
+# number of slots, which may be zero.
+
+FRAME_PREFIX = struct.Struct("!II")
+
+# Frames carry many small JSON documents, so the per-call overhead of
+# json.loads() (whitespace matching and type checks) is worth skipping.
+_json_decode = json.JSONDecoder().raw_decode
+
+
+class Codec:
+    """
+    Interface for payload codecs. Codecs convert call and response objects to
+    and from bytes.
+    """
+
+    name = None
+
+    def encode(self, obj):
+        """
+        Encodes an object, returning a bytes-like object.
+        """
+
+        raise NotImplementedError
+
+    def decode(self, data):
+        """
+        Decodes an object from a memoryview. The memoryview is only valid for
+        the duration of the call, so the decoded object must not refer to it.
+        """
+
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """
+    Encodes payloads as UTF-8 JSON text.
+    """
+
+    name = "json"
+
+    def encode(self, obj):
+
+        return json.dumps(obj).encode("utf-8")
+
+    def decode(self, data):
+
+        return _json_decode(str(data, "utf-8"))[0]
+
+
+class PickleCodec(Codec):
+    """
+    Encodes payloads with pickle. Unpickling can run arbitrary code, so only
+    use this codec between a master and workers which trust each other.
+    """
+
+    name = "pickle"
+
+    def encode(self, obj):
+
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+
+        return pickle.loads(data)
+
+
+class RawCodec(Codec):
+    """
+    Sends bytes-like payloads as they are, without copying or re-encoding
+    them. Decoded payloads are bytes objects.
+    """
+
+    name = "raw"
+
+    def encode(self, obj):
+
+        return obj
+
+    def decode(self, data):
+
+        return bytes(data)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), PickleCodec(),
+                                          RawCodec())}
+
+# Codecs accepted by workers unless others are given. Pickle is left out since
+# a worker would otherwise run arbitrary code sent by the master.
+DEFAULT_WORKER_CODECS = ("json", "raw")
+
+
+def get_codec(name):
+    """
+    Gets a codec by name, raising a ValueError if it doesn't exist.
+    """
+
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError("unknown codec: {}".format(name)) from None
+
+
+def choose_codec(preferred, accepted):
+    """
+    Chooses the first codec in the preferred list of codec names which is also
+    in the accepted list. Returns None if there is no such codec.
+    """
+
+    for name in preferred:
+        if name in accepted:
+            return get_codec(name)
+    return None
+
+
+def encode_line(obj):
+    """
+    Encodes a handshake object as a line of JSON.
+    """
+
+    return (json.dumps(obj) + "\n").encode("utf-8")
+
+
+def decode_line(line):
+    """
+    Decodes a handshake object from a line of JSON.
+    """
+
+    return json.loads(str(line, "utf-8"))
+
+
+def byte_view(data):
+    """
+    Returns a flat byte memoryview of a bytes-like object without copying it.
+    """
+
+    view = memoryview(data)
+    if view.format != "B" or view.ndim != 1:
+        view = view.cast("B")
+    return view
+
+
+def is_array(obj):
+    """
+    Returns True if the object is a NumPy array which can be sent as a raw
+    buffer, and False otherwise. Arrays of Python objects have no meaningful
+    raw buffer, so they are left to the codec.
+    """
+
+    return (numpy is not None and isinstance(obj, numpy.ndarray)
+            and not obj.dtype.hasobject)
+
+
+def encode_payload(codec, obj):
+    """
+    Encodes a call or response object as a payload. Returns a flat byte
+    memoryview of the payload, and a dict of extras for the payload's header
+    entry, or None if there are no extras. NumPy arrays are not copied unless
+    they are not C-contiguous.
+    """
+
+    if is_array(obj):
+        array = numpy.ascontiguousarray(obj)
+        extras = {"array": [array.dtype.str, list(array.shape)]}
+        return memoryview(array.reshape(-1).view(numpy.uint8)), extras
+    return byte_view(codec.encode(obj)), None
+
+
+def payload_entry(call_id, payload, extras):
+    """
+    Makes the header entry for a payload.
+    """
+
+    if extras is None:
+        return [call_id, len(payload)]
+    return [call_id, len(payload), extras]
+
+
+def decode_payload(codec, entry, payload, *, copy=True):
+    """
+    Decodes a call or response object from a payload, given the payload's
+    header entry. NumPy arrays are rebuilt directly on top of the payload
+    buffer, and are copied out of it unless copy is False. Arrays which are
+    not copied are read-only.
+    """
+
+    if len(entry) > 2 and "array" in entry[2]:
+        if numpy is None:
+            raise RuntimeError("received a NumPy array, but NumPy is not "
+                               "installed")
+        dtype, shape = entry[2]["array"]
+        array = numpy.frombuffer(payload, dtype=dtype).reshape(shape)
+        return array.copy() if copy else array
+    return codec.decode(payload)
+
+
+def encode_frame(header, payloads=()):
+    """
+    Encodes a frame with a JSON header and a sequence of bytes-like payloads.
+    Returns a list of buffers to be written in order. Payloads are included
+    in the list as they are, without being copied.
+    """
+
+    header_encoded = json.dumps(header).encode("utf-8")
+    body_length = sum(len(payload) for payload in payloads)
+    prefix = FRAME_PREFIX.pack(len(header_encoded), body_length)
+    return [prefix, header_encoded] + list(payloads)
+
+
+def decode_header(header):
+    """
+    Decodes the JSON header of a frame.
+    """
+
+    return _json_decode(str(header, "utf-8"))[0]
+
+
+def split_payloads(items, body):
+    """
+    Splits a frame body into payload memoryviews. Items is a list of payload
+    header entries. Yields each entry alongside its payload.
+    """
+
+    offset = 0
+    for item in items:
+        end = offset + item[1]
+        yield item, body[offset:end]
+        offset = end
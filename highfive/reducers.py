@@ -0,0 +1,67 @@
+import operator
+
+
+# Reducers which every worker knows by name.
+BUILTIN_REDUCERS = {
+    "sum": operator.add,
+    "product": operator.mul,
+    "min": min,
+    "max": max,
+}
+
+# Default for the initial value of a reduction, meaning there is none.
+NO_INITIAL = object()
+
+
+def reducer_name(reducer):
+    """
+    Returns the name a reducer is known by on the workers. Built-in reducers
+    are named by a string, and other reducers are named by their module and
+    qualified name. Raises a ValueError for functions whose name doesn't tell
+    them apart from others, such as lambdas and functions defined inside
+    other functions, since a worker could otherwise reduce with the wrong
+    function.
+    """
+
+    if isinstance(reducer, str):
+        return reducer
+    module = getattr(reducer, "__module__", None)
+    qualname = getattr(reducer, "__qualname__", None)
+    if module is None or qualname is None or "<" in qualname:
+        raise ValueError("reducer must be a module-level function or a "
+                         "method of a module-level class: {!r}".format(
+                             reducer))
+    return "{}.{}".format(module, qualname)
+
+
+def resolve(reducer):
+    """
+    Returns the name and function of a reducer, given either the name of a
+    built-in reducer or a function.
+    """
+
+    if isinstance(reducer, str):
+        try:
+            return reducer, BUILTIN_REDUCERS[reducer]
+        except KeyError:
+            raise ValueError("unknown reducer: {}".format(reducer)) from None
+    if not callable(reducer):
+        raise TypeError("reducer must be a name or a function")
+    return reducer_name(reducer), reducer
+
+
+def reducer_table(reducers=()):
+    """
+    Returns a dict mapping names to functions for the built-in reducers and
+    the given reducer functions. Raises a ValueError if two different
+    functions have the same name.
+    """
+
+    table = dict(BUILTIN_REDUCERS)
+    for reducer in reducers:
+        name, function = resolve(reducer)
+        if table.get(name, function) is not function:
+            raise ValueError("more than one reducer named {}".format(name))
+        table[name] = function
+    return table
+
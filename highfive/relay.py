@@ -0,0 +1,373 @@
+import asyncio
+import functools
+import logging
+
+from . import compressors
+from . import jobs
+from . import master
+from . import protocol
+from . import reducers as reducer_functions
+from . import shared
+from . import worker
+
+
+logger = logging.getLogger(__name__)
+
+
+async def start_relay(upstream_host="localhost", upstream_port=48484,
+        host="", port=48485, *, codecs=protocol.DEFAULT_WORKER_CODECS,
+        compression=None, reducers=(),
+        shared_bytes=worker.DEFAULT_SHARED_BYTES, chunk_duration=None,
+        reconnect_delay=1, max_reconnect_delay=60, loop=None,
+        **master_options):
+    """
+    Starts a relay, which connects to an upstream master at upstream_host and
+    upstream_port as a single worker, and serves workers of its own at host
+    and port, so that workers can form a tree under one master. Returns the
+    Relay.
+
+    Downstream, the relay is a master, started by start_master() with the
+    remaining keyword arguments. Upstream, it is a worker whose number of
+    slots is the number of slots of its own workers, and it accepts the
+    given codecs, compressors and reducers, as described by handle_jobs().
+    The relay reconnects when it loses the upstream master, as workers do.
+
+    Chunks from the upstream master are split into one job per call, which
+    are chunked again for the relay's workers if chunk_duration is given, as
+    described by Master.run(). Their responses are gathered, and reduced by
+    the relay if the chunk names a reducer, before being sent upstream.
+    """
+
+    loop = loop if loop is not None else asyncio.get_event_loop()
+
+    downstream = await master.start_master(host, port, loop=loop,
+                                           **master_options)
+    return Relay(downstream, upstream_host, upstream_port, codecs=codecs,
+                 compression=compression, reducers=reducers,
+                 shared_bytes=shared_bytes, chunk_duration=chunk_duration,
+                 reconnect_delay=reconnect_delay,
+                 max_reconnect_delay=max_reconnect_delay, loop=loop)
+
+
+def run_relay(upstream_host="localhost", upstream_port=48484, host="",
+              port=48485, **options):
+    """
+    Runs a relay until it is interrupted. See start_relay() for the options.
+    """
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(None)
+    relay = None
+    try:
+        relay = loop.run_until_complete(start_relay(
+                upstream_host, upstream_port, host, port, loop=loop,
+                **options))
+        loop.run_until_complete(relay.wait_closed())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if relay is not None:
+            relay.close()
+            loop.run_until_complete(relay.wait_closed())
+        loop.close()
+
+
+class RelayCall:
+    """
+    A call from the upstream master, which is run by the relay's workers as
+    one job, or as one job per call if it is a chunk. Once every job has a
+    response, the call's response is sent upstream: the response itself, or
+    the list of responses to a chunk's calls, or their reduction if the chunk
+    has a reducer function.
+    """
+
+    def __init__(self, call_id, calls, respond, *, chunk=False, reducer=None):
+
+        self._call_id = call_id
+        self._respond = respond
+        self._chunk = chunk
+        self._reducer = reducer
+        self._responses = [None] * len(calls)
+        self._missing = len(calls)
+        self.jobs = [RelayJob(self, i, call) for i, call in enumerate(calls)]
+
+    def response_received(self, part, response):
+        """
+        Called when the response to one of the call's jobs is received.
+        """
+
+        self._responses[part] = response
+        self._missing -= 1
+        if self._missing > 0:
+            return
+
+        if not self._chunk:
+            response = self._responses[0]
+        elif self._reducer is not None:
+            response = functools.reduce(self._reducer, self._responses)
+        else:
+            response = self._responses
+        self._responses = None
+        self._respond(self._call_id, response)
+
+
+class RelayJob(jobs.Job):
+    """
+    One job of a call relayed from the upstream master. Its response is
+    handed to the call, and its result is not kept.
+    """
+
+    def __init__(self, relay_call, part, call):
+
+        self._relay_call = relay_call
+        self._part = part
+        self._call = call
+
+    def get_call(self):
+
+        return self._call
+
+    def get_result(self, response):
+
+        self._relay_call.response_received(self._part, response)
+        return None
+
+
+class Relay:
+    """
+    A relay between an upstream master and the relay's own workers. Each
+    connection to the upstream master runs a single streaming job set on the
+    downstream master, which is fed the calls the upstream master sends.
+    Calls which a downstream worker drops are requeued by the downstream
+    master. If the upstream connection is lost, the job set is cancelled,
+    since the upstream master requeues every call the relay hadn't answered.
+
+    Objects shared by the upstream master are shared downstream under the
+    same keys, and every relayed call is sent with all of them, since the
+    upstream master doesn't say which call uses which object. The relay
+    tells the upstream master about changes in the number of slots of its
+    workers every CAPACITY_INTERVAL seconds.
+    """
+
+    # seconds between checks of the downstream workers' slots
+    CAPACITY_INTERVAL = 0.5
+
+    def __init__(self, downstream, upstream_host, upstream_port, *, codecs,
+            compression, reducers, shared_bytes, chunk_duration,
+            reconnect_delay, max_reconnect_delay, loop):
+
+        self._master = downstream
+        self._upstream_host = upstream_host
+        self._upstream_port = upstream_port
+        self._codecs = codecs
+        self._compression = compression
+        self._reducers = reducer_functions.reducer_table(reducers)
+        self._shared_bytes = shared_bytes
+        self._chunk_duration = chunk_duration
+        self._backoff = worker.Backoff(reconnect_delay, max_reconnect_delay)
+        self._loop = loop
+
+        self._connected = False
+        self._slots = 0
+        self._in_flight = 0
+        self._closed = False
+
+        self._task = self._loop.create_task(self._run())
+
+    async def __aenter__(self):
+
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+
+        self.close()
+        await self.wait_closed()
+
+    async def _run(self):
+        """
+        Connects to the upstream master and relays its calls, reconnecting
+        whenever the connection can't be made or is lost.
+        """
+
+        while True:
+            if await self._run_connection():
+                self._backoff.reset()
+            delay = self._backoff.next_delay()
+            logger.info("relay reconnecting in {:.1f} seconds".format(delay))
+            await asyncio.sleep(delay)
+
+    async def _run_connection(self):
+        """
+        Connects to the upstream master once and relays its calls until the
+        connection ends. Returns True if the upstream master accepted the
+        relay, and False otherwise.
+        """
+
+        compression = self._compression
+        if compression is None:
+            compression = compressors.available()
+        self._slots = self._master.capacity()
+        connection = await worker.connect(
+                self._upstream_host, self._upstream_port, {
+                    "codecs": list(self._codecs),
+                    "slots": max(1, self._slots),
+                    "reducers": list(self._reducers),
+                    "shared_bytes": self._shared_bytes, "shared": {},
+                    "compression": list(compression)})
+        if connection is None:
+            return False
+        reader, writer, reply = connection
+
+        codec = protocol.get_codec(reply["codec"])
+        compressor, frames = worker.open_frames(writer, reply,
+                                                loop=self._loop)
+        responses = worker.ResponseWriter(writer, codec, frames=frames,
+                                          loop=self._loop)
+        self._connected = True
+        logger.debug("relay connected to upstream master")
+
+        def respond(call_id, response):
+            if not writer.is_closing():
+                self._in_flight -= 1
+                responses.add(call_id, response)
+
+        queue = asyncio.Queue()
+
+        async def relayed_jobs():
+            while True:
+                yield await queue.get()
+
+        handle = self._master.run(relayed_jobs(), streaming=True,
+                                  chunk_duration=self._chunk_duration)
+        shared_keys = set()
+        tasks = [self._loop.create_task(self._drain(handle)),
+                 self._loop.create_task(self._report_capacity(frames))]
+
+        try:
+
+            if self._slots == 0:
+                frames.write(protocol.encode_frame({"slots": 0}))
+
+            while True:
+
+                try:
+                    header, body = await worker.read_frame(
+                            reader, compressor, loop=self._loop)
+                except (asyncio.IncompleteReadError, ConnectionResetError):
+                    break
+                except ValueError as e:
+                    logger.error("bad frame from upstream master, "
+                                 "disconnecting: {}".format(e))
+                    break
+
+                if "ping" in header:
+                    frames.write(protocol.encode_frame(
+                            {"pong": header["ping"]}))
+
+                if "drop" in header or "shared" in header:
+                    entries = header.get("shared", ())
+                    if not all(shared.valid_key(entry[0])
+                               for entry in entries):
+                        logger.error("upstream master sent an invalid shared "
+                                     "object key, disconnecting")
+                        break
+                    for key in header.get("drop", ()):
+                        shared_keys.discard(key)
+                        self._master.unshare(key)
+                    for entry, payload in protocol.split_payloads(
+                            entries, memoryview(body)):
+                        obj = protocol.decode_payload(codec, entry, payload)
+                        shared_keys.add(self._master.share(obj,
+                                                           key=entry[0]))
+                    handle.set_shared(shared_keys)
+
+                for entry, payload in protocol.split_payloads(
+                        header.get("calls", ()), memoryview(body)):
+                    call = protocol.decode_payload(codec, entry, payload)
+                    extras = entry[2] if len(entry) > 2 else {}
+                    if extras.get("chunk"):
+                        reducer = None
+                        if "reduce" in extras:
+                            reducer = self._reducers[extras["reduce"]]
+                        relay_call = RelayCall(entry[0], call, respond,
+                                               chunk=True, reducer=reducer)
+                    else:
+                        relay_call = RelayCall(entry[0], [call], respond)
+                    self._in_flight += 1
+                    for job in relay_call.jobs:
+                        queue.put_nowait(job)
+
+        finally:
+
+            logger.warning("relay lost connection to upstream master")
+            self._connected = False
+            self._in_flight = 0
+            for task in tasks:
+                task.cancel()
+            handle.cancel()
+            frames.close()
+            writer.close()
+            for key in shared_keys:
+                self._master.unshare(key)
+
+        return True
+
+    async def _drain(self, handle):
+        """
+        Consumes the results of the relayed job set, which are all None,
+        so that they are not kept.
+        """
+
+        async for _ in handle.results():
+            pass
+
+    async def _report_capacity(self, frames):
+        """
+        Tells the upstream master whenever the number of slots of the
+        relay's workers changes.
+        """
+
+        while True:
+            await asyncio.sleep(self.CAPACITY_INTERVAL)
+            slots = self._master.capacity()
+            if slots != self._slots:
+                self._slots = slots
+                frames.write(protocol.encode_frame({"slots": slots}))
+
+    def stats(self):
+        """
+        Returns the downstream master's statistics, as described by
+        Master.stats(), with an "upstream" dict saying whether the relay is
+        connected to the upstream master, how many slots it last told the
+        upstream master it has, and how many of the upstream master's calls
+        it is running.
+        """
+
+        stats = self._master.stats()
+        stats["upstream"] = {
+            "connected": self._connected,
+            "slots": self._slots,
+            "in_flight": self._in_flight,
+        }
+        return stats
+
+    def close(self):
+        """
+        Starts closing the relay. The upstream connection is dropped, and the
+        downstream master is closed.
+        """
+
+        if self._closed:
+            return
+
+        self._closed = True
+        self._task.cancel()
+        self._master.close()
+
+    async def wait_closed(self):
+        """
+        Waits until the relay closes completely.
+        """
+
+        await asyncio.wait([self._task])
+        await self._master.wait_closed()
@@ -0,0 +1,185 @@
+import collections
+
+
+class Scheduler:
+    """
+    Interface for job set schedulers. A scheduler decides which job set the
+    job manager takes the next job from.
+    """
+
+    def add(self, js, *, priority=0, weight=1):
+        """
+        Adds an incomplete job set to the scheduler. Job sets with a higher
+        priority are preferred over job sets with a lower priority. The
+        meaning of the weight depends on the scheduler.
+        """
+
+        raise NotImplementedError
+
+    def remove(self, js):
+        """
+        Removes a job set from the scheduler, when it is completed or
+        cancelled. Removing a job set which was never added does nothing.
+        """
+
+        raise NotImplementedError
+
+    def next_job_set(self):
+        """
+        Chooses the job set to take the next job from, which must have a job
+        available. Returns None if no job set should be given a job right now.
+        The caller must take a job from the returned job set.
+        """
+
+        raise NotImplementedError
+
+    def job_sets(self):
+        """
+        Returns a list of all job sets in the scheduler.
+        """
+
+        raise NotImplementedError
+
+
+class FifoScheduler(Scheduler):
+    """
+    Runs one job set at a time, in order of priority and then in the order
+    they were added. Until the running job set is complete, no jobs are taken
+    from other job sets, even when all of its jobs are already running.
+    Weights are ignored.
+    """
+
+    def __init__(self):
+
+        self._job_sets = []
+        self._order = dict()
+        self._next_order = 0
+
+    def add(self, js, *, priority=0, weight=1):
+
+        self._order[js] = (-priority, self._next_order)
+        self._next_order += 1
+        self._job_sets.append(js)
+        self._job_sets.sort(key=self._order.__getitem__)
+
+    def remove(self, js):
+
+        if js in self._order:
+            del self._order[js]
+            self._job_sets.remove(js)
+
+    def next_job_set(self):
+
+        if len(self._job_sets) > 0 and self._job_sets[0].job_available():
+            return self._job_sets[0]
+        return None
+
+    def job_sets(self):
+
+        return list(self._job_sets)
+
+
+class FairScheduler(Scheduler):
+    """
+    Takes jobs from several job sets at once, so that workers never sit idle
+    while any job set has a job available. Job sets with the highest priority
+    are always served first, and lower priority job sets only receive jobs
+    when no higher priority job set has one available. Job sets of the same
+    priority share the workers in proportion to their weights, using deficit
+    round robin.
+    """
+
+    def __init__(self):
+
+        self._levels = dict()
+        self._priorities = []
+        self._js_priorities = dict()
+
+    def add(self, js, *, priority=0, weight=1):
+
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+
+        if priority not in self._levels:
+            self._levels[priority] = _DeficitRoundRobin()
+            self._priorities = sorted(self._levels, reverse=True)
+        self._levels[priority].add(js, weight)
+        self._js_priorities[js] = priority
+
+    def remove(self, js):
+
+        if js not in self._js_priorities:
+            return
+
+        priority = self._js_priorities.pop(js)
+        level = self._levels[priority]
+        level.remove(js)
+        if level.is_empty():
+            del self._levels[priority]
+            self._priorities = sorted(self._levels, reverse=True)
+
+    def next_job_set(self):
+
+        for priority in self._priorities:
+            js = self._levels[priority].next_job_set()
+            if js is not None:
+                return js
+        return None
+
+    def job_sets(self):
+
+        return list(self._js_priorities)
+
+
+class _DeficitRoundRobin:
+    """
+    Deficit round robin over the job sets of a single priority level. The job
+    set at the front of the ring gains its weight in credit at the start of
+    its turn, and spends one credit per job. Its turn ends when it runs out of
+    credit or jobs, and job sets without available jobs lose their credit.
+    """
+
+    def __init__(self):
+
+        self._ring = collections.deque()
+        self._weights = dict()
+        self._deficits = dict()
+        self._turn_started = False
+
+    def add(self, js, weight):
+
+        self._ring.append(js)
+        self._weights[js] = weight
+        self._deficits[js] = 0
+
+    def remove(self, js):
+
+        if len(self._ring) > 0 and self._ring[0] is js:
+            self._turn_started = False
+        self._ring.remove(js)
+        del self._weights[js]
+        del self._deficits[js]
+
+    def is_empty(self):
+
+        return len(self._ring) == 0
+
+    def next_job_set(self):
+
+        ring = self._ring
+        if not any(js.job_available() for js in ring):
+            return None
+
+        while True:
+            js = ring[0]
+            if js.job_available():
+                if not self._turn_started:
+                    self._deficits[js] += self._weights[js]
+                    self._turn_started = True
+                if self._deficits[js] >= 1:
+                    self._deficits[js] -= 1
+                    return js
+            else:
+                self._deficits[js] = 0
+            ring.rotate(-1)
+            self._turn_started = False
@@ -0,0 +1,242 @@
+import functools
+import json
+import os
+import re
+
+from . import cache
+from . import protocol
+
+
+# Shared object keys are SHA-256 hex digests, as returned by cache.call_key().
+# Workers use them as file names, so no other keys are accepted from a master.
+KEY_PATTERN = re.compile("[0-9a-f]{64}")
+
+
+def valid_key(key):
+    """
+    Returns True if a shared object key has the form of a content hash.
+    """
+
+    return isinstance(key, str) and KEY_PATTERN.fullmatch(key) is not None
+
+
+class SharedObjects:
+    """
+    Objects shared with the workers by the master, keyed by a hash of their
+    content. Each object is encoded at most once per codec, and the encoding
+    is kept for sending to workers which don't have the object yet.
+    """
+
+    def __init__(self):
+
+        self._objects = dict()
+        self._encoded = dict()
+
+    def __contains__(self, key):
+
+        return key in self._objects
+
+    def add(self, obj, key=None):
+        """
+        Adds an object, returning its key. Adding an object with the same
+        content as one which was already added returns the same key. If a key
+        is given, it is used instead, for objects relayed from another master
+        which already keyed them.
+        """
+
+        if key is None:
+            key = cache.call_key(obj)
+            if key is None:
+                raise ValueError("shared object can't be serialized")
+        elif not valid_key(key):
+            raise ValueError("invalid shared object key: {!r}".format(key))
+        self._objects.setdefault(key, obj)
+        return key
+
+    def remove(self, key):
+        """
+        Removes an object. Workers which already have it keep it until they
+        are told to drop it.
+        """
+
+        self._objects.pop(key, None)
+        for codec_key in [k for k in self._encoded if k[0] == key]:
+            del self._encoded[codec_key]
+
+    def encoded(self, key, codec):
+        """
+        Returns the payload and extras of an object encoded with a codec.
+        """
+
+        codec_key = (key, codec.name)
+        if codec_key not in self._encoded:
+            payload, extras = protocol.encode_payload(codec,
+                                                      self._objects[key])
+            self._encoded[codec_key] = (bytes(payload), extras)
+        return self._encoded[codec_key]
+
+
+class SharedStore:
+    """
+    A worker's copies of the objects shared by the master, keyed by content
+    hash. The master decides which objects the worker keeps, and tells it to
+    drop the least recently used ones when they would take up more than the
+    worker's advertised number of bytes.
+
+    If a directory is given, each object's payload is also written there,
+    so that other processes on the same host can load it, and a worker which
+    reconnects tells the master which objects it already has. Objects are
+    never deleted from the directory. NumPy arrays loaded from the directory
+    are memory-mapped, so processes share a single copy of them.
+    """
+
+    def __init__(self, directory=None):
+
+        self._directory = directory
+        self._objects = dict()
+
+    def keys(self):
+        """
+        Returns a dict mapping the keys of the objects in the directory to
+        their sizes in bytes.
+        """
+
+        if self._directory is None:
+            return {}
+        keys = dict()
+        for name in os.listdir(self._directory):
+            key = name[:-len(".json")]
+            if name.endswith(".json") and valid_key(key):
+                try:
+                    keys[key] = os.path.getsize(
+                            os.path.join(self._directory, key))
+                except OSError:
+                    pass
+        return keys
+
+    def add(self, key, codec, entry, payload):
+        """
+        Stores an object received from the master, given the codec and
+        header entry it was sent with. Raises a ValueError if the key isn't
+        a content hash, since it is used as a file name.
+        """
+
+        if not valid_key(key):
+            raise ValueError("invalid shared object key: {!r}".format(key))
+
+        self._objects[key] = protocol.decode_payload(codec, entry, payload)
+        if self._directory is not None:
+            path = os.path.join(self._directory, key)
+            _write_file(path, payload)
+            meta = {"codec": codec.name,
+                    "extras": entry[2] if len(entry) > 2 else None}
+            _write_file(path + ".json", json.dumps(meta).encode("utf-8"))
+
+    def drop(self, key):
+        """
+        Drops the in-memory copy of an object.
+        """
+
+        self._objects.pop(key, None)
+        _load_file.cache_clear()
+
+    def clear(self):
+        """
+        Drops the in-memory copies of all objects, for when the worker
+        reconnects and the master starts keeping track of them afresh.
+        """
+
+        self._objects.clear()
+        _load_file.cache_clear()
+
+    def get(self, key):
+        """
+        Returns a shared object, loading it from the directory if it is not
+        in memory. Raises a KeyError if the object is unknown.
+        """
+
+        try:
+            return self._objects[key]
+        except KeyError:
+            pass
+        if self._directory is None or not valid_key(key):
+            raise KeyError(key)
+        return _load_file(self._directory, key)
+
+
+def _write_file(path, data):
+    """
+    Writes a file atomically, so readers never see a partial file.
+    """
+
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_file(directory, key):
+    """
+    Loads and decodes a shared object from a directory. Arrays are built on
+    top of a read-only memory map of the file.
+    """
+
+    path = os.path.join(directory, key)
+    try:
+        with open(path + ".json", "rb") as f:
+            meta = json.loads(f.read().decode("utf-8"))
+    except FileNotFoundError:
+        raise KeyError(key) from None
+
+    entry = [key, 0] if meta["extras"] is None else [key, 0, meta["extras"]]
+    codec = protocol.get_codec(meta["codec"])
+    if meta["extras"] is not None and "array" in meta["extras"]:
+        array = protocol.numpy.memmap(path, mode="r", dtype="uint8")
+        return protocol.decode_payload(codec, entry, memoryview(array),
+                                       copy=False)
+    with open(path, "rb") as f:
+        return protocol.decode_payload(codec, entry, f.read())
+
+
+# The stores of the workers running in this process.
+_stores = []
+
+
+def register_store(store):
+    """
+    Makes a store's objects available to get_shared().
+    """
+
+    _stores.append(store)
+
+
+def unregister_store(store):
+    """
+    Stops get_shared() from looking objects up in a store.
+    """
+
+    _stores.remove(store)
+
+
+def open_directory(directory):
+    """
+    Registers a store which only reads objects from a directory, for pool
+    processes which run calls for a worker in another process.
+    """
+
+    register_store(SharedStore(directory))
+
+
+def get_shared(key):
+    """
+    Returns the object shared by the master under a key, for use by job
+    handlers. Raises a KeyError if the object is unknown.
+    """
+
+    for store in _stores:
+        try:
+            return store.get(key)
+        except KeyError:
+            pass
+    raise KeyError(key)
@@ -0,0 +1,163 @@
+import copy
+import json
+
+
+class JobTrace:
+    """
+    Timeline of a single call to a worker. Times are taken on the master with
+    time.perf_counter(), and are None until they are known:
+
+    - dispatched: the job was handed to the worker, before get_call()
+    - encoded: the call was encoded and added to the next batch
+    - sent: the batch holding the call was written to the connection
+    - received: the response was received and decoded
+    - completed: get_result() returned and the result was handed to the job
+      manager
+
+    queued_seconds and run_seconds are measured by the remote worker: the time
+    the call waited for a free slot, and the time the job handler ran for.
+    They are None if the worker did not report them.
+
+    The trace holds the job, and so its call, which may be large. Hooks which
+    keep traces after a call completes should keep a copy without the job.
+    """
+
+    def __init__(self, job, call_id, worker):
+
+        self.job = job
+        self.call_id = call_id
+        self.worker = worker
+
+        self.dispatched = None
+        self.encoded = None
+        self.sent = None
+        self.received = None
+        self.completed = None
+
+        self.queued_seconds = None
+        self.run_seconds = None
+
+
+class Hooks:
+    """
+    Interface for tracing hooks, which are called as each call to a worker
+    progresses. Hooks run on the master's event loop, so they must be quick.
+    """
+
+    def on_dispatch(self, trace):
+        """
+        Called when a call has been encoded and added to a worker's next
+        batch.
+        """
+
+        pass
+
+    def on_response(self, trace):
+        """
+        Called when a response has been received from a worker, before the
+        job's result is computed.
+        """
+
+        pass
+
+    def on_result(self, trace, result):
+        """
+        Called when the job's result has been computed and handed to the job
+        manager. The result is None if it was discarded, for example because
+        a speculative copy of the job finished first.
+        """
+
+        pass
+
+
+class ChromeTrace(Hooks):
+    """
+    Records every call and writes them as a Chrome trace-event JSON file,
+    which can be opened in chrome://tracing or Perfetto. Each worker slot is
+    shown as a row, and each call is split into get_call() and encoding,
+    waiting for its batch to be sent, network transit, queueing on the
+    worker, running the handler, and get_result().
+
+    Worker-side durations are placed so that the handler finishes when the
+    response arrives, so the transit span covers both directions.
+    """
+
+    def __init__(self, path):
+
+        self._path = path
+        self._traces = []
+
+    def on_result(self, trace, result):
+
+        # keep the timings, but not the job and its call
+        trace = copy.copy(trace)
+        trace.job = None
+        self._traces.append(trace)
+
+    def events(self):
+        """
+        Returns the recorded calls as a list of trace events.
+        """
+
+        events = []
+        if len(self._traces) == 0:
+            return events
+
+        origin = min(trace.dispatched for trace in self._traces)
+
+        def us(t):
+            return (t - origin) * 1e6
+
+        def span(name, tid, start, end, args=None):
+            if start is None or end is None:
+                return
+            event = {"name": name, "ph": "X", "pid": 1, "tid": tid,
+                     "ts": us(start), "dur": max(us(end) - us(start), 0)}
+            if args is not None:
+                event["args"] = args
+            events.append(event)
+
+        # each call goes in the first row of its worker which is free
+        lanes = dict()
+        lane_ends = dict()
+        for trace in sorted(self._traces, key=lambda t: t.dispatched):
+            ends = lane_ends.setdefault(trace.worker, [])
+            for lane, end in enumerate(ends):
+                if end <= trace.dispatched:
+                    break
+            else:
+                lane = len(ends)
+                ends.append(None)
+            ends[lane] = trace.completed
+            key = (trace.worker, lane)
+            if key not in lanes:
+                lanes[key] = len(lanes) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": 1,
+                               "tid": lanes[key], "args": {
+                                   "name": "{} #{}".format(*key)}})
+            tid = lanes[key]
+
+            span("call {}".format(trace.call_id), tid, trace.dispatched,
+                 trace.completed, {"queued": trace.queued_seconds,
+                                   "run": trace.run_seconds})
+            span("get_call", tid, trace.dispatched, trace.encoded)
+            span("batching", tid, trace.encoded, trace.sent)
+            run_start = queue_start = trace.received
+            if trace.run_seconds is not None:
+                run_start = trace.received - trace.run_seconds
+                queue_start = run_start - trace.queued_seconds
+                span("queued", tid, queue_start, run_start)
+                span("run", tid, run_start, trace.received)
+            span("transit", tid, trace.sent, max(queue_start, trace.sent))
+            span("get_result", tid, trace.received, trace.completed)
+
+        return events
+
+    def write(self):
+        """
+        Writes the trace file.
+        """
+
+        with open(self._path, "w") as f:
+            json.dump({"traceEvents": self.events(),
+                       "displayTimeUnit": "ms"}, f)
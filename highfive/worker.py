@@ -1,80 +1,774 @@
 import asyncio
+import collections
+import concurrent.futures
+import functools
 import multiprocessing
-import json
+import multiprocessing.connection
 import logging
+import random
+import tempfile
+import time
+
+from . import compressors
+from . import protocol
+from . import reducers as reducer_functions
+from . import shared
 
 
 logger = logging.getLogger(__name__)
 
+# Bytes of shared objects the master may have a worker keep by default.
+DEFAULT_SHARED_BYTES = 256 * 2 ** 20
+
 
-async def handle_jobs(job_handler, host, port, *, loop):
+async def read_frame(reader, compressor=None, *, loop=None):
     """
-    Connects to the remote master and continuously receives calls, executes
-    them, then returns a response until interrupted.
+    Reads a frame from the master, returning its decoded header and its body.
+    Compressed frames are decompressed with the connection's compressor,
+    on the loop's default executor if they are large. Raises a ValueError if
+    a compressed frame is corrupt or too large.
     """
 
-    try:
+    prefix = await reader.readexactly(protocol.FRAME_PREFIX.size)
+    header_length, body_length = protocol.FRAME_PREFIX.unpack(prefix)
+    header = protocol.decode_header(await reader.readexactly(header_length))
+    body = await reader.readexactly(body_length)
+    if "compressed" in header and compressor is not None:
+        size = header["compressed"]
+        if isinstance(size, int) and size >= compressors.OFFLOAD_BYTES:
+            header, body = await loop.run_in_executor(
+                    None, compressors.decompress_frame, compressor, header,
+                    body)
+        else:
+            header, body = compressors.decompress_frame(compressor, header,
+                                                        body)
+        header = protocol.decode_header(header)
+    return header, body
+
+
+class Chunk(list):
+    """
+    A chunk of calls sent by the master as a single call. Its response is the
+    list of the responses to its calls, or their reduction if it has a
+    reducer function.
+    """
+
+    reducer = None
+
+
+def run_call(job_handler, call):
+    """
+    Runs a call, or each call in a chunk, returning the response.
+    """
+
+    if type(call) is Chunk:
+        if call.reducer is not None:
+            return functools.reduce(call.reducer, map(job_handler, call))
+        return [job_handler(c) for c in call]
+    return job_handler(call)
+
+
+def run_calls(job_handler, calls):
+    """
+    Runs a list of calls one after another, returning a list of responses.
+    """
+
+    return [run_call(job_handler, call) for call in calls]
+
+
+def run_calls_timed(job_handler, calls):
+    """
+    Runs a list of calls one after another, returning a list of responses,
+    each with the times its call started and finished according to
+    time.perf_counter().
+    """
+
+    timed = []
+    for call in calls:
+        started = time.perf_counter()
+        response = run_call(job_handler, call)
+        timed.append((response, started, time.perf_counter()))
+    return timed
+
+
+class CallRunner:
+    """
+    Runs calls with a job handler, allowing up to concurrency calls to run at
+    once, and passes each response to the respond callback along with its
+    call ID. Coroutine function handlers are awaited on the event loop. Other
+    handlers are run by the named executor: "thread" runs them on a thread
+    pool, which suits I/O-bound handlers, "process" runs them on a pool of
+    local processes, which suits CPU-bound handlers, and "inline" runs them
+    directly on the event loop, one at a time.
+
+    Handing a call to an executor costs far more than running a tiny job, so
+    calls waiting for an executor slot are handed over in groups. Each group
+    takes an even share of the waiting calls among all of the slots, rather
+    than among the free ones, so that a slot which frees up while the others
+    are busy doesn't take every waiting call for itself. If the job
+    handler raises an exception, the fail callback is called instead.
+
+    Chunks of calls are run one call at a time, and count as a single call.
+
+    If timing is True, each response is passed to the respond callback with
+    a (queued, run) pair: the number of seconds the call waited between being
+    submitted and starting, and the number of seconds it ran for. Otherwise,
+    the timing is None.
+
+    The initializer is called with initargs in each process of the process
+    executor when it starts.
+    """
+
+    def __init__(self, job_handler, respond, fail, *, executor="thread",
+            concurrency=1, timing=False, initializer=None, initargs=(),
+            loop):
+
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        self._job_handler = job_handler
+        self._respond = respond
+        self._fail = fail
+        self._concurrency = concurrency
+        self._loop = loop
+
+        self._timing = timing
+        self._submitted = dict()
+
+        self._executor = None
+        self._pending = collections.deque()
+        self._running = 0
+        self._tasks = set()
+
+        if asyncio.iscoroutinefunction(job_handler):
+            self._mode = "async"
+        elif executor == "inline":
+            self._mode = "inline"
+        elif executor == "thread":
+            self._mode = "executor"
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=concurrency)
+        elif executor == "process":
+            self._mode = "executor"
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=concurrency, initializer=initializer,
+                    initargs=initargs)
+        else:
+            raise ValueError("unknown executor: {}".format(executor))
+
+    def _start_task(self, coro):
+        """
+        Starts a task which is cancelled if the runner is closed.
+        """
+
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _start_calls(self):
+        """
+        Starts running waiting calls while there are free slots.
+        """
+
+        while self._running < self._concurrency and len(self._pending) > 0:
+            n = -(-len(self._pending) // self._concurrency)
+            group = [self._pending.popleft() for _ in range(n)]
+            self._running += 1
+            if self._mode == "async":
+                self._start_task(self._run_async(group))
+            else:
+                self._start_task(self._run_in_executor(group))
+
+    async def _run_async(self, group):
+        """
+        Awaits the job handler for a group of calls in turn.
+        """
 
         try:
-            reader, writer = await asyncio.open_connection(host, port, loop=loop)
-        except OSError:
-            logging.error("worker could not connect to server")
+            for call_id, call in group:
+                if self._timing:
+                    started = time.perf_counter()
+                    response = await self._run_one(call)
+                    self._respond_timed(call_id, response, started,
+                                        time.perf_counter())
+                else:
+                    self._respond(call_id, await self._run_one(call), None)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._fail()
             return
+        finally:
+            self._running -= 1
 
-        while True:
+        self._start_calls()
 
+    async def _run_one(self, call):
+        """
+        Awaits the job handler for a call, or for each call in a chunk.
+        """
+
+        if type(call) is Chunk:
+            responses = [await self._job_handler(c) for c in call]
+            if call.reducer is not None:
+                return functools.reduce(call.reducer, responses)
+            return responses
+        return await self._job_handler(call)
+
+    async def _run_in_executor(self, group):
+        """
+        Runs a group of calls one after another in the executor.
+        """
+
+        run = run_calls_timed if self._timing else run_calls
+        try:
+            responses = await self._loop.run_in_executor(self._executor,
+                    run, self._job_handler, [call for _, call in group])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._fail()
+            return
+        finally:
+            self._running -= 1
+
+        if self._timing:
+            for (call_id, _), (response, started, finished) in zip(
+                    group, responses):
+                self._respond_timed(call_id, response, started, finished)
+        else:
+            for (call_id, _), response in zip(group, responses):
+                self._respond(call_id, response, None)
+        self._start_calls()
+
+    def _respond_timed(self, call_id, response, started, finished):
+        """
+        Passes a response to the respond callback along with its timing.
+        """
+
+        queued = started - self._submitted.pop(call_id)
+        self._respond(call_id, response, (queued, finished - started))
+
+    def submit(self, call_id, call):
+        """
+        Submits a call to be run. In inline mode, the call is run immediately.
+        """
+
+        if self._timing:
+            self._submitted[call_id] = time.perf_counter()
+
+        if self._mode == "inline":
+            started = time.perf_counter()
             try:
-                call_encoded = await reader.readuntil(b"\n")
-            except (asyncio.IncompleteReadError, ConnectionResetError):
-                break
-            logging.debug("worker got call")
-            call_json = call_encoded.decode("utf-8")
-            call = json.loads(call_json)
+                response = run_call(self._job_handler, call)
+            except Exception:
+                self._fail()
+                return
+            if self._timing:
+                self._respond_timed(call_id, response, started,
+                                    time.perf_counter())
+            else:
+                self._respond(call_id, response, None)
+        else:
+            self._pending.append((call_id, call))
+            self._start_calls()
+
+    def close(self):
+        """
+        Drops waiting calls, cancels running tasks and shuts down the executor
+        without waiting for calls which are already running in it.
+        """
+
+        self._pending.clear()
+        self._submitted.clear()
+        for task in self._tasks:
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class ResponseWriter:
+    """
+    Sends responses to the master. Responses finished during the same event
+    loop iteration are sent together as one frame. A response's timing, if
+    any, is sent in its header entry's extras. Frames are written with a
+    compressors.FrameWriter, which compresses large ones.
+    """
+
+    def __init__(self, writer, codec, *, frames, loop):
+
+        self._writer = writer
+        self._codec = codec
+        self._frames = frames
+        self._loop = loop
+
+        self._entries = []
+        self._payloads = []
+        self._flush_handle = None
+
+    def add(self, call_id, response, timing=None):
+        """
+        Queues a response to be sent at the end of the event loop iteration.
+        """
+
+        payload, extras = protocol.encode_payload(self._codec, response)
+        if timing is not None:
+            extras = dict(extras or (), timing=timing)
+        self._entries.append(protocol.payload_entry(call_id, payload, extras))
+        self._payloads.append(payload)
+
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        """
+        Sends all queued responses as one frame.
+        """
+
+        self._flush_handle = None
+
+        entries = self._entries
+        payloads = self._payloads
+        self._entries = []
+        self._payloads = []
+
+        if self._writer.is_closing():
+            return
+
+        self._frames.write(protocol.encode_frame(
+                {"responses": entries}, payloads))
+        logger.debug("worker returned responses")
+
+
+class Backoff:
+    """
+    Delays between attempts to reconnect to the master, growing exponentially
+    from initial seconds up to maximum seconds. Each delay is drawn uniformly
+    between zero and the current limit, so that many workers which lost the
+    master at the same moment don't all reconnect at the same moment.
+    """
+
+    def __init__(self, initial=1, maximum=60):
+
+        self._initial = initial
+        self._maximum = maximum
+        self._attempts = 0
+
+    def next_delay(self):
+        """
+        Returns the number of seconds to wait before the next attempt.
+        """
+
+        limit = min(self._maximum, self._initial * 2 ** self._attempts)
+        if limit < self._maximum:
+            self._attempts += 1
+        return random.uniform(0, limit)
+
+    def reset(self):
+        """
+        Starts the delays over, after an attempt succeeds.
+        """
+
+        self._attempts = 0
+
+
+async def handle_jobs(job_handler, host, port, *, executor="thread",
+        concurrency=1, codecs=protocol.DEFAULT_WORKER_CODECS, reducers=(),
+        shared_bytes=DEFAULT_SHARED_BYTES, shared_dir=None, compression=None,
+        reconnect=True, reconnect_delay=1, max_reconnect_delay=60, loop):
+    """
+    Connects to the remote master and continuously receives batches of calls,
+    executes them, then returns responses until interrupted. The codecs
+    parameter lists the names of the codecs the worker accepts, and the master
+    chooses one of them for the connection. Compression likewise lists the
+    names of the compressors the worker accepts, which by default are all of
+    those which are installed. The master may choose one of them to compress
+    large frames in both directions.
+
+    If reconnect is True, the worker connects again whenever it can't reach
+    the master or loses its connection, waiting a random delay given by a
+    Backoff between reconnect_delay and max_reconnect_delay seconds. The
+    delays start over once a connection is established. Otherwise, it
+    returns when the connection ends.
+
+    Up to concurrency calls are run at once, as described by CallRunner, and
+    the connection keeps being read while they run. The worker advertises its
+    concurrency to the master as its number of slots, and the master keeps
+    enough calls in flight to fill them. Responses are sent as calls finish,
+    so they may be returned in a different order than the calls arrived in.
+    If the master asks for timing, each response reports how long its call
+    was queued and how long it ran for. If the job handler raises an
+    exception, the worker disconnects, and calls it had not answered are
+    given to other workers.
+
+    Reducers lists reducer functions for map/reduce job sets, in addition to
+    the built-in ones. Chunks naming a reducer are reduced before their
+    response is sent.
+
+    Objects shared by the master are kept in a SharedStore, and the master is
+    told to keep them within shared_bytes. If shared_dir is given, they are
+    also written to that directory, so that other worker processes on the
+    host can load them, and objects already there are not sent again. The
+    process executor always uses a directory, which is temporary unless
+    shared_dir is given.
+    """
+
+    options = dict(executor=executor, concurrency=concurrency, codecs=codecs,
+                   reducers=reducer_functions.reducer_table(reducers),
+                   shared_bytes=shared_bytes, loop=loop,
+                   compression=(compressors.available() if compression is None
+                                else compression))
+
+    temp_dir = None
+    if shared_dir is None and executor == "process":
+        temp_dir = tempfile.TemporaryDirectory(prefix="highfive-")
+        shared_dir = temp_dir.name
+    store = shared.SharedStore(shared_dir)
+    shared.register_store(store)
+    backoff = Backoff(reconnect_delay, max_reconnect_delay)
+
+    try:
+
+        while True:
 
-            response = job_handler(call)
+            store.clear()
+            if await _run_connection(job_handler, host, port, store,
+                                     shared_dir, **options):
+                backoff.reset()
+            if not reconnect:
+                break
 
-            response_json = json.dumps(response) + "\n"
-            response_encoded = response_json.encode("utf-8")
-            writer.write(response_encoded)
-            logging.debug("worker returned response")
+            delay = backoff.next_delay()
+            logger.info("worker reconnecting in {:.1f} seconds".format(delay))
+            await asyncio.sleep(delay)
 
     except KeyboardInterrupt:
 
         pass
 
+    finally:
+
+        shared.unregister_store(store)
+        if temp_dir is not None:
+            temp_dir.cleanup()
 
-def worker_main(job_handler, host, port):
+
+async def connect(host, port, hello):
+    """
+    Connects to a master and sends it a hello object. Returns the stream
+    reader and writer and the master's reply, or None if the master can't be
+    reached or refuses the connection.
+    """
+
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        logging.error("worker could not connect to server")
+        return None
+
+    writer.write(protocol.encode_line(hello))
+    try:
+        reply = protocol.decode_line(await reader.readuntil(b"\n"))
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        logging.error("worker lost connection during handshake")
+        writer.close()
+        return None
+    if "error" in reply:
+        logging.error("master refused worker: {}".format(reply["error"]))
+        writer.close()
+        return None
+    return reader, writer, reply
+
+
+def open_frames(writer, reply, *, loop):
+    """
+    Returns the compressor the master chose in its reply, or None, and a
+    FrameWriter which writes frames to the master with it.
+    """
+
+    compressor = None
+    if "compression" in reply:
+        compressor = compressors.get_compressor(reply["compression"])
+    frames = compressors.FrameWriter(
+            lambda frame, size, seconds: writer.writelines(frame),
+            compressor, threshold=reply.get("compression_threshold",
+                                            compressors.DEFAULT_THRESHOLD),
+            loop=loop)
+    return compressor, frames
+
+
+async def _run_connection(job_handler, host, port, store, shared_dir, *,
+        executor, concurrency, codecs, reducers, shared_bytes, compression,
+        loop):
+    """
+    Connects to the remote master once and runs its calls until the
+    connection ends, as described by handle_jobs(). Reducers is a dict
+    mapping reducer names to functions. Returns True if the master accepted
+    the worker, and False otherwise.
+    """
+
+    connection = await connect(host, port, {
+            "codecs": list(codecs), "slots": concurrency,
+            "reducers": list(reducers), "shared_bytes": shared_bytes,
+            "shared": store.keys(), "compression": list(compression)})
+    if connection is None:
+        return False
+    reader, writer, reply = connection
+
+    try:
+
+        codec = protocol.get_codec(reply["codec"])
+        timing = reply.get("timing", False)
+
+        def fail():
+            logger.exception("job handler failed, disconnecting from master")
+            writer.close()
+
+        compressor, frames = open_frames(writer, reply, loop=loop)
+        responses = ResponseWriter(writer, codec, frames=frames, loop=loop)
+        runner = CallRunner(job_handler, responses.add, fail,
+                            executor=executor, concurrency=concurrency,
+                            timing=timing, initializer=shared.open_directory,
+                            initargs=(shared_dir,), loop=loop)
+
+        try:
+
+            while True:
+
+                try:
+                    header, body = await read_frame(reader, compressor,
+                                                    loop=loop)
+                except (asyncio.IncompleteReadError, ConnectionResetError):
+                    break
+                except ValueError as e:
+                    logger.error("bad frame from master, disconnecting: "
+                                 "{}".format(e))
+                    break
+                logging.debug("worker got calls")
+
+                if "ping" in header:
+                    frames.write(protocol.encode_frame(
+                            {"pong": header["ping"]}))
+
+                for key in header.get("drop", ()):
+                    store.drop(key)
+                entries = header.get("shared", ())
+                if not all(shared.valid_key(entry[0]) for entry in entries):
+                    logger.error("master sent an invalid shared object key, "
+                                 "disconnecting")
+                    break
+                for entry, payload in protocol.split_payloads(
+                        entries, memoryview(body)):
+                    store.add(entry[0], codec, entry, payload)
+
+                for entry, payload in protocol.split_payloads(
+                        header.get("calls", ()), memoryview(body)):
+                    call = protocol.decode_payload(codec, entry, payload,
+                                                   copy=False)
+                    if len(entry) > 2 and entry[2].get("chunk"):
+                        call = Chunk(call)
+                        if "reduce" in entry[2]:
+                            call.reducer = reducers[entry[2]["reduce"]]
+                    runner.submit(entry[0], call)
+
+        finally:
+
+            runner.close()
+            frames.close()
+
+        logger.warning("worker lost connection to master")
+        return True
+
+    finally:
+
+        writer.close()
+
+
+def worker_main(job_handler, host, port,
+        codecs=protocol.DEFAULT_WORKER_CODECS, executor="thread",
+        concurrency=1, reducers=(), shared_bytes=DEFAULT_SHARED_BYTES,
+        shared_dir=None, compression=None, reconnect=True, reconnect_delay=1,
+        max_reconnect_delay=60):
     """
     Starts an asyncio event loop to connect to the master and run jobs.
     """
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(None)
-    loop.run_until_complete(handle_jobs(job_handler, host, port, loop=loop))
+    loop.run_until_complete(handle_jobs(job_handler, host, port,
+                                        executor=executor,
+                                        concurrency=concurrency,
+                                        codecs=codecs, reducers=reducers,
+                                        shared_bytes=shared_bytes,
+                                        shared_dir=shared_dir,
+                                        compression=compression,
+                                        reconnect=reconnect,
+                                        reconnect_delay=reconnect_delay,
+                                        max_reconnect_delay=max_reconnect_delay,
+                                        loop=loop))
     loop.close()
 
 
+def run_worker(job_handler, host="localhost", port=48484, *,
+               executor="thread", concurrency=None,
+               codecs=protocol.DEFAULT_WORKER_CODECS, reducers=(),
+               shared_bytes=DEFAULT_SHARED_BYTES, shared_dir=None,
+               compression=None, reconnect=True, reconnect_delay=1,
+               max_reconnect_delay=60):
+    """
+    Runs a single worker which connects to a remote HighFive master and runs
+    up to concurrency calls at once over the one connection. See CallRunner
+    for the available executors. By default, concurrency is the number of
+    CPUs. Coroutine function job handlers are always awaited on the event
+    loop, whatever the executor. Reducers lists the reducer functions used by
+    the master's map/reduce job sets. Shared_bytes and shared_dir configure
+    how objects shared by the master are kept, compression lists the
+    compressors the worker accepts, and the reconnect options say whether
+    and how often it reconnects to the master, as described by
+    handle_jobs().
+    """
+
+    if concurrency is None:
+        concurrency = multiprocessing.cpu_count()
+
+    worker_main(job_handler, host, port, codecs=codecs, executor=executor,
+                concurrency=concurrency, reducers=reducers,
+                shared_bytes=shared_bytes, shared_dir=shared_dir,
+                compression=compression, reconnect=reconnect,
+                reconnect_delay=reconnect_delay,
+                max_reconnect_delay=max_reconnect_delay)
+
+
+def supervise(start_process, count, *, respawn=True, restart_delay=1,
+              max_restart_delay=60):
+    """
+    Starts count processes with start_process(), which returns a started
+    multiprocessing.Process, and waits for them to exit. If respawn is True,
+    each process which crashes, exiting with a nonzero code, is replaced
+    after a delay given by a Backoff between restart_delay and
+    max_restart_delay seconds, so a process which keeps crashing straight
+    away is restarted less and less often. Processes which exit cleanly are
+    not replaced. The
+    delays start over for a process which ran for at least
+    max_restart_delay seconds. The processes are terminated if the
+    supervisor is interrupted.
+    """
+
+    processes = [start_process() for _ in range(count)]
+    started = [time.monotonic()] * count
+    backoffs = [Backoff(restart_delay, max_restart_delay)
+                for _ in range(count)]
+    restarts = dict()
+
+    logger.debug("workers started")
+
+    try:
+
+        while True:
+
+            running = {p.sentinel: i for i, p in enumerate(processes)
+                       if p is not None}
+            if len(running) == 0 and len(restarts) == 0:
+                break
+            timeout = None
+            if len(restarts) > 0:
+                timeout = max(0, min(restarts.values()) - time.monotonic())
+            ready = multiprocessing.connection.wait(list(running), timeout)
+
+            now = time.monotonic()
+            for sentinel in ready:
+                i = running[sentinel]
+                processes[i].join()
+                exitcode = processes[i].exitcode
+                processes[i] = None
+                if not respawn or exitcode == 0:
+                    continue
+                if now - started[i] >= max_restart_delay:
+                    backoffs[i].reset()
+                delay = backoffs[i].next_delay()
+                logger.warning("worker process exited with code {}, "
+                               "restarting it in {:.1f} seconds".format(
+                                       exitcode, delay))
+                restarts[i] = now + delay
+
+            for i, due in list(restarts.items()):
+                if due <= now:
+                    del restarts[i]
+                    processes[i] = start_process()
+                    started[i] = now
+
+    finally:
+
+        for p in processes:
+            if p is not None and p.is_alive():
+                p.terminate()
+            if p is not None:
+                p.join()
+
+    logger.debug("all workers completed")
+
+
 def run_worker_pool(job_handler, host="localhost", port=48484,
-                      *, max_workers=None):
+                      *, max_workers=None, multiplex=False,
+                      codecs=protocol.DEFAULT_WORKER_CODECS, reducers=(),
+                      shared_bytes=DEFAULT_SHARED_BYTES, shared_dir=None,
+                      compression=None, reconnect=True, reconnect_delay=1,
+                      max_reconnect_delay=60, respawn=True):
     """
     Runs a pool of workers which connect to a remote HighFive master and begin
-    executing calls.
+    executing calls. The codecs parameter lists the names of the codecs the
+    workers accept. The pickle codec must be listed explicitly, since it lets
+    the master run arbitrary code on the workers.
+    Reducers lists the reducer functions used by the master's map/reduce job
+    sets, and compression lists the compressors the workers accept.
+
+    Objects shared by the master are written to shared_dir, or to a temporary
+    directory, where every process of the pool can load them. Each process
+    keeps up to shared_bytes of them in memory.
+
+    By default, each worker process opens its own connection to the master.
+    If multiplex is True, a single supervisor process holds one connection,
+    advertises max_workers slots to the master, and fans calls out to a pool
+    of max_workers child processes over pipes.
+
+    Workers reconnect to the master as described by handle_jobs(). If
+    respawn is True, worker processes which crash are restarted by
+    supervise(), with the same delays as reconnecting. In multiplex mode, a
+    broken pool of child processes makes the worker disconnect, and it is
+    replaced when the worker reconnects.
     """
 
     if max_workers is None:
         max_workers = multiprocessing.cpu_count()
 
-    processes = []
-    for _ in range(max_workers):
-        p = multiprocessing.Process(target=worker_main,
-                args=(job_handler, host, port))
-        p.start()
-        processes.append(p)
+    temp_dir = None
+    if shared_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="highfive-")
+        shared_dir = temp_dir.name
 
-    logger.debug("workers started")
+    options = dict(reducers=reducers, shared_bytes=shared_bytes,
+                   shared_dir=shared_dir, compression=compression,
+                   reconnect=reconnect, reconnect_delay=reconnect_delay,
+                   max_reconnect_delay=max_reconnect_delay)
+
+    try:
 
-    for p in processes:
-        p.join()
+        if multiplex:
+            run_worker(job_handler, host, port, executor="process",
+                       concurrency=max_workers, codecs=codecs, **options)
+            return
 
-    logger.debug("all workers completed")
+        def start_process():
+            p = multiprocessing.Process(target=worker_main,
+                    args=(job_handler, host, port, codecs), kwargs=options)
+            p.start()
+            return p
+
+        supervise(start_process, max_workers, respawn=respawn,
+                  restart_delay=reconnect_delay,
+                  max_restart_delay=max_reconnect_delay)
+
+    finally:
 
+        if temp_dir is not None:
+            temp_dir.cleanup()
@@ -32,6 +32,9 @@ setup(
         "Topic :: Software Development",
         "Topic :: System :: Distributed Computing",
     ],
+    extras_require = {
+        "numpy": ["numpy"],
+    },
     test_suite = "test",
 )
 
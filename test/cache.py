@@ -0,0 +1,131 @@
+import os
+import tempfile
+import unittest
+
+import highfive.cache as cache
+
+
+class TestCallKey(unittest.TestCase):
+
+    def test_equal_calls(self):
+
+        self.assertEqual(cache.call_key({"a": 1, "b": [1, 2]}),
+                         cache.call_key({"b": (1, 2), "a": 1}))
+
+    def test_different_calls(self):
+
+        self.assertNotEqual(cache.call_key([1, 2]), cache.call_key([2, 1]))
+        self.assertNotEqual(cache.call_key("ab"), cache.call_key(b"ab"))
+
+    def test_pickle_fallback(self):
+
+        self.assertEqual(cache.call_key({1, 2}), cache.call_key({2, 1}))
+
+    def test_unserializable(self):
+
+        self.assertIsNone(cache.call_key(lambda: None))
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_get_put(self):
+
+        c = cache.MemoryCache()
+
+        self.assertEqual(c.get("k"), (False, None))
+
+        c.put("k", "v")
+
+        self.assertEqual(c.get("k"), (True, "v"))
+
+    def test_lru(self):
+
+        c = cache.MemoryCache(2)
+        c.put("a", 1)
+        c.put("b", 2)
+        c.get("a")
+        c.put("c", 3)
+
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.get("a"), (True, 1))
+        self.assertEqual(c.get("b"), (False, None))
+
+    def test_ttl(self):
+
+        c = cache.MemoryCache(ttl=-1)
+        c.put("k", "v")
+
+        self.assertEqual(c.get("k"), (False, None))
+        self.assertEqual(len(c), 0)
+
+
+class TestSqliteCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "cache.db")
+
+    def tearDown(self):
+
+        self.dir.cleanup()
+
+    def test_persistent(self):
+
+        c = cache.SqliteCache(self.path)
+        c.put("k", {"v": [1, 2]})
+        c.put("k", {"v": [3]})
+        c.close()
+
+        c = cache.SqliteCache(self.path)
+
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.get("k"), (True, {"v": [3]}))
+        self.assertEqual(c.get("other"), (False, None))
+
+        c.close()
+
+    def test_max_entries(self):
+
+        c = cache.SqliteCache(self.path, max_entries=2)
+        for i in range(5):
+            c.put(str(i), i)
+
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.get("4"), (True, 4))
+        self.assertEqual(c.get("0"), (False, None))
+
+        c.close()
+
+    def test_ttl(self):
+
+        c = cache.SqliteCache(self.path, ttl=-1)
+        c.put("k", "v")
+
+        self.assertEqual(c.get("k"), (False, None))
+        self.assertEqual(len(c), 0)
+
+        c.close()
+
+
+class TestTieredCache(unittest.TestCase):
+
+    def test_promote(self):
+
+        fast = cache.MemoryCache()
+        slow = cache.MemoryCache()
+        c = cache.TieredCache(fast, slow)
+
+        slow.put("k", "v")
+
+        self.assertEqual(c.get("k"), (True, "v"))
+        self.assertEqual(fast.get("k"), (True, "v"))
+
+        c.put("j", "w")
+
+        self.assertEqual(fast.get("j"), (True, "w"))
+        self.assertEqual(slow.get("j"), (True, "w"))
+
+
+if __name__ == "__main__":
+    unittest.main()
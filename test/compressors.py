@@ -0,0 +1,132 @@
+import asyncio
+import os
+import unittest
+
+import highfive.compressors as compressors
+import highfive.protocol as protocol
+
+
+def make_frame(text):
+
+    payload = text.encode("utf-8")
+    return protocol.encode_frame({"calls": [[0, len(payload)]]}, [payload])
+
+
+def read_frame(data):
+
+    header_length, body_length = protocol.FRAME_PREFIX.unpack_from(data)
+    start = protocol.FRAME_PREFIX.size
+    header = protocol.decode_header(data[start:start+header_length])
+    return header, data[start+header_length:start+header_length+body_length]
+
+
+class TestCompressors(unittest.TestCase):
+
+    def test_choose(self):
+
+        self.assertEqual(compressors.choose_compressor(
+                ("zlib",), ["lz4", "zlib"]).name, "zlib")
+        self.assertIsNone(compressors.choose_compressor(("zlib",), []))
+
+    def test_unknown(self):
+
+        with self.assertRaises(ValueError):
+            compressors.check_names(["gzip"])
+
+    def test_round_trip(self):
+
+        for name in compressors.available():
+            compressor = compressors.get_compressor(name)
+            frame = make_frame("abc" * 1000)
+            size = compressors.frame_size(frame)
+            compressed = b"".join(compressors.compress_frame(
+                    compressor, frame, size))
+
+            self.assertLess(len(compressed), size)
+
+            header, body = read_frame(compressed)
+            header, body = compressors.decompress_frame(compressor, header,
+                                                        body)
+
+            self.assertEqual(protocol.decode_header(header),
+                             {"calls": [[0, 3000]]})
+            self.assertEqual(bytes(body), b"abc" * 1000)
+
+    def test_bad_size(self):
+
+        compressor = compressors.get_compressor("zlib")
+        frame = make_frame("abc" * 1000)
+        size = compressors.frame_size(frame)
+        compressed = b"".join(compressors.compress_frame(compressor, frame,
+                                                         size))
+        header, body = read_frame(compressed)
+
+        for claimed in (size - 1, size + 1, compressors.MAX_FRAME_BYTES + 1,
+                        "big"):
+            with self.assertRaises(ValueError):
+                compressors.decompress_frame(
+                        compressor, {"compressed": claimed}, body)
+
+    def test_corrupt(self):
+
+        with self.assertRaises(ValueError):
+            compressors.decompress_frame(
+                    compressors.get_compressor("zlib"),
+                    {"compressed": 100}, b"not zlib data")
+
+
+class TestFrameWriter(unittest.TestCase):
+
+    def make_writer(self, **options):
+
+        written = []
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        writer = compressors.FrameWriter(
+                lambda frame, size, seconds: written.append(
+                        (b"".join(frame), size)),
+                compressors.get_compressor("zlib"), loop=loop, **options)
+        return writer, written, loop
+
+    def test_threshold(self):
+
+        writer, written, loop = self.make_writer(threshold=100)
+        small = make_frame("a")
+        large = make_frame("a" * 1000)
+        writer.write(small)
+        writer.write(large)
+
+        self.assertEqual(written[0], (b"".join(small), len(b"".join(small))))
+        self.assertIn("compressed", read_frame(written[1][0])[0])
+        self.assertEqual(written[1][1], len(b"".join(large)))
+
+    def test_incompressible(self):
+
+        writer, written, loop = self.make_writer(threshold=100)
+        frame = protocol.encode_frame({}, [os.urandom(1000)])
+        writer.write(frame)
+
+        self.assertEqual(written[0][0], b"".join(frame))
+
+    def test_offload_keeps_order(self):
+
+        writer, written, loop = self.make_writer(threshold=100,
+                                                 offload_bytes=10000)
+        writer.write(make_frame("a" * 100000))
+        writer.write(make_frame("b"))
+        writer.write(make_frame("c" * 1000))
+
+        self.assertEqual(written, [])
+
+        async def wait():
+            while len(written) < 3:
+                await asyncio.sleep(0.001)
+        loop.run_until_complete(asyncio.wait_for(wait(), 5))
+
+        self.assertIn("compressed", read_frame(written[0][0])[0])
+        self.assertEqual(written[1][0], b"".join(make_frame("b")))
+        self.assertIn("compressed", read_frame(written[2][0])[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
 import asyncio
 import unittest
 
+import highfive.cache as cache
 import highfive.jobs as jobs
+import highfive.reducers as reducers
+import highfive.scheduling as scheduling
 
 
 class TestDefaultJob(unittest.TestCase):
@@ -57,6 +60,189 @@ class TestResults(unittest.TestCase):
         self.assertTrue(results.is_complete())
 
 
+class MockConsumer:
+
+    def __init__(self, i=0):
+
+        self._i = i
+
+    def position(self):
+
+        return self._i
+
+
+class TestStreamingResults(unittest.TestCase):
+
+    def test_no_consumers_keeps_results(self):
+
+        results = jobs.Results(streaming=True, loop=None)
+
+        for i in range(3):
+            results.add(i)
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0], 0)
+
+    def test_drop_consumed(self):
+
+        results = jobs.Results(streaming=True, loop=None)
+        c1 = MockConsumer()
+        c2 = MockConsumer()
+        results.register(c1)
+        results.register(c2)
+
+        for i in range(4):
+            results.add(i)
+
+        c1._i = 3
+        c2._i = 2
+        results.consumer_advanced()
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results.first_index(), 2)
+        self.assertEqual(results[2], 2)
+        self.assertEqual(results[-1], 3)
+        with self.assertRaises(IndexError):
+            results[1]
+
+        results.unregister(c2)
+
+        self.assertEqual(results.first_index(), 3)
+
+    def test_high_water(self):
+
+        drained = []
+        results = jobs.Results(streaming=True, high_water=2,
+                               on_drain=lambda: drained.append(True),
+                               loop=None)
+        c = MockConsumer()
+        results.register(c)
+
+        results.add(0)
+
+        self.assertFalse(results.is_full())
+
+        results.add(1)
+
+        self.assertTrue(results.is_full())
+
+        c._i = 1
+        results.consumer_advanced()
+
+        self.assertFalse(results.is_full())
+        self.assertEqual(drained, [True])
+
+
+class TestResultOrder(unittest.TestCase):
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+
+        self.loop.close()
+
+    def collect(self, iterator):
+
+        async def run():
+            return [result async for result in iterator]
+
+        return self.loop.run_until_complete(run())
+
+    def make_results(self, indices, **kwargs):
+
+        results = jobs.Results(loop=self.loop, **kwargs)
+        for index in indices:
+            results.add("r{}".format(index), index)
+        results.complete()
+        return results
+
+    def test_completion_order(self):
+
+        results = self.make_results([2, 0, 1])
+
+        self.assertEqual(self.collect(results.aiter()), ["r2", "r0", "r1"])
+
+    def test_indexed(self):
+
+        results = self.make_results([2, 0, 1])
+
+        self.assertEqual(self.collect(results.aiter(indexed=True)),
+                         [(2, "r2"), (0, "r0"), (1, "r1")])
+
+    def test_ordered(self):
+
+        results = self.make_results([2, 0, 3, 1])
+
+        self.assertEqual(self.collect(results.aiter(ordered=True)),
+                         ["r0", "r1", "r2", "r3"])
+        self.assertEqual(self.collect(results.aiter(ordered=True,
+                                                    indexed=True)),
+                         [(0, "r0"), (1, "r1"), (2, "r2"), (3, "r3")])
+
+    def test_ordered_skips_missing(self):
+
+        results = self.make_results([3, 1])
+
+        self.assertEqual(self.collect(results.aiter(ordered=True)),
+                         ["r1", "r3"])
+
+    def test_ordered_buffer_counts_towards_high_water(self):
+
+        results = jobs.Results(streaming=True, high_water=2, loop=self.loop)
+        iterator = results.aiter(ordered=True)
+
+        results.add("r1", 1)
+        results.add("r2", 2)
+
+        self.assertTrue(results.is_full())
+
+        results.add("r0", 0)
+
+        self.assertEqual(self.loop.run_until_complete(iterator.__anext__()),
+                         "r0")
+        self.assertEqual(results.first_index(), 0)
+        self.assertEqual(self.loop.run_until_complete(iterator.__anext__()),
+                         "r1")
+        self.assertEqual(results.first_index(), 1)
+
+    def test_ordered_after_drop(self):
+
+        results = jobs.Results(streaming=True, loop=self.loop)
+        iterator = results.aiter()
+
+        results.add("r1", 1)
+        results.add("r0", 0)
+
+        self.assertEqual(self.loop.run_until_complete(iterator.__anext__()),
+                         "r1")
+        self.assertEqual(self.loop.run_until_complete(iterator.__anext__()),
+                         "r0")
+        self.assertEqual(results.first_index(), 2)
+
+        # the iterator would wait for results which were already dropped
+        with self.assertRaises(ValueError):
+            results.aiter(ordered=True)
+
+    def test_job_set_indices(self):
+
+        m = jobs.JobManager(loop=self.loop)
+        handle = m.add_job_set(range(3))
+
+        getters = [JobGetter() for _ in range(3)]
+        for g in getters:
+            m.get_job(g.callback)
+        for g in reversed(getters):
+            m.add_result(g._job, g._job.get_call())
+
+        self.assertEqual(self.collect(handle.results()), [2, 1, 0])
+        self.assertEqual(self.collect(handle.results(ordered=True)),
+                         [0, 1, 2])
+
+        m.close()
+
+
 class MockResults:
 
     def __init__(self):
@@ -64,7 +250,7 @@ class MockResults:
         self._results = []
         self._complete = False
 
-    def add(self, result):
+    def add(self, result, index=None):
 
         assert not self._complete
         self._results.append(result)
@@ -74,12 +260,21 @@ class MockResults:
         assert not self._complete
         self._complete = True
 
+    def is_full(self):
+
+        return False
+
 
 class MockManager:
 
-    def __init__(self):
+    def __init__(self, capacity=1):
 
         self._done = set()
+        self._capacity = capacity
+
+    def capacity(self):
+
+        return self._capacity
 
     def job_set_done(self, js):
 
@@ -127,6 +322,73 @@ class TestJobSet(unittest.TestCase):
         self.assertEqual(len(r._results), 2)
         self.assertTrue(r._complete)
 
+    def test_remaining(self):
+
+        js = jobs.JobSet(range(3), MockResults(), MockManager(), loop=None)
+
+        self.assertEqual(js.remaining(), 3)
+
+        j = js.get_job()
+
+        self.assertEqual(js.remaining(), 2)
+
+        js.return_job(j)
+
+        self.assertEqual(js.remaining(), 3)
+
+        js = jobs.JobSet((i for i in range(3)), MockResults(), MockManager(),
+                         loop=None)
+
+        self.assertIsNone(js.remaining())
+
+    def test_chunks(self):
+
+        r = MockResults()
+        js = jobs.JobSet(range(10), r, MockManager(capacity=2),
+                         chunk_duration=1, loop=None)
+
+        # nothing has been measured yet
+        c = js.get_job()
+
+        self.assertIsInstance(c, jobs.ChunkJob)
+        self.assertEqual(c.get_call(), [0])
+
+        # 0.1 seconds per job
+        c.started -= 0.1
+        js.add_result(c.get_result(["a"]), job=c)
+
+        self.assertEqual(r._results, ["a"])
+
+        # ten jobs would take a second, but only nine remain for two slots
+        c = js.get_job()
+
+        self.assertEqual(c.get_call(), [1, 2, 3, 4, 5])
+
+        js.add_result(c.get_result(["b", "c", "d", "e", "f"]), job=c)
+
+        self.assertEqual(r._results, ["a", "b", "c", "d", "e", "f"])
+        self.assertEqual(js.chunk_size(), 2)
+        self.assertEqual(js.remaining_calls(), 2)
+
+    def test_returned_chunk(self):
+
+        js = jobs.JobSet(range(10), MockResults(), MockManager(),
+                         chunk_duration=1, loop=None)
+        js._job_seconds = 0.5
+
+        c = js.get_job()
+        c.started -= 100
+        js.return_job(c)
+
+        self.assertEqual(js.remaining(), 10)
+        self.assertIs(js.get_job(), c)
+        self.assertEqual(len(c), 2)
+
+        # the chunk's time on the worker which dropped it isn't measured
+        js.add_result(c.get_result([0, 1]), job=c)
+
+        self.assertLess(js._job_seconds, 1)
+
     def test_return(self):
 
         r = MockResults()
@@ -403,6 +665,565 @@ class TestJobManager(unittest.TestCase):
 
         m.close()
 
+    def test_capacity(self):
+
+        m = jobs.JobManager(loop=None)
+
+        self.assertEqual(m.capacity(), 0)
+
+        m.add_capacity(4)
+        m.add_capacity(1)
+
+        self.assertEqual(m.capacity(), 5)
+
+        m.remove_capacity(4)
+
+        self.assertEqual(m.capacity(), 1)
+
+        m.close()
+
+    def test_high_water_pauses(self):
+
+        m = jobs.JobManager(loop=None)
+
+        handle = m.add_job_set(range(5), streaming=True, high_water=2)
+        c = MockConsumer()
+        handle._results.register(c)
+
+        for _ in range(2):
+            g = JobGetter()
+            m.get_job(g.callback)
+            m.add_result(g._job, g._job.get_call())
+
+        g = JobGetter()
+        m.get_job(g.callback)
+
+        self.assertIsNone(g._job)
+
+        c._i = 1
+        handle._results.consumer_advanced()
+
+        self.assertEqual(g._job.get_call(), 2)
+
+        m.close()
+
+    def test_job_timeout(self):
+
+        m = jobs.JobManager(job_timeout=10, loop=None)
+
+        m.add_job_set(range(1))
+        m.add_job_set(range(1), job_timeout=2)
+
+        g1 = JobGetter()
+        m.get_job(g1.callback)
+
+        self.assertEqual(m.job_timeout(g1._job), 10)
+
+        m.add_result(g1._job, "done")
+
+        g2 = JobGetter()
+        m.get_job(g2.callback)
+
+        self.assertEqual(m.job_timeout(g2._job), 2)
+
+        m.close()
+
+    def test_chunk_job_timeout(self):
+
+        m = jobs.JobManager(job_timeout=10, loop=None)
+        handle = m.add_job_set(range(3), chunk_duration=1)
+        handle._js._job_seconds = 0.1
+
+        g = JobGetter()
+        m.get_job(g.callback)
+
+        # the timeout applies to each of the chunk's jobs
+        self.assertEqual(len(g._job), 3)
+        self.assertEqual(m.job_timeout(g._job), 30)
+
+        m.close()
+
+
+class TestJobManagerSpeeds(unittest.TestCase):
+
+    def test_tail_held_for_fast_worker(self):
+
+        m = jobs.JobManager(loop=None)
+        m.set_worker_speed("fast", 10, 0.1)
+        m.set_worker_speed("slow", 0.1, 10)
+        handle = m.add_job_set(range(1))
+
+        slow = JobGetter()
+        m.get_job(slow.callback, worker="slow")
+
+        self.assertIsNone(slow._job)
+
+        fast = JobGetter()
+        m.get_job(fast.callback, worker="fast")
+
+        self.assertEqual(fast._job.get_call(), 0)
+        self.assertIsNone(slow._job)
+
+        m.close()
+
+    def test_slow_worker_helps_large_set(self):
+
+        m = jobs.JobManager(loop=None)
+        m.set_worker_speed("fast", 10, 0.1)
+        m.set_worker_speed("slow", 0.1, 10)
+        m.add_job_set(range(200))
+
+        slow = JobGetter()
+        m.get_job(slow.callback, worker="slow")
+
+        self.assertEqual(slow._job.get_call(), 0)
+
+        m.close()
+
+    def test_fastest_waiting_worker_chosen(self):
+
+        m = jobs.JobManager(loop=None)
+        m.set_worker_speed("a", 1, 1)
+        m.set_worker_speed("b", 2, 0.5)
+
+        a = JobGetter()
+        m.get_job(a.callback, worker="a")
+        b = JobGetter()
+        m.get_job(b.callback, worker="b")
+        m.add_job_set(range(1))
+
+        self.assertIsNone(a._job)
+        self.assertEqual(b._job.get_call(), 0)
+
+        m.close()
+
+    def test_forget_releases_held_jobs(self):
+
+        m = jobs.JobManager(loop=None)
+        m.set_worker_speed("fast", 10, 0.1)
+        m.set_worker_speed("slow", 0.1, 10)
+        m.add_job_set(range(1))
+
+        slow = JobGetter()
+        m.get_job(slow.callback, worker="slow")
+
+        self.assertIsNone(slow._job)
+
+        m.forget_worker_speed("fast")
+
+        self.assertEqual(slow._job.get_call(), 0)
+
+        m.close()
+
+    def test_unknown_size_not_held(self):
+
+        m = jobs.JobManager(loop=None)
+        m.set_worker_speed("fast", 10, 0.1)
+        m.set_worker_speed("slow", 0.1, 10)
+        m.add_job_set(i for i in range(1))
+
+        slow = JobGetter()
+        m.get_job(slow.callback, worker="slow")
+
+        self.assertEqual(slow._job.get_call(), 0)
+
+        m.close()
+
+
+class TestJobManagerCache(unittest.TestCase):
+
+    def test_hit_skips_worker(self):
+
+        c = cache.MemoryCache()
+        c.put(cache.call_key(1), "cached")
+        m = jobs.JobManager(cache=c, loop=None)
+
+        handle = m.add_job_set(range(3))
+        results = handle._results
+
+        # the cached job is answered before any worker asks for a job
+        self.assertEqual(len(results), 0)
+
+        g = JobGetter()
+        m.get_job(g.callback)
+
+        self.assertEqual(g._job.get_call(), 0)
+        self.assertEqual(results[0], "cached")
+
+        m.add_response(g._job, "zero")
+
+        g = JobGetter()
+        m.get_job(g.callback)
+
+        self.assertEqual(g._job.get_call(), 2)
+        self.assertEqual(c.get(cache.call_key(0)), (True, "zero"))
+
+        m.close()
+
+    def test_all_hits(self):
+
+        c = cache.MemoryCache()
+        for i in range(3):
+            c.put(cache.call_key(i), i * 10)
+        m = jobs.JobManager(cache=c, loop=None)
+
+        handle = m.add_job_set(range(3))
+
+        self.assertTrue(handle._results.is_complete())
+        self.assertEqual(list(handle._results), [0, 10, 20])
+
+        m.close()
+
+    def test_inflight_dedup(self):
+
+        m = jobs.JobManager(cache=cache.MemoryCache(),
+                            scheduler=scheduling.FairScheduler(), loop=None)
+
+        h1 = m.add_job_set(["x"])
+        h2 = m.add_job_set(["x", "y"])
+
+        g1 = JobGetter()
+        m.get_job(g1.callback)
+        g2 = JobGetter()
+        m.get_job(g2.callback)
+
+        # only one of the two "x" jobs is handed out
+        x = {g1._job.get_call(): g1._job, g2._job.get_call(): g2._job}
+
+        self.assertEqual(sorted(x), ["x", "y"])
+
+        m.add_response(x["x"], "X")
+
+        self.assertEqual(list(h1._results), ["X"])
+        self.assertEqual(list(h2._results), ["X"])
+
+        m.close()
+
+    def test_cancelled_primary(self):
+
+        m = jobs.JobManager(cache=cache.MemoryCache(),
+                            scheduler=scheduling.FairScheduler(), loop=None)
+
+        h1 = m.add_job_set(["x"])
+        h2 = m.add_job_set(["x"])
+
+        g1 = JobGetter()
+        m.get_job(g1.callback)
+        g2 = JobGetter()
+        m.get_job(g2.callback)
+
+        self.assertIsNone(g2._job)
+
+        h1.cancel()
+
+        self.assertEqual(g2._job.get_call(), "x")
+
+        m.add_response(g2._job, "X")
+
+        self.assertEqual(list(h2._results), ["X"])
+
+        m.close()
+
+
+class ListJobSource(jobs.JobSource):
+
+    def __init__(self, n):
+
+        self._next = 0
+        self._n = n
+        self.requests = []
+
+    def get_jobs(self, n):
+
+        self.requests.append(n)
+        new_jobs = list(range(self._next, min(self._next + n, self._n)))
+        self._next += len(new_jobs)
+        return new_jobs
+
+
+class FailingJobSource(jobs.JobSource):
+
+    def get_jobs(self, n):
+
+        raise RuntimeError("source failed")
+
+
+class TestAsyncJobSources(unittest.TestCase):
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+
+        self.loop.close()
+
+    def run_job_set(self, source, capacity=1):
+
+        async def run():
+            m = jobs.JobManager(loop=self.loop)
+            m.add_capacity(capacity)
+            handle = m.add_job_set(source)
+
+            def job_received(job):
+                self.loop.call_soon(m.add_result, job, job.get_call())
+                m.get_job(job_received)
+
+            for _ in range(capacity):
+                m.get_job(job_received)
+
+            results = [result async for result in handle.results()]
+            m.close()
+            return results
+
+        return self.loop.run_until_complete(run())
+
+    def test_async_generator(self):
+
+        async def generate():
+            for i in range(5):
+                await asyncio.sleep(0)
+                yield i
+
+        self.assertEqual(sorted(self.run_job_set(generate())), list(range(5)))
+
+    def test_empty_async_generator(self):
+
+        async def generate():
+            return
+            yield
+
+        self.assertEqual(self.run_job_set(generate()), [])
+
+    def test_chunked_source(self):
+
+        source = ListJobSource(10)
+
+        self.assertEqual(sorted(self.run_job_set(source, capacity=4)),
+                         list(range(10)))
+        self.assertLessEqual(max(source.requests), 4)
+
+    def test_iterable_source(self):
+
+        source = jobs.IterableJobSource(range(7))
+
+        self.assertEqual(sorted(self.run_job_set(source, capacity=3)),
+                         list(range(7)))
+
+    def test_failing_source(self):
+
+        logger = jobs.logger
+        logger.disabled = True
+        try:
+            self.assertEqual(self.run_job_set(FailingJobSource()), [])
+        finally:
+            logger.disabled = False
+
+
+class TestReduction(unittest.TestCase):
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+
+        self.loop.close()
+
+    def test_reduction(self):
+
+        r = jobs.Reduction(max, loop=None)
+
+        with self.assertRaises(TypeError):
+            r.value()
+
+        r.add(3)
+        r.add(5)
+        r.add(4)
+
+        self.assertEqual(r.value(), 5)
+        self.assertEqual(len(r), 3)
+
+    def test_map_reduce(self):
+
+        async def run():
+            m = jobs.JobManager(loop=self.loop)
+            m.add_capacity(2)
+            handle = m.add_reduction(range(10), "sum", initial=100)
+
+            def job_received(job):
+                self.assertIsInstance(job, jobs.ChunkJob)
+                self.assertEqual(job.reducer_name, "sum")
+                partial = sum(c * c for c in job.get_call())
+                self.loop.call_soon(m.add_response, job, partial)
+                m.get_job(job_received)
+
+            m.get_job(job_received)
+            m.get_job(job_received)
+
+            result = await handle.result()
+            m.close()
+            return result
+
+        result = self.loop.run_until_complete(run())
+
+        self.assertEqual(result, 100 + sum(i * i for i in range(10)))
+
+    def test_cancel(self):
+
+        async def run():
+            m = jobs.JobManager(loop=self.loop)
+            handle = m.add_reduction(range(10), "sum")
+            g = JobGetter()
+            m.get_job(g.callback)
+            m.add_response(g._job, 7)
+            handle.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await handle.result()
+
+            self.assertEqual(handle.partial_result(), 7)
+            m.close()
+
+        self.loop.run_until_complete(run())
+
+    def test_unknown_shared(self):
+
+        m = jobs.JobManager(loop=None)
+
+        with self.assertRaises(ValueError):
+            m.add_job_set(range(10), shared=["missing"])
+
+        m.close()
+
+    def test_check_shared(self):
+
+        m = jobs.JobManager(loop=None)
+        key = m.shared_objects().add("table")
+
+        self.assertEqual(m.check_shared([key]), (key,))
+        with self.assertRaises(ValueError):
+            m.check_shared([key, "missing"])
+
+        m.close()
+
+    def test_set_shared(self):
+
+        m = jobs.JobManager(loop=None)
+        key = m.shared_objects().add("table")
+        handle = m.add_job_set(range(10))
+        handle.set_shared([key])
+
+        self.assertEqual(handle._js.shared(), (key,))
+
+        with self.assertRaises(ValueError):
+            handle.set_shared(["missing"])
+
+        m.close()
+
+    def test_anonymous_reducer(self):
+
+        def local_add(a, b):
+            return a + b
+
+        m = jobs.JobManager(loop=None)
+
+        for reducer in (lambda a, b: a + b, local_add):
+            with self.assertRaises(ValueError):
+                m.add_reduction(range(10), reducer)
+            with self.assertRaises(ValueError):
+                reducers.reducer_table([reducer])
+
+        m.close()
+
+    def test_unknown_reducer(self):
+
+        m = jobs.JobManager(loop=None)
+
+        with self.assertRaises(ValueError):
+            m.add_reduction(range(10), "median")
+
+        m.close()
+
+
+class TestJobManagerSpeculative(unittest.TestCase):
+
+    def test_duplicate_straggler(self):
+
+        m = jobs.JobManager(speculative=True, loop=None)
+
+        handle = m.add_job_set(range(2))
+        results = handle._results
+
+        g1 = JobGetter()
+        m.get_job(g1.callback, worker="w1")
+        g2 = JobGetter()
+        m.get_job(g2.callback, worker="w2")
+        g3 = JobGetter()
+        m.get_job(g3.callback, worker="w3")
+
+        self.assertEqual(g1._job.get_call(), 0)
+        self.assertEqual(g2._job.get_call(), 1)
+        self.assertIs(g3._job, g1._job)
+
+        m.add_result(g3._job, "fast")
+        m.add_result(g1._job, "slow")
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0], "fast")
+
+        m.add_result(g2._job, "other")
+
+        self.assertEqual(len(results), 2)
+        self.assertTrue(results.is_complete())
+
+        m.close()
+
+    def test_no_duplicate_on_same_worker(self):
+
+        m = jobs.JobManager(speculative=True, loop=None)
+
+        m.add_job_set(range(1))
+
+        g1 = JobGetter()
+        m.get_job(g1.callback, worker="w1")
+        g2 = JobGetter()
+        m.get_job(g2.callback, worker="w1")
+
+        self.assertIsNotNone(g1._job)
+        self.assertIsNone(g2._job)
+
+        m.close()
+
+    def test_return_duplicate(self):
+
+        m = jobs.JobManager(speculative=True, loop=None)
+
+        handle = m.add_job_set(range(1))
+        results = handle._results
+
+        g1 = JobGetter()
+        m.get_job(g1.callback, worker="w1")
+        g2 = JobGetter()
+        m.get_job(g2.callback, worker="w2")
+
+        self.assertIs(g2._job, g1._job)
+
+        # one copy is lost, the other is still running
+        m.return_job(g1._job, worker="w1")
+
+        g3 = JobGetter()
+        m.get_job(g3.callback, worker="w3")
+
+        self.assertIs(g3._job, g1._job)
+
+        m.add_result(g2._job, "done")
+
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results.is_complete())
+
+        m.close()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,230 @@
+import os
+import tempfile
+import unittest
+
+import highfive.jobs as jobs
+import highfive.journal as journal
+
+
+class MockHandle:
+
+    def __init__(self):
+
+        self._cancelled = False
+
+    def cancel(self):
+
+        self._cancelled = True
+
+
+class MockLoop:
+
+    def __init__(self):
+
+        self._handles = []
+
+    def call_later(self, delay, callback):
+
+        handle = MockHandle()
+        self._handles.append((handle, callback))
+        return handle
+
+    def run_timers(self):
+
+        handles = self._handles
+        self._handles = []
+        for handle, callback in handles:
+            if not handle._cancelled:
+                callback()
+
+
+class JobGetter:
+
+    def __init__(self):
+
+        self._job = None
+
+    def callback(self, job):
+
+        self._job = job
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "journal.db")
+        self.loop = MockLoop()
+
+    def tearDown(self):
+
+        self.dir.cleanup()
+
+    def count_rows(self):
+
+        j = journal.Journal(self.path, loop=self.loop)
+        count = j._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        j.close()
+        return count
+
+    def test_batch_size(self):
+
+        j = journal.Journal(self.path, batch_size=3, loop=self.loop)
+        j.add_result("a", 0, "r0")
+        j.add_result("a", 1, "r1")
+
+        self.assertEqual(self.count_rows(), 0)
+
+        j.add_result("a", 2, "r2")
+
+        self.assertEqual(self.count_rows(), 3)
+
+        j.close()
+
+    def test_flush_interval(self):
+
+        j = journal.Journal(self.path, loop=self.loop)
+        j.add_result("a", 0, "r0")
+
+        self.assertEqual(self.count_rows(), 0)
+
+        self.loop.run_timers()
+
+        self.assertEqual(self.count_rows(), 1)
+
+        j.close()
+
+    def test_load(self):
+
+        j = journal.Journal(self.path, loop=self.loop)
+        j.add_result("a", 0, [1])
+        j.add_result("a", 2, [3])
+        j.add_result("b", 0, [4])
+        j.close()
+
+        j = journal.Journal(self.path, loop=self.loop)
+
+        self.assertEqual(j.load("a"), {0: [1], 2: [3]})
+
+        j.forget("a")
+
+        self.assertEqual(j.load("a"), {})
+        self.assertEqual(j.load("b"), {0: [4]})
+
+        j.close()
+
+    def test_unpicklable_result(self):
+
+        logger = journal.logger
+        logger.disabled = True
+        try:
+            j = journal.Journal(self.path, loop=self.loop)
+            j.add_result("a", 0, lambda: None)
+            j.add_result("a", 1, "r1")
+
+            self.assertEqual(j.load("a"), {1: "r1"})
+
+            j.close()
+        finally:
+            logger.disabled = False
+
+    def test_restart(self):
+
+        j = journal.Journal(self.path, loop=self.loop)
+        m = jobs.JobManager(journal=j, loop=None)
+        m.add_job_set(range(4), name="a")
+
+        getters = [JobGetter() for _ in range(3)]
+        for g in getters:
+            m.get_job(g.callback)
+        m.add_result(getters[0]._job, "r0")
+        m.add_result(getters[2]._job, "r2")
+
+        # crash with job 1 running and job 3 never started
+        m.close()
+
+        j = journal.Journal(self.path, loop=self.loop)
+        m = jobs.JobManager(journal=j, loop=None)
+        handle = m.add_job_set(range(4), name="a")
+        results = handle._results
+
+        self.assertEqual(list(results), ["r0", "r2"])
+
+        g1 = JobGetter()
+        m.get_job(g1.callback)
+        g2 = JobGetter()
+        m.get_job(g2.callback)
+        g3 = JobGetter()
+        m.get_job(g3.callback)
+
+        self.assertEqual(g1._job.get_call(), 1)
+        self.assertEqual(g2._job.get_call(), 3)
+        self.assertIsNone(g3._job)
+
+        m.add_result(g1._job, "r1")
+        m.add_result(g2._job, "r3")
+
+        self.assertTrue(results.is_complete())
+
+        m.close()
+
+    def test_duplicate_name(self):
+
+        m = jobs.JobManager(journal=journal.Journal(self.path, loop=self.loop),
+                            loop=None)
+        m.add_job_set(range(2), name="a")
+
+        with self.assertRaises(ValueError):
+            m.add_job_set(range(2), name="a")
+
+        m.close()
+
+    def test_invalid_options_keep_name(self):
+
+        m = jobs.JobManager(journal=journal.Journal(self.path, loop=self.loop),
+                            loop=None)
+
+        with self.assertRaises(ValueError):
+            m.add_job_set(range(2), name="a", weight=0)
+
+        # the name wasn't taken by the job set which failed to start
+        m.add_job_set(range(2), name="a")
+
+        m.close()
+
+    def test_failed_start_releases_name(self):
+
+        m = jobs.JobManager(journal=journal.Journal(self.path, loop=self.loop),
+                            loop=None)
+
+        with self.assertRaises(TypeError):
+            m.add_job_set(5, name="a")
+
+        m.add_job_set(range(2), name="a")
+
+        m.close()
+
+    def test_forget(self):
+
+        m = jobs.JobManager(journal=journal.Journal(self.path, loop=self.loop),
+                            loop=None)
+        m.add_job_set(range(1), name="a")
+        g = JobGetter()
+        m.get_job(g.callback)
+
+        with self.assertRaises(ValueError):
+            m.forget("a")
+
+        m.add_result(g._job, "r0")
+        m.forget("a")
+        handle = m.add_job_set(range(1), name="a")
+
+        # the job is run again rather than restored
+        self.assertEqual(list(handle._results), [])
+
+        m.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,833 @@
+import asyncio
+import unittest
+
+import highfive.compressors as compressors
+import highfive.jobs as jobs
+import highfive.master as master
+import highfive.protocol as protocol
+import highfive.tracing as tracing
+
+
+class MockTransport:
+
+    def __init__(self):
+
+        self._written = bytearray()
+        self._closed = False
+        self._paused = False
+
+    def write(self, data):
+
+        self._written.extend(data)
+
+    def writelines(self, data):
+
+        for d in data:
+            self.write(d)
+
+    def close(self):
+
+        self._closed = True
+
+    def pause_reading(self):
+
+        self._paused = True
+
+    def resume_reading(self):
+
+        self._paused = False
+
+    def abort(self):
+
+        self._closed = True
+
+    def get_extra_info(self, name):
+
+        return None
+
+
+class MockHandle:
+
+    def cancel(self):
+
+        pass
+
+
+class MockLoop:
+
+    def __init__(self):
+
+        self._now = 0
+        self._timers = []
+
+    def time(self):
+
+        return self._now
+
+    def call_later(self, delay, callback):
+
+        self._timers.append((self._now + delay, callback))
+        return MockHandle()
+
+    def call_soon(self, callback):
+
+        return self.call_later(0, callback)
+
+    def advance(self, seconds):
+
+        self._now += seconds
+        due = [t for t in self._timers if t[0] <= self._now]
+        self._timers = [t for t in self._timers if t[0] > self._now]
+        for _, callback in due:
+            callback()
+
+
+class MockWorker:
+
+    def __init__(self):
+
+        self._responses = []
+        self._timings = []
+        self._bytes = 0
+        self._frames = 0
+        self._pongs = []
+        self._slots = []
+
+    def bytes_received(self, n):
+
+        self._bytes += n
+
+    def frame_received(self, size, seconds=0):
+
+        self._frames += 1
+
+    def pong_received(self, ping_id):
+
+        self._pongs.append(ping_id)
+
+    def slots_changed(self, slots):
+
+        self._slots.append(slots)
+
+    def response_received(self, call_id, response, timing=None):
+
+        self._responses.append((call_id, response))
+        self._timings.append(timing)
+
+
+def make_protocol(codec="json"):
+
+    p = master.WorkerProtocol(None, None, loop=None)
+    p._transport = MockTransport()
+    p._buffer = bytearray()
+    p._scan_start = 0
+    p._codec = protocol.get_codec(codec)
+    p._worker = MockWorker()
+    return p
+
+
+def response_frame(responses, codec="json"):
+
+    codec = protocol.get_codec(codec)
+    items = []
+    payloads = []
+    for call_id, response in responses:
+        payload = protocol.byte_view(codec.encode(response))
+        items.append([call_id, len(payload)])
+        payloads.append(payload)
+    return b"".join(protocol.encode_frame({"responses": items}, payloads))
+
+
+class TestWorkerProtocolFraming(unittest.TestCase):
+
+    def test_one_frame(self):
+
+        p = make_protocol()
+        p.data_received(response_frame([(0, "a")]))
+
+        self.assertEqual(p._worker._responses, [(0, "a")])
+        self.assertEqual(len(p._buffer), 0)
+
+    def test_many_frames_one_chunk(self):
+
+        p = make_protocol()
+        p.data_received(response_frame([(0, "a")])
+                        + response_frame([(1, "b"), (2, "c")])
+                        + response_frame([(3, "d")]))
+
+        self.assertEqual(p._worker._responses,
+                         [(0, "a"), (1, "b"), (2, "c"), (3, "d")])
+        self.assertEqual(len(p._buffer), 0)
+
+    def test_frame_split_across_chunks(self):
+
+        p = make_protocol()
+        data = response_frame([(0, "abcdef")]) + response_frame([(1, "g")])
+        for i in range(len(data)):
+            p.data_received(data[i:i+1])
+
+        self.assertEqual(p._worker._responses, [(0, "abcdef"), (1, "g")])
+        self.assertEqual(len(p._buffer), 0)
+
+    def test_partial_frame_kept(self):
+
+        p = make_protocol()
+        second = response_frame([(1, "b")])
+        p.data_received(response_frame([(0, "a")]) + second[:5])
+
+        self.assertEqual(p._worker._responses, [(0, "a")])
+        self.assertEqual(bytes(p._buffer), second[:5])
+
+        p.data_received(second[5:])
+
+        self.assertEqual(p._worker._responses, [(0, "a"), (1, "b")])
+        self.assertEqual(len(p._buffer), 0)
+
+    def test_raw_codec(self):
+
+        p = make_protocol("raw")
+        p.data_received(response_frame([(0, b"\x00\n\xff"), (1, b"")], "raw"))
+
+        self.assertEqual(p._worker._responses, [(0, b"\x00\n\xff"), (1, b"")])
+
+    def test_timing(self):
+
+        p = make_protocol()
+        payload = protocol.JsonCodec().encode("a")
+        p.data_received(b"".join(protocol.encode_frame(
+                {"responses": [[0, len(payload), {"timing": [0.5, 2]}]]},
+                [payload])))
+
+        self.assertEqual(p._worker._responses, [(0, "a")])
+        self.assertEqual(p._worker._timings, [[0.5, 2]])
+
+    def test_compressed(self):
+
+        p = make_protocol()
+        p._compressor = compressors.get_compressor("zlib")
+        original = response_frame([(0, "a" * 100), (1, "b")])
+        frame = compressors.compress_frame(p._compressor, [original],
+                                           len(original))
+        p.data_received(b"".join(frame))
+
+        self.assertEqual(p._worker._responses, [(0, "a" * 100), (1, "b")])
+        self.assertEqual(len(p._buffer), 0)
+
+    def test_compressed_bad_size(self):
+
+        p = make_protocol()
+        p._compressor = compressors.get_compressor("zlib")
+        original = response_frame([(0, "a" * 100)])
+        frame = compressors.compress_frame(p._compressor, [original],
+                                           len(original) + 1)
+        p.data_received(b"".join(frame))
+
+        self.assertTrue(p._transport._closed)
+        self.assertEqual(p._worker._responses, [])
+
+    def test_compressed_offloaded(self):
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        p = make_protocol()
+        p._loop = loop
+        p._compressor = compressors.get_compressor("zlib")
+        large = "a" * compressors.OFFLOAD_BYTES
+        original = response_frame([(0, large)])
+        frame = compressors.compress_frame(p._compressor, [original],
+                                           len(original))
+        p.data_received(b"".join(frame) + response_frame([(1, "b")]))
+
+        # later frames wait for the large frame to be decompressed
+        self.assertTrue(p._transport._paused)
+        self.assertEqual(p._worker._responses, [])
+
+        async def wait():
+            while len(p._worker._responses) < 2:
+                await asyncio.sleep(0.001)
+        loop.run_until_complete(asyncio.wait_for(wait(), 5))
+
+        self.assertEqual(p._worker._responses, [(0, large), (1, "b")])
+        self.assertFalse(p._transport._paused)
+        self.assertEqual(len(p._buffer), 0)
+
+    def test_compressed_offloaded_error(self):
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        p = make_protocol()
+        p._loop = loop
+        p._compressor = compressors.get_compressor("zlib")
+        original = b"".join(protocol.encode_frame(
+                {"pong": "a" * compressors.OFFLOAD_BYTES}))
+        frame = compressors.compress_frame(p._compressor, [original],
+                                           len(original))
+
+        def fail(ping_id):
+            raise TypeError("bad ping ID")
+        p._worker.pong_received = fail
+
+        with self.assertLogs(master.logger, "ERROR"):
+            p.data_received(b"".join(frame))
+
+            async def wait():
+                while not p._transport._closed:
+                    await asyncio.sleep(0.001)
+            loop.run_until_complete(asyncio.wait_for(wait(), 5))
+
+        self.assertTrue(p._rejected)
+
+    def test_pong(self):
+
+        p = make_protocol()
+        p.data_received(b"".join(protocol.encode_frame({"pong": 3})))
+
+        self.assertEqual(p._worker._frames, 1)
+        self.assertEqual(p._worker._pongs, [3])
+        self.assertEqual(p._worker._responses, [])
+
+    def test_slots(self):
+
+        p = make_protocol()
+        p.data_received(b"".join(protocol.encode_frame({"slots": 0})))
+
+        self.assertEqual(p._worker._slots, [0])
+
+
+class TestWorkerProtocolHandshake(unittest.TestCase):
+
+    def make_protocol(self, codecs):
+
+        p = master.WorkerProtocol(None, None, codecs=codecs, loop=None)
+        p._transport = MockTransport()
+        p._buffer = bytearray()
+        p._scan_start = 0
+        return p
+
+    def test_no_common_codec(self):
+
+        p = self.make_protocol(("pickle",))
+        p.data_received(protocol.encode_line({"codecs": ["json", "raw"]}))
+
+        reply = protocol.decode_line(bytes(p._transport._written))
+        self.assertIn("error", reply)
+        self.assertTrue(p._transport._closed)
+        self.assertIsNone(p._worker)
+
+    def test_bad_slots(self):
+
+        p = self.make_protocol(("json",))
+        p.data_received(protocol.encode_line({"codecs": ["json"], "slots": 0}))
+
+        reply = protocol.decode_line(bytes(p._transport._written))
+        self.assertIn("error", reply)
+        self.assertTrue(p._transport._closed)
+        self.assertIsNone(p._worker)
+
+
+    def handshake(self, compression, accepted):
+
+        m = jobs.JobManager(loop=None)
+        p = master.WorkerProtocol(m, set(), codecs=("json",),
+                                  compression=compression, loop=MockLoop())
+        p.connection_made(MockTransport())
+        p.data_received(protocol.encode_line(
+                {"codecs": ["json"], "compression": accepted}))
+        reply = protocol.decode_line(bytes(p._transport._written))
+        m.close()
+        return reply
+
+    def test_compression(self):
+
+        reply = self.handshake(("lz4", "zlib"), ["zlib"])
+
+        self.assertEqual(reply["compression"], "zlib")
+        self.assertEqual(reply["compression_threshold"],
+                         compressors.DEFAULT_THRESHOLD)
+
+    def test_no_common_compressor(self):
+
+        reply = self.handshake(("zlib",), [])
+
+        self.assertNotIn("compression", reply)
+
+
+class TestWorkerHeartbeat(unittest.TestCase):
+
+    def make_worker(self, **options):
+
+        loop = MockLoop()
+        manager = jobs.JobManager(loop=None)
+        transport = MockTransport()
+        w = master.Worker(transport, manager,
+                          codec=protocol.get_codec("json"), loop=loop,
+                          **options)
+        return w, manager, transport, loop
+
+    def test_ping(self):
+
+        w, m, t, loop = self.make_worker(heartbeat_interval=5,
+                                         heartbeat_timeout=30)
+        loop.advance(5)
+
+        self.assertEqual(bytes(t._written),
+                         b"".join(protocol.encode_frame({"ping": 0})))
+        self.assertFalse(t._closed)
+
+        m.close()
+
+    def test_missed_heartbeats(self):
+
+        w, m, t, loop = self.make_worker(heartbeat_interval=5,
+                                         heartbeat_timeout=12)
+        for _ in range(2):
+            loop.advance(5)
+            w.frame_received(0)
+        loop.advance(5)
+
+        self.assertFalse(t._closed)
+
+        loop.advance(5)
+        loop.advance(5)
+
+        self.assertTrue(t._closed)
+        self.assertEqual(m.capacity(), 0)
+
+        m.close()
+
+    def test_job_timeout(self):
+
+        w, m, t, loop = self.make_worker()
+        m.add_job_set(range(1), job_timeout=2)
+
+        loop.advance(1)
+
+        self.assertFalse(t._closed)
+
+        loop.advance(1)
+        loop.advance(1)
+
+        self.assertTrue(t._closed)
+
+        # the job was returned to the manager, so another worker gets it
+        w2 = master.Worker(MockTransport(), m,
+                           codec=protocol.get_codec("json"), loop=loop)
+
+        self.assertEqual(len(w2._jobs), 1)
+
+        m.close()
+
+
+class TestWorkerClose(unittest.TestCase):
+
+    def test_requests_cancelled(self):
+
+        m = jobs.JobManager(loop=None)
+        loop = MockLoop()
+        for _ in range(3):
+            w = master.Worker(MockTransport(), m,
+                              codec=protocol.get_codec("json"), prefetch=400,
+                              loop=loop)
+            w.close()
+
+        self.assertEqual(m.stats()["queues"]["waiting_slots"], 0)
+        self.assertEqual(m.capacity(), 0)
+
+        w = master.Worker(MockTransport(), m,
+                          codec=protocol.get_codec("json"), prefetch=5,
+                          loop=loop)
+        handle = m.add_job_set(range(5))
+
+        self.assertEqual(len(w._jobs), 5)
+
+        for call_id in range(5):
+            w.response_received(call_id, call_id)
+
+        self.assertTrue(handle._js.is_done())
+
+        m.close()
+
+    def test_jobs_returned(self):
+
+        m = jobs.JobManager(loop=None)
+        loop = MockLoop()
+        m.add_job_set(range(4))
+        w1 = master.Worker(MockTransport(), m,
+                           codec=protocol.get_codec("json"), prefetch=2,
+                           loop=loop)
+        w2 = master.Worker(MockTransport(), m,
+                           codec=protocol.get_codec("json"), prefetch=4,
+                           loop=loop)
+
+        self.assertEqual((len(w1._jobs), len(w2._jobs)), (2, 2))
+
+        # the closed worker's jobs go to the worker still waiting for jobs
+        w1.close()
+
+        self.assertEqual(len(w2._jobs), 4)
+
+        m.close()
+
+
+class TestAdaptiveWorker(unittest.TestCase):
+
+    def test_window(self):
+
+        m = jobs.JobManager(loop=None)
+        m.add_job_set(range(100))
+        w = master.Worker(MockTransport(), m,
+                          codec=protocol.get_codec("json"), slots=2,
+                          prefetch=8, batch_size=16, adaptive=True,
+                          loop=MockLoop())
+
+        self.assertEqual(len(w._jobs), 16)
+
+        # 100 jobs per second with a 30ms round trip
+        w._busy_since = 0
+        w._measure(0.01, 0.03)
+
+        self.assertEqual(w._window, 5)
+        self.assertEqual(w._batch_size, 3)
+        self.assertEqual(m._speeds[w], (100, 0.02))
+
+        # the window is refilled only once calls drop below it
+        for call_id in range(12):
+            w.response_received(call_id, call_id)
+
+        self.assertEqual(len(w._jobs), 4)
+
+        w.response_received(12, 12)
+
+        self.assertEqual(len(w._jobs), w._window)
+
+        w.close()
+
+        self.assertNotIn(w, m._speeds)
+
+        m.close()
+
+    def test_window_limits(self):
+
+        m = jobs.JobManager(loop=None)
+        w = master.Worker(MockTransport(), m,
+                          codec=protocol.get_codec("json"), slots=2,
+                          prefetch=2, batch_size=4, adaptive=True,
+                          loop=MockLoop())
+
+        w._busy_since = 0
+        w._measure(0.001, 0.5)
+
+        self.assertEqual(w._window, 4)
+        self.assertEqual(w._batch_size, 4)
+
+        w._interval = 100
+        w._measure(0.001 + 100, 0.5)
+
+        self.assertEqual(w._window, 3)
+        self.assertEqual(w._batch_size, 1)
+
+        m.close()
+
+
+class TestWorkerSlots(unittest.TestCase):
+
+    def test_slots_changed(self):
+
+        m = jobs.JobManager(loop=None)
+        m.add_job_set(range(100))
+        w = master.Worker(MockTransport(), m,
+                          codec=protocol.get_codec("json"), slots=2,
+                          prefetch=4, batch_size=16, loop=MockLoop())
+
+        self.assertEqual(len(w._jobs), 8)
+        self.assertEqual(m.capacity(), 2)
+
+        w.slots_changed(3)
+
+        self.assertEqual(len(w._jobs), 12)
+        self.assertEqual(m.capacity(), 3)
+
+        # calls in flight beyond the window are left to finish
+        w.slots_changed(0)
+
+        self.assertEqual(len(w._jobs), 12)
+        self.assertEqual(m.capacity(), 0)
+
+        w.response_received(0, 0)
+
+        self.assertEqual(len(w._jobs), 11)
+
+        w.close()
+        m.close()
+
+    def test_no_slots_speed(self):
+
+        m = jobs.JobManager(loop=None)
+        m.add_job_set(range(100))
+        w = master.Worker(MockTransport(), m,
+                          codec=protocol.get_codec("json"), slots=2,
+                          prefetch=4, batch_size=16, adaptive=True,
+                          loop=MockLoop())
+
+        w._busy_since = 0
+        w._measure(0.01, 0.03)
+
+        self.assertIn(w, m._speeds)
+        self.assertEqual(m._total_throughput, 100)
+
+        # a worker with no slots doesn't count towards the others' speed,
+        # even while its calls in flight finish
+        w.slots_changed(0)
+
+        self.assertNotIn(w, m._speeds)
+        self.assertEqual(m._total_throughput, 0)
+
+        w.response_received(0, 0)
+
+        self.assertNotIn(w, m._speeds)
+
+        w.slots_changed(2)
+        w.response_received(1, 1)
+        w.response_received(2, 2)
+
+        self.assertIn(w, m._speeds)
+
+        w.close()
+        m.close()
+
+
+class TestWorkerBatching(unittest.TestCase):
+
+    def make_worker(self, job_list, **options):
+
+        m = jobs.JobManager(loop=None)
+        m.add_job_set(job_list)
+        t = MockTransport()
+        loop = MockLoop()
+        master.Worker(t, m, codec=protocol.get_codec("json"), prefetch=10,
+                      loop=loop, **options)
+        return m, t, loop
+
+    def batches(self, t):
+
+        return [len(f["calls"]) for f in read_frames(bytes(t._written))]
+
+    def test_batch_size(self):
+
+        m, t, loop = self.make_worker(range(10), batch_size=4)
+
+        self.assertEqual(self.batches(t), [4, 4])
+
+        # the partial batch is sent at the end of the loop iteration
+        loop.advance(0)
+
+        self.assertEqual(self.batches(t), [4, 4, 2])
+
+        m.close()
+
+    def test_batch_bytes(self):
+
+        m, t, loop = self.make_worker(["a" * 10] * 5, batch_size=100,
+                                      batch_bytes=30)
+
+        # each call is 12 bytes of JSON
+        self.assertEqual(self.batches(t), [3])
+
+        loop.advance(0)
+
+        self.assertEqual(self.batches(t), [3, 2])
+
+        m.close()
+
+    def test_batch_delay(self):
+
+        m, t, loop = self.make_worker(range(3), batch_size=100,
+                                      batch_delay=0.5)
+        loop.advance(0.4)
+
+        self.assertEqual(self.batches(t), [])
+
+        loop.advance(0.1)
+
+        self.assertEqual(self.batches(t), [3])
+
+        m.close()
+
+
+class TestWorkerChunks(unittest.TestCase):
+
+    def test_chunk_marked(self):
+
+        m = jobs.JobManager(loop=None)
+        m.add_job_set(range(3), chunk_duration=1)
+        t = MockTransport()
+        master.Worker(t, m, codec=protocol.get_codec("json"), loop=MockLoop())
+
+        data = bytes(t._written)
+        header_length, _ = protocol.FRAME_PREFIX.unpack_from(data)
+        header = protocol.decode_header(
+                data[protocol.FRAME_PREFIX.size:][:header_length])
+
+        self.assertEqual(header["calls"][0][2], {"chunk": True})
+
+        m.close()
+
+
+class TestWorkerReducers(unittest.TestCase):
+
+    def make_worker(self, reducers):
+
+        m = jobs.JobManager(loop=None)
+        handle = m.add_reduction(range(3), "sum", chunk_duration=1)
+        t = MockTransport()
+        w = master.Worker(t, m, codec=protocol.get_codec("json"),
+                          reducers=reducers, loop=MockLoop())
+        w._flush()
+        data = bytes(t._written)
+        header_length, _ = protocol.FRAME_PREFIX.unpack_from(data)
+        header = protocol.decode_header(
+                data[protocol.FRAME_PREFIX.size:][:header_length])
+        return m, w, handle, header["calls"][0]
+
+    def test_reduced_by_worker(self):
+
+        m, w, handle, entry = self.make_worker(frozenset(["sum"]))
+
+        self.assertEqual(entry[2], {"chunk": True, "reduce": "sum"})
+
+        w.response_received(0, 5)
+
+        self.assertEqual(handle.partial_result(), 5)
+
+        m.close()
+
+    def test_reduced_by_master(self):
+
+        m, w, handle, entry = self.make_worker(frozenset())
+
+        self.assertEqual(entry[2], {"chunk": True})
+
+        w.response_received(0, [2, 3])
+
+        self.assertEqual(handle.partial_result(), 5)
+
+        m.close()
+
+
+def read_frames(data):
+
+    frames = []
+    while len(data) > 0:
+        header_length, body_length = protocol.FRAME_PREFIX.unpack_from(data)
+        start = protocol.FRAME_PREFIX.size
+        frames.append(protocol.decode_header(
+                data[start:start+header_length]))
+        data = data[start+header_length+body_length:]
+    return frames
+
+
+class TestWorkerShared(unittest.TestCase):
+
+    def make_worker(self, jobs_by_key, **options):
+
+        m = jobs.JobManager(loop=None)
+        keys = [m.shared_objects().add(obj) for obj in jobs_by_key]
+        for key in keys:
+            m.add_job_set([key] * 2, shared=[key])
+        t = MockTransport()
+        w = master.Worker(t, m, codec=protocol.get_codec("json"), prefetch=2,
+                          loop=MockLoop(), **options)
+        w._flush()
+        return m, w, t, keys
+
+    def test_sent_once(self):
+
+        m, w, t, keys = self.make_worker(["table"], shared_bytes=100)
+        frames = read_frames(bytes(t._written))
+
+        self.assertEqual([f["shared"][0][0] for f in frames if "shared" in f],
+                         keys)
+        self.assertEqual(sum(len(f.get("calls", [])) for f in frames), 2)
+
+        m.close()
+
+    def test_already_held(self):
+
+        key = jobs.JobManager(loop=None).shared_objects().add("table")
+        m, w, t, keys = self.make_worker(["table"], shared_bytes=100,
+                                         shared_keys={key: 7})
+        frames = read_frames(bytes(t._written))
+
+        self.assertFalse(any("shared" in f for f in frames))
+
+        m.close()
+
+    def test_drop_least_recently_used(self):
+
+        m, w, t, keys = self.make_worker(["a" * 10, "b" * 10],
+                                         shared_bytes=15)
+
+        # the first job set's calls are in flight, so nothing can be dropped
+        self.assertEqual(set(w._shared), {keys[0]})
+
+        t._written.clear()
+        w.response_received(0, 0)
+        w.response_received(1, 1)
+        w._flush()
+        frames = read_frames(bytes(t._written))
+
+        self.assertEqual(frames[0]["shared"][0][0], keys[1])
+        self.assertEqual(frames[0]["drop"], [keys[0]])
+        self.assertEqual(list(w._shared), [keys[1]])
+
+        m.close()
+
+
+class RecordingHooks(tracing.Hooks):
+
+    def __init__(self):
+
+        self.events = []
+
+    def on_dispatch(self, trace):
+
+        self.events.append(("dispatch", trace.call_id))
+
+    def on_response(self, trace):
+
+        self.events.append(("response", trace.call_id))
+
+    def on_result(self, trace, result):
+
+        self.events.append(("result", trace.call_id, result))
+
+
+class TestWorkerHooks(unittest.TestCase):
+
+    def test_hooks(self):
+
+        hooks = RecordingHooks()
+        loop = MockLoop()
+        m = jobs.JobManager(loop=None)
+        m.add_job_set(["a"])
+        w = master.Worker(MockTransport(), m,
+                          codec=protocol.get_codec("json"), hooks=(hooks,),
+                          loop=loop)
+        trace = w._traces[0]
+        w._flush()
+        w.response_received(0, "A", [0.25, 1.5])
+
+        self.assertEqual(hooks.events, [("dispatch", 0), ("response", 0),
+                                        ("result", 0, "A")])
+        self.assertEqual(trace.queued_seconds, 0.25)
+        self.assertEqual(trace.run_seconds, 1.5)
+        self.assertLessEqual(trace.dispatched, trace.encoded)
+        self.assertLessEqual(trace.encoded, trace.sent)
+        self.assertLessEqual(trace.sent, trace.received)
+        self.assertLessEqual(trace.received, trace.completed)
+
+        m.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+
+import highfive.jobs as jobs
+import highfive.metrics as metrics
+
+
+class JobGetter:
+
+    def __init__(self):
+
+        self._job = None
+
+    def callback(self, job):
+
+        self._job = job
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_buckets(self):
+
+        h = metrics.Histogram((1, 2, 5))
+        for value in (0.5, 1, 1.5, 3, 10):
+            h.observe(value)
+
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.sum, 16)
+        self.assertEqual(h.buckets(),
+                         [(1, 2), (2, 3), (5, 4), (float("inf"), 5)])
+
+    def test_quantile(self):
+
+        h = metrics.Histogram((1, 2, 5))
+
+        self.assertIsNone(h.quantile(0.5))
+
+        for value in (0.5, 0.5, 1.5, 3):
+            h.observe(value)
+
+        self.assertEqual(h.quantile(0.5), 1)
+        self.assertEqual(h.quantile(0.99), 5)
+
+
+class TestManagerStats(unittest.TestCase):
+
+    def test_counts(self):
+
+        m = jobs.JobManager(loop=None)
+        m.add_capacity(2)
+        m.add_job_set(range(3))
+
+        g1 = JobGetter()
+        m.get_job(g1.callback)
+        g2 = JobGetter()
+        m.get_job(g2.callback)
+        m.add_result(g1._job, 0)
+        m.return_job(g2._job)
+
+        stats = m.stats()
+
+        self.assertEqual(stats["jobs"]["dispatched"], 2)
+        self.assertEqual(stats["jobs"]["completed"], 1)
+        self.assertEqual(stats["jobs"]["returned"], 1)
+        self.assertEqual(stats["queues"]["returned_jobs"], 1)
+        self.assertEqual(stats["queues"]["job_sets"], 1)
+        self.assertEqual(stats["capacity"], 2)
+
+        m.close()
+
+    def test_prometheus_text(self):
+
+        m = jobs.JobManager(loop=None)
+        m.metrics().latency.observe(0.002)
+        stats = m.stats()
+        stats["workers"] = [{"id": 1, "utilization": 0.5,
+                             "idle_seconds": 2}]
+
+        text = metrics.prometheus_text(stats)
+
+        self.assertIn("highfive_jobs_dispatched_total 0.0\n", text)
+        self.assertIn('highfive_job_latency_seconds_bucket{le="0.0025"} 1\n',
+                      text)
+        self.assertIn('highfive_job_latency_seconds_bucket{le="+Inf"} 1\n',
+                      text)
+        self.assertIn('highfive_worker_utilization{worker="1"} 0.5\n', text)
+
+        m.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+
+import highfive.protocol as protocol
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestCodecs(unittest.TestCase):
+
+    def round_trip(self, codec, obj):
+
+        codec = protocol.get_codec(codec)
+        encoded = protocol.byte_view(codec.encode(obj))
+        return codec.decode(memoryview(bytes(encoded)))
+
+    def test_json(self):
+
+        obj = {"a": [1, 2.5, None, "x"]}
+        self.assertEqual(self.round_trip("json", obj), obj)
+
+    def test_pickle(self):
+
+        obj = {"a": (1, 2), "b": {3, 4}, "c": b"\x00"}
+        self.assertEqual(self.round_trip("pickle", obj), obj)
+
+    def test_raw(self):
+
+        self.assertEqual(self.round_trip("raw", b"\x00\x01\n"), b"\x00\x01\n")
+        self.assertEqual(self.round_trip("raw", bytearray(b"ab")), b"ab")
+
+    def test_raw_no_copy(self):
+
+        data = bytearray(b"abc")
+        encoded = protocol.byte_view(protocol.get_codec("raw").encode(data))
+        data[0] = ord("x")
+        self.assertEqual(bytes(encoded), b"xbc")
+
+    def test_unknown(self):
+
+        with self.assertRaises(ValueError):
+            protocol.get_codec("nope")
+
+    def test_choose(self):
+
+        codec = protocol.choose_codec(("pickle", "json"), ["json", "pickle"])
+        self.assertEqual(codec.name, "pickle")
+
+        codec = protocol.choose_codec(("pickle",), ["json", "raw"])
+        self.assertIsNone(codec)
+
+
+class TestFrames(unittest.TestCase):
+
+    def test_encode_split(self):
+
+        payloads = [b"abc", b"", b"de"]
+        items = [[i, len(p)] for i, p in enumerate(payloads)]
+        frame = b"".join(protocol.encode_frame({"calls": items}, payloads))
+
+        header_length, body_length = protocol.FRAME_PREFIX.unpack_from(frame)
+        self.assertEqual(len(frame),
+                protocol.FRAME_PREFIX.size + header_length + body_length)
+
+        header_start = protocol.FRAME_PREFIX.size
+        body_start = header_start + header_length
+        header = protocol.decode_header(frame[header_start:body_start])
+        body = memoryview(frame)[body_start:]
+
+        split = [(item[0], bytes(payload)) for item, payload
+                 in protocol.split_payloads(header["calls"], body)]
+        self.assertEqual(split, [(0, b"abc"), (1, b""), (2, b"de")])
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestArrayPayloads(unittest.TestCase):
+
+    def round_trip(self, obj, *, copy=True):
+
+        codec = protocol.get_codec("json")
+        payload, extras = protocol.encode_payload(codec, obj)
+        entry = protocol.payload_entry(0, payload, extras)
+        return protocol.decode_payload(codec, entry,
+                                       memoryview(bytes(payload)), copy=copy)
+
+    def test_float64(self):
+
+        array = numpy.linspace(0, 1, 12).reshape(3, 4)
+        decoded = self.round_trip(array)
+
+        self.assertEqual(decoded.dtype, array.dtype)
+        self.assertEqual(decoded.shape, (3, 4))
+        self.assertTrue((decoded == array).all())
+
+    def test_no_copy_on_send(self):
+
+        array = numpy.arange(4, dtype=numpy.int32)
+        payload, _ = protocol.encode_payload(protocol.get_codec("json"), array)
+        array[0] = 7
+
+        self.assertEqual(len(payload), array.nbytes)
+        self.assertEqual(numpy.frombuffer(payload, dtype=numpy.int32)[0], 7)
+
+    def test_non_contiguous(self):
+
+        array = numpy.arange(12).reshape(3, 4).T
+        decoded = self.round_trip(array)
+
+        self.assertTrue((decoded == array).all())
+
+    def test_scalar_and_empty(self):
+
+        self.assertEqual(self.round_trip(numpy.array(2.5)), 2.5)
+        self.assertEqual(self.round_trip(numpy.zeros((0, 3))).shape, (0, 3))
+
+    def test_no_copy_read_only(self):
+
+        decoded = self.round_trip(numpy.arange(3.0), copy=False)
+
+        self.assertFalse(decoded.flags.writeable)
+
+    def test_object_array_uses_codec(self):
+
+        codec = protocol.get_codec("pickle")
+        array = numpy.array([{}, None], dtype=object)
+        payload, extras = protocol.encode_payload(codec, array)
+
+        self.assertIsNone(extras)
+
+
+if __name__ == "__main__":
+    unittest.main()
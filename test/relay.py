@@ -0,0 +1,99 @@
+import asyncio
+import operator
+import socket
+import unittest
+
+import highfive.master as master
+import highfive.relay as relay
+import highfive.worker as worker
+
+
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def double(call):
+
+    return call * 2
+
+
+class TestRelayCall(unittest.TestCase):
+
+    def run_call(self, calls, **options):
+
+        responses = []
+        call = relay.RelayCall(7, calls, lambda *r: responses.append(r),
+                               **options)
+        for job in reversed(call.jobs):
+            self.assertEqual(responses, [])
+            self.assertIsNone(job.get_result(job.get_call() * 2))
+        return responses
+
+    def test_call(self):
+
+        self.assertEqual(self.run_call([3]), [(7, 6)])
+
+    def test_chunk(self):
+
+        self.assertEqual(self.run_call([1, 2, 3], chunk=True),
+                         [(7, [2, 4, 6])])
+
+    def test_reduced_chunk(self):
+
+        self.assertEqual(self.run_call([1, 2, 3], chunk=True,
+                                       reducer=operator.add),
+                         [(7, 12)])
+
+
+class TestRelay(unittest.TestCase):
+
+    def test_tree(self):
+
+        upstream_port = free_port()
+        port = free_port()
+
+        async def test():
+            loop = asyncio.get_running_loop()
+            m = await master.start_master(host="localhost",
+                                          port=upstream_port,
+                                          heartbeat_interval=None,
+                                          heartbeat_timeout=None)
+            relay_node = await relay.start_relay("localhost", upstream_port,
+                                                 "localhost", port,
+                                                 reconnect_delay=0.01,
+                                                 heartbeat_interval=None,
+                                                 heartbeat_timeout=None)
+            task = loop.create_task(worker.handle_jobs(
+                    double, "localhost", port, concurrency=2,
+                    reconnect_delay=0.01, loop=loop))
+            try:
+                # the relay tells the master about its worker's slots
+                while m.capacity() < 2:
+                    await asyncio.sleep(0.01)
+
+                async with m.run(range(20)) as js:
+                    results = [r async for r in js.results()]
+                async with m.run(range(20), chunk_duration=1) as js:
+                    chunked = [r async for r in js.results()]
+                total = await m.map_reduce(range(20), "sum",
+                                           chunk_duration=1).result()
+                stats = relay_node.stats()
+            finally:
+                task.cancel()
+                relay_node.close()
+                await relay_node.wait_closed()
+                m.close()
+                await m.wait_closed()
+            return results, chunked, total, stats
+
+        results, chunked, total, stats = asyncio.run(
+                asyncio.wait_for(test(), 10))
+
+        self.assertEqual(results, [call * 2 for call in range(20)])
+        self.assertEqual(chunked, [call * 2 for call in range(20)])
+        self.assertEqual(total, 2 * sum(range(20)))
+        self.assertTrue(stats["upstream"]["connected"])
+        self.assertEqual(stats["upstream"]["slots"], 2)
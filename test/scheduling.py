@@ -0,0 +1,172 @@
+import collections
+import unittest
+
+import highfive.jobs as jobs
+import highfive.scheduling as scheduling
+
+
+class MockJobSet:
+
+    def __init__(self, n_jobs):
+
+        self._n_jobs = n_jobs
+
+    def job_available(self):
+
+        return self._n_jobs > 0
+
+    def take(self):
+
+        self._n_jobs -= 1
+
+
+def take_jobs(scheduler, n):
+
+    taken = []
+    for _ in range(n):
+        js = scheduler.next_job_set()
+        if js is None:
+            break
+        js.take()
+        taken.append(js)
+    return taken
+
+
+class TestFifoScheduler(unittest.TestCase):
+
+    def test_order(self):
+
+        s = scheduling.FifoScheduler()
+        js1 = MockJobSet(2)
+        js2 = MockJobSet(2)
+        s.add(js1)
+        s.add(js2)
+
+        self.assertEqual(take_jobs(s, 5), [js1, js1])
+
+        s.remove(js1)
+
+        self.assertEqual(take_jobs(s, 5), [js2, js2])
+
+    def test_priority(self):
+
+        s = scheduling.FifoScheduler()
+        js1 = MockJobSet(1)
+        js2 = MockJobSet(1)
+        s.add(js1)
+        s.add(js2, priority=1)
+
+        self.assertEqual(take_jobs(s, 5), [js2])
+
+
+class TestFairScheduler(unittest.TestCase):
+
+    def test_fills_idle_capacity(self):
+
+        s = scheduling.FairScheduler()
+        js1 = MockJobSet(1)
+        js2 = MockJobSet(3)
+        s.add(js1)
+        s.add(js2)
+
+        taken = take_jobs(s, 10)
+
+        self.assertEqual(taken.count(js1), 1)
+        self.assertEqual(taken.count(js2), 3)
+
+    def test_round_robin(self):
+
+        s = scheduling.FairScheduler()
+        js1 = MockJobSet(100)
+        js2 = MockJobSet(100)
+        s.add(js1)
+        s.add(js2)
+
+        self.assertEqual(take_jobs(s, 4), [js1, js2, js1, js2])
+
+    def test_weights(self):
+
+        s = scheduling.FairScheduler()
+        js1 = MockJobSet(1000)
+        js2 = MockJobSet(1000)
+        js3 = MockJobSet(1000)
+        s.add(js1, weight=3)
+        s.add(js2, weight=1)
+        s.add(js3, weight=0.5)
+
+        counts = collections.Counter(take_jobs(s, 900))
+
+        self.assertEqual(counts[js1], 600)
+        self.assertEqual(counts[js2], 200)
+        self.assertEqual(counts[js3], 100)
+
+    def test_priority(self):
+
+        s = scheduling.FairScheduler()
+        low = MockJobSet(2)
+        high = MockJobSet(2)
+        s.add(low)
+        s.add(high, priority=1)
+
+        self.assertEqual(take_jobs(s, 10), [high, high, low, low])
+
+    def test_remove(self):
+
+        s = scheduling.FairScheduler()
+        js1 = MockJobSet(100)
+        js2 = MockJobSet(100)
+        s.add(js1)
+        s.add(js2)
+        take_jobs(s, 1)
+        s.remove(js1)
+        s.remove(js1)
+
+        self.assertEqual(take_jobs(s, 2), [js2, js2])
+        self.assertEqual(s.job_sets(), [js2])
+
+    def test_bad_weight(self):
+
+        s = scheduling.FairScheduler()
+
+        with self.assertRaises(ValueError):
+            s.add(MockJobSet(1), weight=0)
+
+
+class JobGetter:
+
+    def __init__(self):
+        self._job = None
+
+    def callback(self, job):
+        self._job = job
+
+
+class TestJobManagerFair(unittest.TestCase):
+
+    def test_2_js_concurrent(self):
+
+        m = jobs.JobManager(scheduler=scheduling.FairScheduler(), loop=None)
+
+        js1 = m.add_job_set(range(1))
+        js2 = m.add_job_set(range(10, 11))
+
+        g1 = JobGetter()
+        m.get_job(g1.callback)
+        g2 = JobGetter()
+        m.get_job(g2.callback)
+        g3 = JobGetter()
+        m.get_job(g3.callback)
+
+        self.assertEqual(g1._job.get_call(), 0)
+        self.assertEqual(g2._job.get_call(), 10)
+        self.assertIsNone(g3._job)
+
+        js3 = m.add_job_set(range(20, 21), priority=1)
+
+        self.assertEqual(g3._job.get_call(), 20)
+
+        m.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
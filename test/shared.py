@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+
+import highfive.protocol as protocol
+import highfive.shared as shared
+
+
+def send(objects, store, key, codec):
+
+    payload, extras = objects.encoded(key, codec)
+    entry = protocol.payload_entry(key, payload, extras)
+    store.add(key, codec, entry, payload)
+
+
+class TestSharedObjects(unittest.TestCase):
+
+    def test_same_content(self):
+
+        objects = shared.SharedObjects()
+        key = objects.add({"a": [1, 2]})
+
+        self.assertEqual(objects.add({"a": [1, 2]}), key)
+        self.assertNotEqual(objects.add({"a": [1, 3]}), key)
+        self.assertIn(key, objects)
+
+    def test_remove(self):
+
+        objects = shared.SharedObjects()
+        key = objects.add("table")
+        objects.encoded(key, protocol.get_codec("json"))
+        objects.remove(key)
+
+        self.assertNotIn(key, objects)
+        with self.assertRaises(KeyError):
+            objects.encoded(key, protocol.get_codec("json"))
+
+    def test_given_key(self):
+
+        objects = shared.SharedObjects()
+        key = "0" * 64
+
+        self.assertEqual(objects.add("table", key), key)
+        with self.assertRaises(ValueError):
+            objects.add("table", "../table")
+
+
+class TestSharedStore(unittest.TestCase):
+
+    def test_in_memory(self):
+
+        objects = shared.SharedObjects()
+        key = objects.add([1, 2, 3])
+        store = shared.SharedStore()
+        send(objects, store, key, protocol.get_codec("json"))
+
+        self.assertEqual(store.get(key), [1, 2, 3])
+        self.assertEqual(store.keys(), {})
+
+        store.drop(key)
+        with self.assertRaises(KeyError):
+            store.get(key)
+
+    def test_directory(self):
+
+        objects = shared.SharedObjects()
+        key = objects.add([1, 2, 3])
+        with tempfile.TemporaryDirectory() as directory:
+            store = shared.SharedStore(directory)
+            send(objects, store, key, protocol.get_codec("json"))
+            store.drop(key)
+
+            self.assertEqual(list(store.keys()), [key])
+            self.assertEqual(store.get(key), [1, 2, 3])
+
+            other = shared.SharedStore(directory)
+            self.assertEqual(other.get(key), [1, 2, 3])
+
+    def test_get_shared(self):
+
+        objects = shared.SharedObjects()
+        key = objects.add("table")
+        store = shared.SharedStore()
+        send(objects, store, key, protocol.get_codec("json"))
+
+        with self.assertRaises(KeyError):
+            shared.get_shared(key)
+
+        shared.register_store(store)
+        try:
+            self.assertEqual(shared.get_shared(key), "table")
+        finally:
+            shared.unregister_store(store)
+
+    def test_invalid_key(self):
+
+        codec = protocol.get_codec("json")
+        payload = protocol.byte_view(codec.encode("data"))
+        with tempfile.TemporaryDirectory() as parent:
+            directory = os.path.join(parent, "shared")
+            os.mkdir(directory)
+            store = shared.SharedStore(directory)
+            for key in ("../escape", "A" * 64, "0" * 63):
+                with self.assertRaises(ValueError):
+                    store.add(key, codec, [key, len(payload)], payload)
+                with self.assertRaises(KeyError):
+                    store.get(key)
+
+            self.assertEqual(os.listdir(parent), ["shared"])
+            self.assertEqual(os.listdir(directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
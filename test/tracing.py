@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import unittest
+
+import highfive.tracing as tracing
+
+
+def make_trace(call_id, worker, start, run_seconds=None):
+
+    trace = tracing.JobTrace(None, call_id, worker)
+    trace.dispatched = start
+    trace.encoded = start + 1
+    trace.sent = start + 2
+    trace.received = start + 6
+    trace.completed = start + 7
+    if run_seconds is not None:
+        trace.queued_seconds = 1
+        trace.run_seconds = run_seconds
+    return trace
+
+
+class TestChromeTrace(unittest.TestCase):
+
+    def test_empty(self):
+
+        self.assertEqual(tracing.ChromeTrace(None).events(), [])
+
+    def test_spans(self):
+
+        t = tracing.ChromeTrace(None)
+        t.on_result(make_trace(0, "w", 10, run_seconds=2), None)
+
+        spans = {e["name"]: (e["ts"], e["dur"]) for e in t.events()
+                 if e["ph"] == "X"}
+
+        self.assertEqual(spans["call 0"], (0, 7e6))
+        self.assertEqual(spans["get_call"], (0, 1e6))
+        self.assertEqual(spans["batching"], (1e6, 1e6))
+        self.assertEqual(spans["transit"], (2e6, 1e6))
+        self.assertEqual(spans["queued"], (3e6, 1e6))
+        self.assertEqual(spans["run"], (4e6, 2e6))
+        self.assertEqual(spans["get_result"], (6e6, 1e6))
+
+    def test_lanes(self):
+
+        t = tracing.ChromeTrace(None)
+        t.on_result(make_trace(0, "w", 0), None)
+        t.on_result(make_trace(1, "w", 3), None)
+        t.on_result(make_trace(2, "w", 7), None)
+        t.on_result(make_trace(3, "v", 0), None)
+
+        tids = {e["name"]: e["tid"] for e in t.events()
+                if e["name"].startswith("call")}
+
+        self.assertEqual(tids["call 0"], tids["call 2"])
+        self.assertNotEqual(tids["call 0"], tids["call 1"])
+        self.assertNotEqual(tids["call 0"], tids["call 3"])
+
+    def test_job_dropped(self):
+
+        trace = make_trace(0, "w", 0)
+        trace.job = object()
+        t = tracing.ChromeTrace(None)
+        t.on_result(trace, None)
+
+        self.assertIsNotNone(trace.job)
+        self.assertIsNone(t._traces[0].job)
+        self.assertEqual(t._traces[0].completed, 7)
+
+    def test_write(self):
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "trace.json")
+            t = tracing.ChromeTrace(path)
+            t.on_result(make_trace(0, "w", 0), None)
+            t.write()
+
+            with open(path) as f:
+                data = json.load(f)
+
+        self.assertIn("traceEvents", data)
+
+
+if __name__ == "__main__":
+    unittest.main()
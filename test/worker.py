@@ -0,0 +1,368 @@
+import asyncio
+import multiprocessing
+import operator
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import highfive.master as master
+import highfive.protocol as protocol
+import highfive.worker as worker
+
+
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def double(call):
+
+    return call * 2
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_growth(self):
+
+        backoff = worker.Backoff(1, 10)
+        for limit in (1, 2, 4, 8, 10, 10):
+            delay = backoff.next_delay()
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, limit)
+
+    def test_reset(self):
+
+        backoff = worker.Backoff(1, 1000)
+        for _ in range(10):
+            backoff.next_delay()
+        backoff.reset()
+
+        self.assertLessEqual(backoff.next_delay(), 1)
+
+
+def fail_on_odd(call):
+
+    if call % 2 == 1:
+        raise ValueError("odd call")
+    return call
+
+
+async def async_double(call):
+
+    await asyncio.sleep(0)
+    return call * 2
+
+
+async def async_fail(call):
+
+    raise ValueError("async failure")
+
+
+def run_calls(handler, calls, **options):
+    """
+    Runs calls with a CallRunner until every response arrives or the runner
+    fails, returning the responses by call ID and whether it failed.
+    """
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        responses = dict()
+
+        def respond(call_id, response, timing):
+            responses[call_id] = response
+            if len(responses) == len(calls) and not done.done():
+                done.set_result(False)
+
+        def fail():
+            if not done.done():
+                done.set_result(True)
+
+        runner = worker.CallRunner(handler, respond, fail, loop=loop,
+                                   **options)
+        try:
+            for call_id, call in enumerate(calls):
+                runner.submit(call_id, call)
+            failed = await asyncio.wait_for(done, 10)
+        finally:
+            runner.close()
+        return responses, failed
+
+    return asyncio.run(run())
+
+
+class TestCallRunner(unittest.TestCase):
+
+    def test_modes(self):
+
+        chunk = worker.Chunk([3, 4])
+        reduced = worker.Chunk([5, 6])
+        reduced.reducer = operator.add
+        calls = [1, 2, chunk, reduced]
+        expected = {0: 2, 1: 4, 2: [6, 8], 3: 22}
+
+        for executor in ("inline", "thread", "process"):
+            responses, failed = run_calls(double, calls, executor=executor,
+                                          concurrency=2)
+            self.assertEqual(responses, expected)
+            self.assertFalse(failed)
+
+        responses, failed = run_calls(async_double, calls, concurrency=2)
+        self.assertEqual(responses, expected)
+        self.assertFalse(failed)
+
+    def test_failure(self):
+
+        for executor in ("thread", "process"):
+            responses, failed = run_calls(fail_on_odd, [0, 1],
+                                          executor=executor)
+            self.assertTrue(failed)
+
+        responses, failed = run_calls(async_fail, [0])
+        self.assertTrue(failed)
+
+    def test_async_concurrency(self):
+
+        running = [0, 0]
+
+        async def sleep(call):
+            running[0] += 1
+            running[1] = max(running)
+            await asyncio.sleep(0.05)
+            running[0] -= 1
+            return call
+
+        started = time.perf_counter()
+        responses, failed = run_calls(sleep, list(range(12)), concurrency=3)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(len(responses), 12)
+        self.assertEqual(running[1], 3)
+        self.assertLess(elapsed, 12 * 0.05 / 3 * 1.5)
+
+    def test_bad_concurrency(self):
+
+        with self.assertRaises(ValueError):
+            worker.CallRunner(double, None, None, concurrency=0, loop=None)
+
+    def test_inline_failure(self):
+
+        responses = []
+        failures = []
+        runner = worker.CallRunner(
+                fail_on_odd, lambda *r: responses.append(r[:2]),
+                lambda: failures.append(True), executor="inline", loop=None)
+        runner.submit(0, 2)
+        runner.submit(1, 3)
+
+        self.assertEqual(responses, [(0, 2)])
+        self.assertEqual(failures, [True])
+
+        runner.close()
+
+    def test_backlog_spread(self):
+
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def sleep(call):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return call
+
+        async def test():
+            loop = asyncio.get_running_loop()
+            done = loop.create_future()
+            responses = []
+
+            def respond(call_id, response, timing):
+                responses.append(call_id)
+                if len(responses) == 32:
+                    done.set_result(None)
+
+            runner = worker.CallRunner(sleep, respond, done.cancel,
+                                       executor="thread", concurrency=4,
+                                       loop=loop)
+            started = time.perf_counter()
+            for call_id in range(32):
+                runner.submit(call_id, call_id)
+            await asyncio.wait_for(done, 5)
+            elapsed = time.perf_counter() - started
+            runner.close()
+            return elapsed
+
+        elapsed = asyncio.run(test())
+
+        # a slot which frees up shares the waiting calls with the others
+        # rather than taking all of them
+        self.assertEqual(running[1], 4)
+        self.assertLess(elapsed, 32 * 0.05 / 4 * 1.5)
+
+
+class TestReconnect(unittest.TestCase):
+
+    def test_master_restart(self):
+
+        port = free_port()
+
+        async def run_master():
+            m = await master.start_master(host="localhost", port=port,
+                                          heartbeat_interval=None,
+                                          heartbeat_timeout=None)
+            async with m.run(range(5)) as js:
+                results = [r async for r in js.results()]
+            m.close()
+            await m.wait_closed()
+            return results
+
+        async def test():
+            loop = asyncio.get_running_loop()
+            task = loop.create_task(worker.handle_jobs(
+                    double, "localhost", port, reconnect_delay=0.01,
+                    max_reconnect_delay=0.05, loop=loop))
+            try:
+                # the worker starts before the master, then outlives it
+                await asyncio.sleep(0.1)
+                first = await asyncio.wait_for(run_master(), 5)
+                second = await asyncio.wait_for(run_master(), 5)
+            finally:
+                task.cancel()
+            return first, second
+
+        first, second = asyncio.run(test())
+
+        self.assertEqual(first, [0, 2, 4, 6, 8])
+        self.assertEqual(second, [0, 2, 4, 6, 8])
+
+    def test_handler_failure(self):
+
+        port = free_port()
+        failed = []
+
+        def fail_once(call):
+            if call == 3 and len(failed) == 0:
+                failed.append(call)
+                raise ValueError("first try")
+            return call * 2
+
+        async def test():
+            loop = asyncio.get_running_loop()
+            m = await master.start_master(host="localhost", port=port,
+                                          heartbeat_interval=None,
+                                          heartbeat_timeout=None)
+            task = loop.create_task(worker.handle_jobs(
+                    fail_once, "localhost", port, executor="inline",
+                    reconnect_delay=0.01, max_reconnect_delay=0.05,
+                    loop=loop))
+            try:
+                # the worker disconnects, then reconnects and runs the call
+                # it dropped
+                async with m.run(range(5)) as js:
+                    results = [r async for r in js.results(ordered=True)]
+            finally:
+                task.cancel()
+                m.close()
+                await m.wait_closed()
+            return results
+
+        results = asyncio.run(asyncio.wait_for(test(), 5))
+
+        self.assertEqual(failed, [3])
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+
+
+class TestSharedKeys(unittest.TestCase):
+
+    def test_invalid_key(self):
+
+        port = free_port()
+        key = "../escape"
+
+        async def serve(reader, writer):
+            await reader.readuntil(b"\n")
+            writer.write(protocol.encode_line({"codec": "json"}))
+            payload = protocol.byte_view(b'"data"')
+            writer.writelines(protocol.encode_frame(
+                    {"shared": [[key, len(payload)]]}, [payload]))
+            # the worker disconnects rather than storing the object
+            self.assertEqual(await reader.read(), b"")
+            writer.close()
+
+        async def test(directory):
+            loop = asyncio.get_running_loop()
+            server = await asyncio.start_server(serve, "localhost", port)
+            try:
+                await asyncio.wait_for(worker.handle_jobs(
+                        double, "localhost", port, shared_dir=directory,
+                        reconnect=False, loop=loop), 5)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        with tempfile.TemporaryDirectory() as parent:
+            directory = os.path.join(parent, "shared")
+            os.mkdir(directory)
+            asyncio.run(test(directory))
+
+            self.assertEqual(os.listdir(parent), ["shared"])
+            self.assertEqual(os.listdir(directory), [])
+
+
+class TestSupervise(unittest.TestCase):
+
+    def start_exiting(self, starts, code=1):
+
+        def start_process():
+            p = multiprocessing.Process(target=sys.exit, args=(code,))
+            p.start()
+            starts.append(p)
+            return p
+
+        return start_process
+
+    def test_no_respawn(self):
+
+        starts = []
+        worker.supervise(self.start_exiting(starts), 2, respawn=False)
+
+        self.assertEqual(len(starts), 2)
+        self.assertTrue(all(p.exitcode == 1 for p in starts))
+
+    def test_respawn(self):
+
+        starts = []
+        start_exiting = self.start_exiting(starts)
+
+        def start_process():
+            if len(starts) == 5:
+                raise KeyboardInterrupt
+            return start_exiting()
+
+        with self.assertRaises(KeyboardInterrupt):
+            worker.supervise(start_process, 2, restart_delay=0.01,
+                             max_restart_delay=0.05)
+
+        self.assertEqual(len(starts), 5)
+
+    def test_clean_exit(self):
+
+        starts = []
+        worker.supervise(self.start_exiting(starts, 0), 2,
+                         restart_delay=0.01, max_restart_delay=0.05)
+
+        # processes which exit cleanly aren't restarted
+        self.assertEqual(len(starts), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()